@@ -0,0 +1,78 @@
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+import asyncio
+import json
+import time
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model that answers from predefined scripts instead of calling an API. Each script maps a user question
+    to its steps: a list of tool calls as (tool name, args) pairs, or the final answer as a string.
+    The step is chosen from the number of agent messages since the question, so one model serves
+    any number of concurrent sessions.
+    """
+
+    scripts: dict
+    # Simulated model response time in seconds
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _next_message(self, messages) -> AIMessage:
+        question_index = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=None)
+        if question_index is None or messages[question_index].content not in self.scripts:
+            return AIMessage(content="There is no script for this question.")
+        steps = self.scripts[messages[question_index].content]
+        step = sum(isinstance(message, AIMessage) for message in messages[question_index + 1:])
+        entry = steps[min(step, len(steps) - 1)]
+        if isinstance(entry, str):
+            return AIMessage(content=entry)
+        return AIMessage(content="", tool_calls=[
+            {"name": name, "args": args, "id": f"call_{step}_{i}", "type": "tool_call"}
+            for i, (name, args) in enumerate(entry)
+        ])
+
+    def _chunks(self, message: AIMessage):
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ]))
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == len(words) - 1 else word + " "))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        yield from self._chunks(self._next_message(messages))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self._next_message(messages)):
+            yield chunk
+
+
+def install_fake_llm(scripts: dict, latency: float = 0.0) -> ScriptedChatModel:
+    """
+    Replaces the agent's module-level llm, and the model brain_node calls, with a ScriptedChatModel.
+    """
+    from pages.graph import nodes
+
+    fake_llm = ScriptedChatModel(scripts=scripts, latency=latency)
+    nodes.llm = fake_llm
+    nodes.model = nodes.get_chat_template() | fake_llm.bind(tools=[convert_to_openai_tool(tool) for tool in nodes.tools])
+    return fake_llm
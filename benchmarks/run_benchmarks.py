@@ -0,0 +1,449 @@
+"""
+Offline end-to-end benchmarks. The agent's LLM is replaced by a scripted model (see fake_llm.py), so runs need
+no network or API key and measure only this project's code: schema loading, the graph's nodes, SQL and Python
+tools, figure handoff and a Streamlit script round trip, against chinook.db and copies with 100x and 1000x
+the sales rows. Results are written as JSON; pass an earlier result as --baseline to compare.
+
+Usage:
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --scales 1 100 --iterations 10 --sessions 1 8 --output results.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/results/previous.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmarks with a scripted LLM.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 100, 1000],
+                        help="Row multipliers for the sales tables of chinook.db")
+    parser.add_argument("--scenarios", nargs="+", default=None, help="Scenario names (default: all)")
+    parser.add_argument("--iterations", type=int, default=5, help="Measured runs per scenario and scale")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 8],
+                        help="Numbers of concurrent sessions for the throughput benchmark")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated model response time in seconds")
+    parser.add_argument("--sql-cache", action="store_true", help="Keep the SQL result cache enabled")
+    parser.add_argument("--skip-streamlit", action="store_true", help="Skip the Streamlit round trip benchmark")
+    parser.add_argument("--output", default=None, help="Result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--baseline", default=None, help="Earlier result file to compare against")
+    parser.add_argument("--regression-threshold", type=float, default=0.2,
+                        help="Relative p50 slowdown versus the baseline reported as a regression")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """
+    Settings applied before the app's modules are imported, since they read their configuration at import.
+    """
+    # The scripted model replaces the real one, but the OpenAI client is still constructed at import
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ["LLM_CACHE_MODE"] = "off"
+    os.environ["SQL_CACHE_ENABLED"] = "true" if args.sql_cache else "false"
+    # Keep checkpoints and offloaded sessions out of the app's own store
+    os.environ["SESSION_STORE_DIR"] = tempfile.mkdtemp(prefix="benchmark_sessions_")
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pick(0.5),
+        "p90": pick(0.9),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+def peak_rss_mb() -> dict:
+    """
+    Peak resident memory of this process and of its live children (the Python kernel workers).
+    """
+    # ru_maxrss is in kilobytes on Linux
+    server = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = 0.0
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        workers += int(line.split()[1]) / 1024
+        except OSError:
+            continue
+    return {"server": round(server, 1), "python_workers": round(workers, 1)}
+
+
+def git_revision() -> dict:
+    def run(*command):
+        try:
+            return subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+
+    return {"commit": run("git", "rev-parse", "HEAD"), "dirty": bool(run("git", "status", "--porcelain", "--untracked-files=no"))}
+
+
+def make_node_timer():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class NodeTimer(BaseCallbackHandler):
+        """
+        Records the duration of every graph node run, keyed by node name.
+        """
+        run_inline = True
+
+        def __init__(self):
+            self.samples = defaultdict(list)
+            self._roots = set()
+            self._starts = {}
+            self._lock = threading.Lock()
+
+        def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+            with self._lock:
+                if parent_run_id is None:
+                    self._roots.add(run_id)
+                elif parent_run_id in self._roots and (metadata or {}).get("langgraph_node"):
+                    self._starts[run_id] = (metadata["langgraph_node"], time.perf_counter())
+
+        def on_chain_end(self, outputs, *, run_id, **kwargs):
+            with self._lock:
+                self._roots.discard(run_id)
+                started = self._starts.pop(run_id, None)
+                if started:
+                    self.samples[started[0]].append(time.perf_counter() - started[1])
+
+        def on_chain_error(self, error, *, run_id, **kwargs):
+            with self._lock:
+                self._roots.discard(run_id)
+                self._starts.pop(run_id, None)
+
+    return NodeTimer()
+
+
+def make_chatbot_class(node_timer):
+    from pages.backend import PythonChatBot
+
+    class InstrumentedChatBot(PythonChatBot):
+        @property
+        def _config(self):
+            return {**super()._config, "callbacks": [node_timer]}
+
+    return InstrumentedChatBot
+
+
+class RunRecorder:
+    """
+    Collects per-run measurements: end-to-end time, time to the first streamed token and each tool call's duration.
+    """
+
+    def __init__(self):
+        self.end_to_end = []
+        self.first_token = []
+        self.tools = defaultdict(list)
+        self.figure_handoff = []
+        self._lock = threading.Lock()
+
+    def record(self, start, first_token_at, tool_timings):
+        with self._lock:
+            self.end_to_end.append(time.perf_counter() - start)
+            if first_token_at is not None:
+                self.first_token.append(first_token_at - start)
+            for name, seconds in tool_timings:
+                self.tools[name].append(seconds)
+
+    def handle_event(self, event, tool_timings):
+        if event["type"] == "tool_end" and event["timing"]:
+            tool_timings.append((event["name"], event["timing"]["duration_seconds"]))
+
+
+def run_once(chatbot, question, input_data, recorder):
+    start = time.perf_counter()
+    first_token_at = None
+    tool_timings = []
+    for event in chatbot.stream_graph_events(question, input_data):
+        if event["type"] == "token" and first_token_at is None:
+            first_token_at = time.perf_counter()
+        recorder.handle_event(event, tool_timings)
+    recorder.record(start, first_token_at, tool_timings)
+
+
+async def arun_once(chatbot, question, input_data, recorder):
+    start = time.perf_counter()
+    first_token_at = None
+    tool_timings = []
+    async for event in chatbot.astream_graph_events(question, input_data):
+        if event["type"] == "token" and first_token_at is None:
+            first_token_at = time.perf_counter()
+        recorder.handle_event(event, tool_timings)
+    recorder.record(start, first_token_at, tool_timings)
+
+
+def hand_off_figures(chatbot, recorder):
+    """
+    Fetches the last turn's figures from the registry and serializes them the way st.plotly_chart does.
+    """
+    from pages.graph.figure_registry import get_figure, discard_figures
+
+    figure_ids = chatbot.output_figure_ids.get(len(chatbot.chat_history) - 1, [])
+    if not figure_ids:
+        return
+    start = time.perf_counter()
+    for figure_id in figure_ids:
+        figure = get_figure(figure_id)
+        if figure is not None:
+            json.dumps(figure.to_plotly_json(), default=str)
+    recorder.figure_handoff.append(time.perf_counter() - start)
+    discard_figures(figure_ids)
+
+
+def benchmark_schema_load(engine, repeats: int = 5) -> dict:
+    """
+    Times the schema summary on a cold cache (reflection plus index build) and a warm one.
+    """
+    from pages.graph.schema import invalidate_schema_cache
+    from pages.graph.schema_index import get_schema_index
+
+    cold, warm = [], []
+    for _ in range(repeats):
+        invalidate_schema_cache(engine)
+        start = time.perf_counter()
+        get_schema_index(engine)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        get_schema_index(engine)
+        warm.append(time.perf_counter() - start)
+    return {"cold": percentiles(cold), "warm": percentiles(warm)}
+
+
+def benchmark_scenarios(chatbot_class, node_timer, scenarios, input_data, iterations) -> dict:
+    results = {}
+    for name, scenario in scenarios.items():
+        chatbot = chatbot_class()
+        # One unmeasured run starts the session's Python worker and warms the schema cache
+        run_once(chatbot, scenario["question"], input_data, RunRecorder())
+        chatbot.reset_chat()
+        node_timer.samples.clear()
+
+        recorder = RunRecorder()
+        for _ in range(iterations):
+            run_once(chatbot, scenario["question"], input_data, recorder)
+            hand_off_figures(chatbot, recorder)
+            chatbot.reset_chat()
+        results[name] = {
+            "end_to_end": percentiles(recorder.end_to_end),
+            "first_token": percentiles(recorder.first_token),
+            "nodes": {node: percentiles(samples) for node, samples in node_timer.samples.items()},
+            "tools": {tool: percentiles(samples) for tool, samples in recorder.tools.items()},
+            "figure_handoff": percentiles(recorder.figure_handoff),
+        }
+    return results
+
+
+def benchmark_concurrency(chatbot_class, scenarios, input_data, sessions, iterations) -> dict:
+    """
+    Runs the scenario mix in `sessions` concurrent chats, with threads (as the Streamlit server does)
+    and with asyncio, and reports throughput and run latency.
+    """
+    questions = [scenario["question"] for scenario in scenarios.values()]
+
+    def thread_session(chatbot):
+        recorder = RunRecorder()
+        for i in range(iterations):
+            run_once(chatbot, questions[i % len(questions)], input_data, recorder)
+        return recorder
+
+    async def async_session(chatbot):
+        recorder = RunRecorder()
+        for i in range(iterations):
+            await arun_once(chatbot, questions[i % len(questions)], input_data, recorder)
+        return recorder
+
+    async def run_async(chatbots):
+        return await asyncio.gather(*(async_session(chatbot) for chatbot in chatbots))
+
+    results = {}
+    for mode in ("threads", "asyncio"):
+        results[mode] = {}
+        for count in sessions:
+            chatbots = [chatbot_class() for _ in range(count)]
+            start = time.perf_counter()
+            if mode == "threads":
+                with ThreadPoolExecutor(max_workers=count) as pool:
+                    recorders = list(pool.map(thread_session, chatbots))
+            else:
+                recorders = asyncio.run(run_async(chatbots))
+            wall = time.perf_counter() - start
+            runs = [seconds for recorder in recorders for seconds in recorder.end_to_end]
+            results[mode][str(count)] = {
+                "runs": len(runs),
+                "wall_seconds": wall,
+                "runs_per_second": len(runs) / wall if wall else 0.0,
+                "end_to_end": percentiles(runs),
+            }
+            for chatbot in chatbots:
+                chatbot.reset_chat()
+    return results
+
+
+def benchmark_streamlit(db_uri: str, question: str, iterations: int) -> dict:
+    """
+    Drives pages/frontend.py with Streamlit's AppTest: a chat message submitted and the page rendered with the
+    reply and figures, then a plain rerun that redraws the history.
+    """
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError as e:
+        return {"skipped": f"streamlit.testing is not available: {e}"}
+    # Outside `streamlit run` each call warns that there is no script context
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "pages", "frontend.py"), default_timeout=300)
+    app.session_state["connection_status"] = True
+    app.session_state["db_uri"] = db_uri
+    app.session_state["db_type"] = "SQLite"
+    app.run()
+    if app.exception:
+        return {"skipped": f"frontend raised: {app.exception[0].message}"}
+
+    submit, rerender = [], []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        app.chat_input[0].set_value(question).run()
+        submit.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        app.run()
+        rerender.append(time.perf_counter() - start)
+    if app.exception:
+        return {"skipped": f"frontend raised: {app.exception[0].message}"}
+    return {"submit_round_trip": percentiles(submit), "rerender": percentiles(rerender)}
+
+
+def flatten_p50(results: dict, prefix: str = "") -> dict:
+    """
+    Maps each measured metric's path to its median, for comparing two result files.
+    """
+    flat = {}
+    for key, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        path = f"{prefix}/{key}" if prefix else key
+        if "p50" in value:
+            flat[path] = value["p50"]
+        else:
+            flat.update(flatten_p50(value, path))
+    return flat
+
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints the p50 change of every metric present in both results and returns those slower by more than threshold.
+    """
+    current, previous = flatten_p50(results["benchmarks"]), flatten_p50(baseline["benchmarks"])
+    regressions = []
+    print(f"\nComparison with {baseline['meta']['git'].get('commit', '')[:12] or 'baseline'} (p50 seconds):")
+    for path in sorted(current.keys() & previous.keys()):
+        before, after = previous[path], current[path]
+        change = (after - before) / before if before else 0.0
+        marker = "  REGRESSION" if change > threshold else ""
+        print(f"  {path:<80} {before:>10.4f} -> {after:>10.4f} ({change:+.1%}){marker}")
+        if change > threshold:
+            regressions.append(path)
+    return regressions
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    configure_environment(args)
+
+    from benchmarks.fake_llm import install_fake_llm
+    from benchmarks.scenarios import SCENARIOS, scenario_scripts
+    from benchmarks.synthetic_db import build_scaled_db, table_row_counts
+    from pages.graph.db_utils import get_engine_for_uri
+
+    scenarios = {name: scenario for name, scenario in SCENARIOS.items() if not args.scenarios or name in args.scenarios}
+    install_fake_llm(scenario_scripts(scenarios), latency=args.llm_latency)
+    node_timer = make_node_timer()
+    chatbot_class = make_chatbot_class(node_timer)
+
+    benchmarks = {}
+    for scale in args.scales:
+        print(f"Scale {scale}x: preparing database...", flush=True)
+        db_path = build_scaled_db(scale)
+        input_data = {"db_uri": f"sqlite:///{db_path}", "db_type": "SQLite"}
+        engine = get_engine_for_uri(input_data["db_uri"])
+
+        print(f"Scale {scale}x: schema, scenarios and concurrency...", flush=True)
+        benchmarks[f"scale_{scale}x"] = {
+            "rows": table_row_counts(db_path),
+            "schema_load": benchmark_schema_load(engine),
+            "scenarios": benchmark_scenarios(chatbot_class, node_timer, scenarios, input_data, args.iterations),
+            "concurrency": benchmark_concurrency(chatbot_class, scenarios, input_data, args.sessions, args.iterations),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    if not args.skip_streamlit:
+        print("Streamlit round trip...", flush=True)
+        # Prefer a scenario with a figure, so the page's chart rendering is included
+        scenario = scenarios.get("sql_python_figure") or next(iter(scenarios.values()))
+        question = scenario["question"]
+        benchmarks["streamlit"] = benchmark_streamlit(f"sqlite:///{build_scaled_db(1)}", question, args.iterations)
+
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "benchmarks": benchmarks,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = results["meta"]["git"]["commit"][:12] or "nogit"
+        output = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.regression_threshold)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.regression_threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
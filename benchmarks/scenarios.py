@@ -0,0 +1,89 @@
+from pages.graph.tools import query_id_for
+
+COUNT_ARTISTS_SQL = "SELECT COUNT(*) AS artist_count FROM Artist"
+SALES_BY_COUNTRY_SQL = (
+    "SELECT BillingCountry, COUNT(*) AS invoices, SUM(Total) AS revenue "
+    "FROM Invoice GROUP BY BillingCountry ORDER BY revenue DESC"
+)
+INVOICE_LINES_SQL = "SELECT InvoiceLineId, InvoiceId, TrackId, UnitPrice, Quantity FROM InvoiceLine"
+GENRE_REVENUE_SQL = (
+    "SELECT g.Name AS genre, SUM(il.UnitPrice * il.Quantity) AS revenue "
+    "FROM InvoiceLine il JOIN Track t ON t.TrackId = il.TrackId JOIN Genre g ON g.GenreId = t.GenreId "
+    "GROUP BY g.Name ORDER BY revenue DESC"
+)
+INVOICE_TOTALS_SQL = "SELECT InvoiceId, InvoiceDate, Total FROM Invoice"
+
+
+def _sql(thought: str, sql_query: str):
+    return ("make_sql_query", {"thought": thought, "sql_query": sql_query})
+
+
+def _python(thought: str, python_code: str):
+    return ("complete_python_task", {"thought": thought, "python_code": python_code})
+
+
+# Each scenario is a user question and the steps the scripted model takes to answer it (see ScriptedChatModel)
+SCENARIOS = {
+    "sql_only": {
+        "question": "How many artists are in the database?",
+        "steps": [
+            [_sql("Count the artists.", COUNT_ARTISTS_SQL)],
+            "There are 275 artists in the database.",
+        ],
+    },
+    "sql_python_figure": {
+        "question": "Show revenue by billing country as a bar chart.",
+        "steps": [
+            [_sql("Aggregate revenue per country.", SALES_BY_COUNTRY_SQL)],
+            [_python("Plot revenue per country.", (
+                f"df = get_dataframe('{query_id_for(SALES_BY_COUNTRY_SQL)}')\n"
+                "fig = px.bar(df, x='BillingCountry', y='revenue')\n"
+                "plotly_figures.append(fig)\n"
+                "print(df.head())"
+            ))],
+            "The USA has the highest revenue, followed by Canada and France.",
+        ],
+    },
+    "large_scan": {
+        "question": "Summarize all invoice lines.",
+        "steps": [
+            [_sql("Fetch every invoice line.", INVOICE_LINES_SQL)],
+            [_python("Summarize the invoice lines.", (
+                f"lines = get_dataframe('{query_id_for(INVOICE_LINES_SQL)}')\n"
+                "lines['amount'] = lines['UnitPrice'] * lines['Quantity']\n"
+                "print(len(lines), lines['amount'].sum())\n"
+                "print(lines.groupby('TrackId')['amount'].sum().nlargest(5))"
+            ))],
+            "Invoice lines are summarized above.",
+        ],
+    },
+    "parallel_tools_scatter": {
+        "question": "Which genres earn the most, and how are invoice totals spread over time?",
+        "steps": [
+            [
+                ("describe_tables", {"thought": "Check the genre tables.", "table_names": ["Genre", "MediaType"]}),
+                _sql("Revenue per genre.", GENRE_REVENUE_SQL),
+                _sql("Every invoice total with its date.", INVOICE_TOTALS_SQL),
+            ],
+            [_python("Plot invoice totals over time.", (
+                f"totals = get_dataframe('{query_id_for(INVOICE_TOTALS_SQL)}')\n"
+                f"genres = get_dataframe('{query_id_for(GENRE_REVENUE_SQL)}')\n"
+                "plotly_figures.append(px.scatter(totals, x='InvoiceDate', y='Total'))\n"
+                "plotly_figures.append(px.bar(genres, x='genre', y='revenue'))\n"
+                "print(genres.head())"
+            ))],
+            "Rock earns the most; invoice totals are spread evenly over time.",
+        ],
+    },
+}
+
+
+def scenario_scripts(names=None) -> dict:
+    """
+    Returns the scripts for ScriptedChatModel, keyed by question.
+    """
+    return {
+        scenario["question"]: scenario["steps"]
+        for name, scenario in SCENARIOS.items()
+        if names is None or name in names
+    }
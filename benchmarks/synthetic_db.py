@@ -0,0 +1,71 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+CHINOOK_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "chinook.db")
+BENCHMARK_DB_DIR = os.getenv("BENCHMARK_DB_DIR", os.path.join(tempfile.gettempdir(), "agent_benchmarks"))
+
+# Sales tables copied scale - 1 times, with primary keys offset per copy and each copied
+# invoice line pointing at its own copied invoice. The catalog and customer tables keep their size.
+SCALED_TABLES = {
+    "Invoice": ("InvoiceId", {}),
+    "InvoiceLine": ("InvoiceLineId", {"InvoiceId": "Invoice"}),
+}
+
+
+def _scale_table(connection, table: str, key: str, foreign_keys: dict, scale: int, max_ids: dict):
+    columns = [row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')]
+    selected = []
+    for column in columns:
+        if column == key:
+            selected.append(f'"{column}" + copy * {max_ids[table]}')
+        elif column in foreign_keys:
+            selected.append(f'"{column}" + copy * {max_ids[foreign_keys[column]]}')
+        else:
+            selected.append(f'"{column}"')
+    connection.execute(f"""
+        WITH RECURSIVE copies(copy) AS (SELECT 1 UNION ALL SELECT copy + 1 FROM copies WHERE copy < {scale - 1})
+        INSERT INTO "{table}" ({", ".join(f'"{column}"' for column in columns)})
+        SELECT {", ".join(selected)} FROM "{table}", copies WHERE "{key}" <= {max_ids[table]}
+    """)
+
+
+def build_scaled_db(scale: int, path: str = None) -> str:
+    """
+    Returns the path of a copy of chinook.db whose sales tables have scale times as many rows,
+    building it on first use. Scale 1 is the original database.
+    """
+    if scale <= 1:
+        return os.path.abspath(CHINOOK_PATH)
+    path = path or os.path.join(BENCHMARK_DB_DIR, f"chinook_x{scale}.db")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Build under a temporary name so an interrupted build is never reused
+    tmp_path = path + ".building"
+    shutil.copyfile(CHINOOK_PATH, tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        max_ids = {
+            table: connection.execute(f'SELECT MAX("{key}") FROM "{table}"').fetchone()[0]
+            for table, (key, _) in SCALED_TABLES.items()
+        }
+        with connection:
+            for table, (key, foreign_keys) in SCALED_TABLES.items():
+                _scale_table(connection, table, key, foreign_keys, scale, max_ids)
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def table_row_counts(path: str) -> dict:
+    connection = sqlite3.connect(path)
+    try:
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return {table: connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        connection.close()
@@ -1,83 +1,358 @@
 # Third-party imports
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
-import json
+import threading
+import time
+import uuid
+import weakref
 # Local imports
 from pages.graph.state import AgentState
+from pages.graph.compaction import trim_intermediate_outputs
+from pages.graph.sessions import get_checkpointer, SESSION_IDLE_TIMEOUT, SESSION_SWEEP_INTERVAL
+from pages.graph.python_executor import offload_idle_workers, prestart_workers
+from pages.graph.startup import STARTUP_WARMUP, timed_phase
+from pages.graph.workspaces import offload_idle_workspaces
+from pages.graph.figure_registry import discard_figures
+from pages.graph.tracing import traced_node, start_metrics_server
 from pages.graph.nodes import (
     brain_node,
+    abrain_node,
+    get_model,
     tool_node,
     route_to_tools,
     handle_tool_output,
-    get_table_schema
+    tool_output_from_message,
+    get_table_schema,
+    aget_table_schema
 )
 
+# Chatbots in this process, so the conversations of idle ones can be dropped from memory
+_live_chatbots = weakref.WeakSet()
+_sweeper_started = False
+_sweeper_lock = threading.Lock()
+# The compiled graph is shared by every chatbot; conversations are kept apart by the thread id in each call's config
+_compiled_graph = None
+_graph_lock = threading.Lock()
+_warm_up_started = False
+
+
+def build_graph(checkpointer=None):
+    builder =  StateGraph(AgentState)
+    # Nodes with both sync and async implementations serve invoke/stream and ainvoke/astream alike.
+    # Each node is traced: wall time plus the LLM, SQL and Python metrics recorded while it runs.
+    builder.add_node('get_table_schema', traced_node('get_table_schema', RunnableLambda(get_table_schema, afunc=aget_table_schema)))
+    builder.add_node('agent', traced_node('agent', RunnableLambda(brain_node, afunc=abrain_node)))
+    builder.add_node('tools', traced_node('tools', tool_node))
+    builder.add_node('handle_tool_output', traced_node('handle_tool_output', handle_tool_output))
+
+    builder.add_edge('get_table_schema', 'agent')
+    builder.add_conditional_edges('agent', route_to_tools)
+    builder.add_edge('tools', 'handle_tool_output')
+    builder.add_edge('handle_tool_output', 'agent')
+
+    builder.set_entry_point('get_table_schema')
+
+    return builder.compile(checkpointer=checkpointer)
+
+
+def get_compiled_graph():
+    """
+    Returns the process-wide compiled graph, compiling it on first use.
+    """
+    global _compiled_graph
+    with _graph_lock:
+        if _compiled_graph is None:
+            with timed_phase("compile_graph"):
+                _compiled_graph = build_graph(get_checkpointer())
+    return _compiled_graph
+
+
+def warm_up():
+    """
+    Creates the process-wide resources a first question needs: the compiled graph, the LLM client and a
+    standby Python worker with the analysis libraries imported.
+    """
+    with timed_phase("warm_up"):
+        get_compiled_graph()
+        get_model()
+        with timed_phase("prestart_python_workers"):
+            prestart_workers()
+
+
+def start_warm_up():
+    """
+    Runs warm_up once per process in a background thread, so the page renders without waiting for it.
+    """
+    global _warm_up_started
+    with _graph_lock:
+        if _warm_up_started or not STARTUP_WARMUP:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, daemon=True, name="warm-up").start()
+
+
+def offload_idle_sessions(max_idle: float = None) -> dict:
+    """
+    Frees the memory held by sessions idle for more than max_idle seconds. Conversations are dropped and
+    reloaded from their checkpoint on the next access; Python variables are saved to disk and restored
+    on the session's next Python task. Returns the number of each offloaded.
+    """
+    return {
+        "chats": sum(chatbot.offload_if_idle(max_idle) for chatbot in list(_live_chatbots)),
+        "python_workers": offload_idle_workers(max_idle),
+        "workspaces": offload_idle_workspaces(max_idle),
+    }
+
+
+def _sweep_idle_sessions():
+    while True:
+        time.sleep(SESSION_SWEEP_INTERVAL)
+        try:
+            offload_idle_sessions()
+        except Exception:
+            continue
+
+
+def _start_session_sweeper():
+    global _sweeper_started
+    with _sweeper_lock:
+        if not _sweeper_started:
+            threading.Thread(target=_sweep_idle_sessions, daemon=True, name="session-sweeper").start()
+            _sweeper_started = True
 
 
 class PythonChatBot:
-    def __init__(self):
+    def __init__(self, session_id: str = None):
         super().__init__()
-        self.reset_chat()   
-        self.graph = self.build_graph()
-    
-    def invoke_graph(self, user_query, input_data):
-        starting_image_paths_set = set(sum(self.output_image_paths.values(), []))
-        # Clear intermediate outputs before each new graph execution
-        input_state = {
-            "messages": self.chat_history + [HumanMessage(content=user_query)],
-            "input_data": input_data,
-            "intermediate_outputs": self.intermediate_outputs
+        # Identifies this chat's Python worker and other per-session resources, and its checkpoint thread.
+        # Passing the id of an earlier session resumes it from its checkpoint.
+        self.session_id = session_id or str(uuid.uuid4())
+        self.checkpointer = get_checkpointer()
+        self.graph = get_compiled_graph()
+        self.last_used = time.monotonic()
+        self._running = False
+        # With a checkpointer the conversation is loaded lazily; without one it starts empty
+        self._chat_history = None if self.checkpointer else []
+        self._intermediate_outputs = []
+        self._output_figure_ids = {}
+        _live_chatbots.add(self)
+        _start_session_sweeper()
+        start_metrics_server()
+
+    @property
+    def _config(self):
+        return {"configurable": {"thread_id": self.session_id}, "recursion_limit": 15}
+
+    @property
+    def chat_history(self):
+        self._ensure_loaded()
+        return self._chat_history
+
+    @chat_history.setter
+    def chat_history(self, value):
+        self._chat_history = value
+
+    @property
+    def intermediate_outputs(self):
+        self._ensure_loaded()
+        return self._intermediate_outputs
+
+    @intermediate_outputs.setter
+    def intermediate_outputs(self, value):
+        self._intermediate_outputs = value
+
+    @property
+    def output_figure_ids(self):
+        self._ensure_loaded()
+        return self._output_figure_ids
+
+    @output_figure_ids.setter
+    def output_figure_ids(self, value):
+        self._output_figure_ids = value
+
+    def _ensure_loaded(self):
+        self.last_used = time.monotonic()
+        if self._chat_history is None:
+            state = self.graph.get_state(self._config)
+            self._restore_from_messages(state.values.get("messages", []))
+
+    def _restore_from_messages(self, messages):
+        """
+        Rebuilds the chat from checkpointed messages. Intermediate outputs and the figures of each turn
+        are recovered from the tool messages, so they need no storage of their own.
+        """
+        intermediate_outputs = []
+        output_figure_ids = {}
+        turn_figure_ids = None
+        for index, message in enumerate(messages):
+            if isinstance(message, HumanMessage):
+                if turn_figure_ids is not None:
+                    output_figure_ids[index - 1] = turn_figure_ids
+                turn_figure_ids = []
+            elif isinstance(message, ToolMessage):
+                tool_output = tool_output_from_message(message)
+                if tool_output is not None:
+                    intermediate_outputs.append(tool_output)
+                    if turn_figure_ids is not None:
+                        turn_figure_ids.extend(tool_output.get("output_figure_ids", []))
+        if turn_figure_ids is not None:
+            output_figure_ids[len(messages) - 1] = turn_figure_ids
+
+        self._chat_history = list(messages)
+        self._intermediate_outputs = trim_intermediate_outputs(intermediate_outputs)
+        self._output_figure_ids = output_figure_ids
+
+    def offload_if_idle(self, max_idle: float = None) -> bool:
+        """
+        Drops the in-memory conversation if the chat has been idle for more than max_idle seconds
+        and can be reloaded from its checkpoint. Returns whether it was dropped.
+        """
+        max_idle = SESSION_IDLE_TIMEOUT if max_idle is None else max_idle
+        if not self.checkpointer or self._running or self._chat_history is None:
+            return False
+        if time.monotonic() - self.last_used <= max_idle:
+            return False
+        self._chat_history = None
+        self._intermediate_outputs = []
+        self._output_figure_ids = {}
+        return True
+
+    def _input_state(self, user_query, input_data):
+        # With a checkpointer the earlier messages are already in the thread's state.
+        # Intermediate outputs from earlier turns stay here rather than being copied through the graph state.
+        messages = [HumanMessage(content=user_query)]
+        if not self.checkpointer:
+            messages = self.chat_history + messages
+        return {
+            "messages": messages,
+            "input_data": {**input_data, "session_id": self.session_id},
         }
-        result = self.graph.invoke(input_state, {"recursion_limit": 15})
-        self.chat_history = result["messages"]
-        new_image_paths = set(result["output_image_paths"]) - starting_image_paths_set
-        self.output_image_paths[len(self.chat_history) - 1] = list(new_image_paths)
-        if "intermediate_outputs" in result:
-            self.intermediate_outputs = result["intermediate_outputs"]
+
+    def invoke_graph(self, user_query, input_data):
+        for _ in self.stream_graph(user_query, input_data):
+            pass
+
+    async def ainvoke_graph(self, user_query, input_data):
+        """
+        Async variant of invoke_graph: LLM and database calls are awaited and Python tasks run in a worker thread,
+        so one event loop can keep many conversations in flight.
+        """
+        async for _ in self.astream_graph(user_query, input_data):
+            pass
         
     def reset_chat(self):
-        self.chat_history = []
-        self.intermediate_outputs = []
-        self.output_image_paths = {}
+        if self.checkpointer:
+            self.checkpointer.delete_thread(self.session_id)
+        discard_figures([figure_id for figure_ids in self.output_figure_ids.values() for figure_id in figure_ids])
+        self._chat_history = []
+        self._intermediate_outputs = []
+        self._output_figure_ids = {}
     
-    def build_graph(self):
-        builder =  StateGraph(AgentState)
-        builder.add_node('get_table_schema', get_table_schema)
-        builder.add_node('agent', brain_node)
-        builder.add_node('tools', tool_node)
-        builder.add_node('handle_tool_output', handle_tool_output)
+    def _start_stream(self, user_query, input_data):
+        """
+        Prepares a streamed run. The chat history is extended in place from per-node updates,
+        so the user's message is part of it from the start.
+        """
+        input_state = self._input_state(user_query, input_data)
+        self.chat_history = self.chat_history + input_state["messages"][-1:]
+        self.intermediate_outputs = list(self.intermediate_outputs)
+        self._stream_figure_ids = []
+        self._running = True
+        return input_state
 
-        builder.add_edge('get_table_schema', 'agent')
-        builder.add_conditional_edges('agent', route_to_tools)
-        builder.add_edge('tools', 'handle_tool_output')
-        builder.add_edge('handle_tool_output', 'agent')
+    def _apply_update(self, update):
+        """
+        Applies one node's update (a delta, not the full state) and returns the messages it added.
+        """
+        if not update:
+            return []
+        new_messages = list(update.get("messages", []))
+        self.chat_history.extend(new_messages)
+        self.intermediate_outputs.extend(update.get("intermediate_outputs", []))
+        self._stream_figure_ids.extend(update.get("output_figure_ids", []))
+        return new_messages
 
-        builder.set_entry_point('get_table_schema')
+    def _finish_stream(self):
+        self._running = False
+        self.output_figure_ids[len(self.chat_history) - 1] = self._stream_figure_ids
+        self.intermediate_outputs = trim_intermediate_outputs(self.intermediate_outputs)
+
+    def _stream_events(self, mode, payload):
+        """
+        Converts one item of a ("messages", "updates") stream into lightweight UI events:
+            {"type": "token", "content": str}: a chunk of the agent's reply as the LLM produces it
+            {"type": "message", "message": AIMessage}: a completed agent message
+            {"type": "tool_start", "id": str, "name": str}: a tool call requested by the agent
+            {"type": "tool_end", "id": str, "name": str, "status": str, "timing": dict or None}: a finished tool call
+        """
+        if mode == "messages":
+            chunk, metadata = payload
+            if isinstance(chunk, AIMessageChunk) and metadata.get("langgraph_node") == "agent" and chunk.content:
+                yield {"type": "token", "content": chunk.content}
+            return
+
+        for update in payload.values():
+            for message in self._apply_update(update):
+                if isinstance(message, AIMessage):
+                    yield {"type": "message", "message": message}
+                    for tool_call in message.tool_calls:
+                        yield {"type": "tool_start", "id": tool_call["id"], "name": tool_call["name"]}
+                elif isinstance(message, ToolMessage):
+                    yield {
+                        "type": "tool_end",
+                        "id": message.tool_call_id,
+                        "name": message.name,
+                        "status": message.status,
+                        "timing": message.response_metadata.get("timing"),
+                    }
 
-        return builder.compile()
-    
     def stream_graph(self, user_query, input_data):
-        starting_image_paths_set = set(sum(self.output_image_paths.values(), []))
-        # Clear intermediate outputs before each new graph execution
-        input_state = {
-            "messages": self.chat_history + [HumanMessage(content=user_query)],
-            "input_data": input_data,
-            "intermediate_outputs": self.intermediate_outputs
-        }
-        response = self.graph.stream(input_state, {"recursion_limit": 15}, stream_mode="values")
-        for state in response:
-            # Update chat history with any new messages
-            if "messages" in state and len(state["messages"]) > len(self.chat_history):
-                self.chat_history = state["messages"]
-                last_message = state["messages"][-1]
-                yield last_message
-
-            # Update intermediate outputs with any new outputs
-            if "intermediate_outputs" in state and len(state["intermediate_outputs"]) > len(self.intermediate_outputs):
-                self.intermediate_outputs = state["intermediate_outputs"]
-                
-            # Update output image paths with any new paths
-            if "output_image_paths" in state:
-                new_image_paths = set(state["output_image_paths"]) - starting_image_paths_set
-                if new_image_paths:
-                    self.output_image_paths[len(self.chat_history) - 1] = list(new_image_paths)
\ No newline at end of file
+        """
+        Yields each new message as the graph produces it. Nodes stream only their updates,
+        so no copy of the full state is made per step.
+        """
+        input_state = self._start_stream(user_query, input_data)
+        try:
+            for update in self.graph.stream(input_state, self._config, stream_mode="updates"):
+                for node_update in update.values():
+                    yield from self._apply_update(node_update)
+        finally:
+            self._finish_stream()
+
+    async def astream_graph(self, user_query, input_data):
+        """
+        Async variant of stream_graph.
+        """
+        input_state = self._start_stream(user_query, input_data)
+        try:
+            async for update in self.graph.astream(input_state, self._config, stream_mode="updates"):
+                for node_update in update.values():
+                    for message in self._apply_update(node_update):
+                        yield message
+        finally:
+            self._finish_stream()
+
+    def stream_graph_events(self, user_query, input_data):
+        """
+        Streams the agent's reply token by token, with tool start and end events, for display as it is generated.
+        See _stream_events for the event format.
+        """
+        input_state = self._start_stream(user_query, input_data)
+        try:
+            for mode, payload in self.graph.stream(input_state, self._config, stream_mode=["messages", "updates"]):
+                yield from self._stream_events(mode, payload)
+        finally:
+            self._finish_stream()
+
+    async def astream_graph_events(self, user_query, input_data):
+        """
+        Async variant of stream_graph_events.
+        """
+        input_state = self._start_stream(user_query, input_data)
+        try:
+            async for mode, payload in self.graph.astream(input_state, self._config, stream_mode=["messages", "updates"]):
+                for event in self._stream_events(mode, payload):
+                    yield event
+        finally:
+            self._finish_stream()
@@ -1,21 +1,31 @@
 # Standard library imports
 import os
-import pickle
-import socket
-import json
 # Third-party imports
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import text
 from langchain_core.messages import HumanMessage, AIMessage
 
-# Database connectors
-import sqlite3
-import mysql.connector
-import psycopg2
+# Database drivers are imported by SQLAlchemy when the first engine for them is created
 
 # Local imports
-from pages.backend import PythonChatBot
+from pages.graph.startup import timed_phase, get_startup_report
+with timed_phase("import_backend"):
+    from pages.backend import PythonChatBot, start_warm_up
+from pages.graph.db_utils import get_engine_for_uri
+from pages.graph.schema import get_cached_schema
+from pages.graph.figure_registry import get_figure
+from pages.graph.sessions import issue_resume_token, redeem_resume_token
+from pages.graph.tracing import get_spans, export_jsonl
+from pages.graph.workspaces import get_workspace_usage, get_workspace_stats
+
+# Turns of chat history and agent steps drawn on each run; older ones are loaded on demand
+CHAT_WINDOW_TURNS = int(os.getenv("CHAT_WINDOW_TURNS", "10"))
+ACTIONS_WINDOW_STEPS = int(os.getenv("ACTIONS_WINDOW_STEPS", "20"))
+# Answers whose figures are drawn right away; figures of earlier answers are drawn when opened
+CHAT_FIGURE_TURNS = int(os.getenv("CHAT_FIGURE_TURNS", "2"))
+# Most recent node traces shown in the Agent Actions tab
+TRACE_TABLE_ROWS = 200
 
 def is_remote_host():
     """
@@ -31,6 +41,9 @@ def is_remote_host():
 
 st.header("Data Analysis LangGraph Agent")
 
+# Prepare the graph, LLM client and a Python worker while the user connects to a database
+start_warm_up()
+
 
 def get_database_connection(db_type, **kwargs):
     """
@@ -51,7 +64,7 @@ def get_database_connection(db_type, **kwargs):
             if not os.path.exists(db_path):
                 return None, None, f"Database file not found: {db_path}"
             uri = f'sqlite:///{db_path}'
-            engine = create_engine(uri)
+            engine = get_engine_for_uri(uri)
             # Verify connection
             with engine.connect() as conn:
                 conn.execute(text("SELECT 1")).fetchone()
@@ -66,7 +79,7 @@ def get_database_connection(db_type, **kwargs):
             password = kwargs.get('password')
             database = kwargs.get('database')
             uri = f'mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}'
-            engine = create_engine(uri)
+            engine = get_engine_for_uri(uri)
             # Verify connection
             with engine.connect() as conn:
                 conn.execute(text("SELECT 1")).fetchone()
@@ -81,7 +94,7 @@ def get_database_connection(db_type, **kwargs):
             password = kwargs.get('password')
             database = kwargs.get('database')
             uri = f'postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}'
-            engine = create_engine(uri)
+            engine = get_engine_for_uri(uri)
             # Verify connection
             with engine.connect() as conn:
                 conn.execute(text("SELECT 1")).fetchone()
@@ -89,9 +102,53 @@ def get_database_connection(db_type, **kwargs):
         except Exception as e:
             return None, None, str(e)
 
+def format_trace(trace):
+    """
+    Summarizes a step's or node's traced metrics in one line.
+    """
+    parts = []
+    if trace.get('llm_calls'):
+        if trace.get('prompt_tokens') or trace.get('completion_tokens'):
+            parts.append(f"{trace.get('prompt_tokens', 0)} prompt / {trace.get('completion_tokens', 0)} completion tokens")
+        else:
+            parts.append(f"{trace['llm_calls']} model call(s)")
+    if trace.get('sql_queries'):
+        if trace.get('sql_cache_hits') == trace['sql_queries']:
+            parts.append("SQL served from cache")
+        else:
+            parts.append(f"SQL fetched {trace.get('sql_rows', 0):,} rows ({trace.get('sql_bytes', 0) / 1024 ** 2:.1f} MB)")
+    if trace.get('python_tasks'):
+        parts.append(f"Python used {trace.get('python_cpu_seconds', 0):.2f}s CPU, "
+                     f"{trace.get('python_memory_delta_bytes', 0) / 1024 ** 2:+.1f} MB memory")
+    return "; ".join(parts)
+
+def show_workspace_usage(container, session_id):
+    """
+    Shows the memory used by this session's workspace and by all sessions, against their quotas.
+    """
+    usage = get_workspace_usage(session_id)
+    stats = get_workspace_stats()
+    container.subheader("Session Memory")
+    if usage is None:
+        container.caption("No query results or Python variables yet.")
+    else:
+        container.progress(
+            min(usage['resident_bytes'] / usage['max_bytes'], 1.0),
+            text=f"{usage['resident_bytes'] / 1024 ** 2:,.0f} of {usage['max_bytes'] / 1024 ** 2:,.0f} MB",
+        )
+        container.caption(
+            f"Query results: {usage['dataframes_resident_bytes'] / 1024 ** 2:,.1f} MB in memory ({usage['frames_resident']}), "
+            f"{usage['dataframes_spilled_bytes'] / 1024 ** 2:,.1f} MB on disk ({usage['frames_spilled']}); "
+            f"Python: {usage['python_bytes'] / 1024 ** 2:,.1f} MB"
+        )
+    container.caption(
+        f"All sessions: {stats['resident_bytes'] / 1024 ** 2:,.0f} of {stats['max_bytes'] / 1024 ** 2:,.0f} MB "
+        f"across {stats['sessions']} session(s), {stats['evictions']} evicted"
+    )
+
 def get_schema(engine):
     """
-    Get the database schema using SQLAlchemy inspector.
+    Get the database schema from the shared schema cache.
     
     Args:
         engine: SQLAlchemy engine object
@@ -99,21 +156,229 @@ def get_schema(engine):
     Returns:
         dict: Database schema information
     """
-    inspector = inspect(engine)
     schema = {}
     
-    for table_name in inspector.get_table_names():
+    for table_name, table_info in get_cached_schema(engine).items():
         columns = []
-        for column in inspector.get_columns(table_name):
+        for column in table_info['columns']:
             columns.append({
                 'name': column['name'],
-                'type': str(column['type']),
+                'type': column['type'],
                 'nullable': column['nullable']
             })
         schema[table_name] = columns
     
     return schema
 
+def get_message_figures(message_index):
+    """
+    Figures of one answer, from the session's figure cache; on first use they are loaded from the figure registry.
+    The registry keeps its copy, so a resumed session can show the figures again.
+    """
+    if message_index not in st.session_state.stored_figures:
+        figures = []
+        for figure_id in st.session_state.chatbot.output_figure_ids[message_index]:
+            fig = get_figure(figure_id)
+            if fig is None:
+                st.warning(f"Figure is no longer available: {figure_id}")
+                continue
+            figures.append(fig)
+        st.session_state.stored_figures[message_index] = figures
+    return st.session_state.stored_figures[message_index]
+
+def show_figures(message_index, expanded):
+    """
+    Draws an answer's figures, or a toggle that draws them on demand when expanded is False.
+    """
+    figure_count = len(st.session_state.chatbot.output_figure_ids[message_index])
+    if not expanded and not st.toggle(f"Show {figure_count} figure(s)", key=f"show-figures-{message_index}"):
+        return
+    # Keys keep identical figures from different answers apart
+    for figure_index, fig in enumerate(get_message_figures(message_index)):
+        st.plotly_chart(fig, use_container_width=True, key=f"figure-{message_index}-{figure_index}")
+
+def show_chat_message(message_index, message, figures_expanded):
+    if message.content == "":
+        return
+    if isinstance(message, HumanMessage):
+        st.chat_message("Human").markdown(message.content)
+    elif isinstance(message, AIMessage):
+        with st.chat_message("AI"):
+            st.markdown(message.content)
+        if st.session_state.chatbot.output_figure_ids.get(message_index):
+            show_figures(message_index, figures_expanded)
+
+def stream_answer(question):
+    """
+    Renders the reply to a question token by token, with a status line per tool call.
+    """
+    input_data = {
+        "db_uri": st.session_state.db_uri,
+        "db_type": st.session_state.db_type
+    }
+    with st.chat_message("Human"):
+        st.markdown(question)
+
+    with st.chat_message("AI"):
+        reply_placeholder = st.empty()
+        reply_placeholder.markdown("_Thinking..._")
+        reply_text = ""
+        tool_placeholders = {}
+        for event in st.session_state.chatbot.stream_graph_events(question, input_data):
+            if event["type"] == "token":
+                reply_text += event["content"]
+                reply_placeholder.markdown(reply_text + "▌")
+            elif event["type"] == "message":
+                if event["message"].content:
+                    reply_placeholder.markdown(event["message"].content)
+                else:
+                    reply_placeholder.empty()
+                # The next agent message streams into a new placeholder below this step's tools
+                reply_text = ""
+                reply_placeholder = st.empty()
+            elif event["type"] == "tool_start":
+                tool_placeholders[event["id"]] = st.empty()
+                tool_placeholders[event["id"]].caption(f"Running `{event['name']}`...")
+            elif event["type"] == "tool_end" and event["id"] in tool_placeholders:
+                status = "failed" if event["status"] == "error" else "finished"
+                if event["timing"]:
+                    status += f" in {event['timing']['duration_seconds']:.2f}s"
+                tool_placeholders[event["id"]].caption(f"`{event['name']}` {status}")
+
+@st.fragment
+def chat_pane():
+    """
+    The last CHAT_WINDOW_TURNS turns of the conversation, with earlier ones loaded on demand, and the answer
+    to a question submitted in this run. As a fragment, loading turns or opening figures redraws only this pane.
+    """
+    chatbot = st.session_state.chatbot
+    chat_container = st.container(height=500)
+    with chat_container:
+        turn_starts = [i for i, message in enumerate(chatbot.chat_history) if isinstance(message, HumanMessage)]
+        hidden_turns = max(len(turn_starts) - st.session_state.chat_window_turns, 0)
+        if hidden_turns and st.button(f"Show earlier messages ({hidden_turns} more turns)", key="show-earlier-messages"):
+            st.session_state.chat_window_turns += CHAT_WINDOW_TURNS
+            hidden_turns = max(len(turn_starts) - st.session_state.chat_window_turns, 0)
+        start = turn_starts[hidden_turns] if hidden_turns else 0
+        # Figures of the latest answers are drawn right away, older ones when their toggle is opened
+        expanded_figures = sorted(i for i, figure_ids in chatbot.output_figure_ids.items() if figure_ids and i >= start)[-CHAT_FIGURE_TURNS:] if CHAT_FIGURE_TURNS else []
+        for message_index in range(start, len(chatbot.chat_history)):
+            show_chat_message(message_index, chatbot.chat_history[message_index], message_index in expanded_figures)
+
+        question = st.session_state.pop("pending_question", None)
+        if question:
+            first_new_message = len(chatbot.chat_history)
+            stream_answer(question)
+            # The streamed reply is already on screen; only the new answers' figures are left to draw
+            for message_index in range(first_new_message, len(chatbot.chat_history)):
+                if chatbot.output_figure_ids.get(message_index):
+                    show_figures(message_index, True)
+
+def show_intermediate_output(output):
+    if 'thought' in output:
+        st.markdown("#### Thought Process")
+        st.markdown(output['thought'])
+    if 'query' in output:
+        st.markdown("#### SQL Query")
+        st.code(output['query'], language="sql")
+        if 'row_count' in output:
+            st.markdown(f"**Rows Retrieved:** {output['row_count']}")
+        if output.get('cache', {}).get('hit'):
+            st.caption(f"Served from the {output['cache']['tier']} result cache")
+        if output.get('engine') == "duckdb":
+            st.caption("Run on the local DuckDB replica")
+        if 'memory' in output:
+            memory = output['memory']
+            st.caption(
+                f"Memory {memory['bytes_before'] / 1024 ** 2:,.2f} MB → {memory['bytes_after'] / 1024 ** 2:,.2f} MB "
+                f"after compacting {len(memory['converted'])} column dtype(s)"
+            )
+        if 'estimate' in output:
+            estimate = output['estimate']
+            rows = "unknown" if estimate['rows'] is None else f"{'at most ' if estimate.get('grouped') else ''}{estimate['rows']:,}"
+            st.caption(f"Estimated cost {estimate['cost']:,.0f}, estimated rows {rows}")
+            st.code("\n".join(estimate['plan']))
+        if 'columns' in output:
+            st.markdown("**Columns:**")
+            st.code(", ".join(output['columns']))
+        if 'preview' in output:
+            st.markdown("**Data Preview:**")
+            st.dataframe(pd.DataFrame(output['preview']))
+        if 'message' in output:
+            if output.get('rejected'):
+                st.error(output['message'])
+            elif output.get('truncated'):
+                st.warning(output['message'])
+            else:
+                st.success(output['message'])
+    if 'schema' in output:
+        st.markdown("#### Table Schemas")
+        st.code(output['schema'])
+        if 'message' in output:
+            st.info(output['message'])
+    if 'code' in output:
+        st.markdown("#### Python Code")
+        st.code(output['code'], language="python")
+    if 'query' not in output:
+        if 'output' in output and output['output'] != "":
+            st.markdown("#### Output")
+            st.text(output['output'])
+        if 'variables' in output:
+            st.markdown("#### Variables Updated")
+            for name, description in output['variables'].items():
+                st.markdown(f"- `{name}`: {description}")
+    if 'timing' in output:
+        timing = output['timing']
+        caption = f"Ran in {timing['duration_seconds']:.2f}s"
+        if timing['step_saved_seconds'] > 0:
+            caption += (f"; tool calls in this step ran in parallel in {timing['step_wall_seconds']:.2f}s, "
+                        f"saving {timing['step_saved_seconds']:.2f}s")
+        st.caption(caption)
+    if output.get('trace'):
+        st.caption(format_trace(output['trace']))
+
+@st.fragment
+def actions_pane():
+    """
+    The last ACTIONS_WINDOW_STEPS agent steps, with earlier ones loaded on demand, and the latest node traces.
+    As a fragment, loading steps or preparing the trace download redraws only this pane.
+    """
+    chatbot = st.session_state.chatbot
+    outputs = chatbot.intermediate_outputs
+    st.markdown("#### Intermediate Outputs")
+    hidden_steps = max(len(outputs) - st.session_state.actions_window_steps, 0)
+    if hidden_steps and st.button(f"Show earlier steps ({hidden_steps} more)", key="show-earlier-steps"):
+        st.session_state.actions_window_steps += ACTIONS_WINDOW_STEPS
+        hidden_steps = max(len(outputs) - st.session_state.actions_window_steps, 0)
+    for i in range(hidden_steps, len(outputs)):
+        with st.expander(f"Step {i+1}"):
+            show_intermediate_output(outputs[i])
+    if not outputs:
+        st.info("No debug information available yet. Start a conversation to see intermediate outputs.")
+
+    spans = get_spans(chatbot.session_id, limit=TRACE_TABLE_ROWS)
+    if spans:
+        st.markdown("#### Node Traces")
+        st.dataframe(pd.DataFrame([
+            {
+                "Turn": span['turn'],
+                "Step": span['step'],
+                "Node": span['node'],
+                "Seconds": round(span['duration_seconds'], 3),
+                "Details": format_trace(span['metrics']) or span.get('error', ""),
+            }
+            for span in reversed(spans)
+        ]), hide_index=True)
+        # Serializing every trace of a long session is only worth it when a download is wanted
+        if st.button("Prepare traces for download", key="prepare-traces"):
+            st.download_button(
+                "Download traces (JSON lines)",
+                export_jsonl(get_spans(chatbot.session_id)),
+                file_name=f"traces-{chatbot.session_id}.jsonl",
+                mime="application/x-ndjson",
+                on_click="ignore",
+            )
+
 # Initialize session state variables
 if 'connection_status' not in st.session_state:
     st.session_state.connection_status = False
@@ -125,6 +390,10 @@ if 'db_uri' not in st.session_state:
     st.session_state.db_uri = None
 if 'stored_figures' not in st.session_state:
     st.session_state.stored_figures = {}
+if 'chat_window_turns' not in st.session_state:
+    st.session_state.chat_window_turns = CHAT_WINDOW_TURNS
+if 'actions_window_steps' not in st.session_state:
+    st.session_state.actions_window_steps = ACTIONS_WINDOW_STEPS
 
 # Sidebar for database connection
 st.sidebar.title("Database Connection")
@@ -218,6 +487,9 @@ if st.session_state.db_schema:
                 st.write(f"- {col['name']} ({col['type']})")
 
 
+# Filled in at the end of the script, after this run's questions have been answered
+workspace_panel = st.sidebar.container()
+
 tab1, tab2 = st.tabs(["Chat Interface", "Agent Actions"])
 
 
@@ -226,98 +498,33 @@ with tab1:
     if st.session_state.connection_status:
 
         if 'chatbot' not in st.session_state:
-            st.session_state.chatbot = PythonChatBot()
-        
-        # Display chat history
-        chat_container = st.container(height=500)
-        with chat_container:
-            for message_index, message in enumerate(st.session_state.chatbot.chat_history):
-                if message.content != "":
-                    if isinstance(message, HumanMessage):
-                        st.chat_message("Human").markdown(message.content)
-                    elif isinstance(message, AIMessage):
-                        with st.chat_message("AI"):
-                            st.markdown(message.content)
-
-                    if isinstance(message, AIMessage) and message_index in st.session_state.chatbot.output_image_paths:
-                        # Display stored figures if available
-                        if message_index in st.session_state.stored_figures:
-                            for fig in st.session_state.stored_figures[message_index]:
-                                st.plotly_chart(fig, use_container_width=True)
-                        else:
-                            # If figures aren't in session state, try to load from pickle files
-                            image_paths = st.session_state.chatbot.output_image_paths[message_index]
-                            for image_path in image_paths:
-                                pickle_path = os.path.join("images/plotly_figures/pickle", image_path)
-                                try:
-                                    with open(pickle_path, "rb") as f:
-                                        fig = pickle.load(f)
-
-                                    # Store the figure in session state
-                                    if message_index not in st.session_state.stored_figures:
-                                        st.session_state.stored_figures[message_index] = []
-                                    st.session_state.stored_figures[message_index].append(fig)
-                                    st.plotly_chart(fig, use_container_width=True)
-                                    # Delete the pickle file after loading
-                                    try:
-                                        os.remove(pickle_path)
-                                    except Exception as e:
-                                        st.warning(f"Could not delete pickle file: {e}")
-                                except FileNotFoundError:
-                                    st.warning(f"Figure file not found: {image_path}")
-            
-        # Chat input
+            # The resume token in the URL lets a returning user resume their checkpointed conversation.
+            # A token works once and is replaced here, so a copied link cannot open the session in another browser.
+            st.session_state.chatbot = PythonChatBot(session_id=redeem_resume_token(st.query_params.get("resume")))
+            resume_token = issue_resume_token(st.session_state.chatbot.session_id)
+            if resume_token:
+                st.query_params["resume"] = resume_token
+
+        # The pane is laid out above the chat input but drawn after it, so it can answer this run's question
+        chat_pane_container = st.container()
         if user_input := st.chat_input("Ask a question about your data..."):
-            # Create input data object with current database info
-            input_data = {
-                "db_uri": st.session_state.db_uri,
-                "db_type": st.session_state.db_type
-            }
-            
-            # Process user message
-            with chat_container:
-                with st.chat_message("Human"):
-                    st.markdown(user_input)
-                
-                with st.chat_message("AI"):
-                    # Iterate through the generator
-                    with st.spinner("Thinking..."):
-                        for message in st.session_state.chatbot.stream_graph(user_input, input_data):
-                            if isinstance(message, AIMessage):
-                                st.markdown(message.content)
-                        st.rerun()
+            st.session_state.pending_question = user_input
+        with chat_pane_container:
+            chat_pane()
 
     else:
         st.info("Please connect to a database first to use the query assistant.")
 
 with tab2:
     if 'chatbot' in st.session_state:
-        st.markdown("#### Intermediate Outputs")
-        for i, output in enumerate(st.session_state.chatbot.intermediate_outputs):
-            with st.expander(f"Step {i+1}"):
-                if 'thought' in output:
-                    st.markdown("#### Thought Process")
-                    st.markdown(output['thought'])
-                if 'query' in output:
-                    st.markdown("#### SQL Query")
-                    st.code(output['query'], language="sql")
-                    if 'row_count' in output:
-                        st.markdown(f"**Rows Retrieved:** {output['row_count']}")
-                    if 'columns' in output:
-                        st.markdown("**Columns:**")
-                        st.code(", ".join(output['columns']))
-                    if 'preview' in output:
-                        st.markdown("**Data Preview:**")
-                        st.dataframe(pd.DataFrame(output['preview']))
-                    if 'message' in output:
-                        st.success(output['message'])
-                if 'code' in output:
-                    st.markdown("#### Python Code")
-                    st.code(output['code'], language="python")
-                if 'query' not in output:
-                    if 'output' in output and output['output'] != "":
-                        st.markdown("#### Output")
-                        st.text(output['output'])
-        if not st.session_state.chatbot.intermediate_outputs:
-            st.info("No debug information available yet. Start a conversation to see intermediate outputs.")
+        actions_pane()
+
+    with st.expander("Server startup"):
+        startup_report = get_startup_report()
+        st.caption(f"Process started {startup_report['process_started']}")
+        st.dataframe(pd.DataFrame(
+            [{"Phase": phase, "Seconds": seconds} for phase, seconds in startup_report['phases'].items()]
+        ), hide_index=True)
 
+if 'chatbot' in st.session_state:
+    show_workspace_usage(workspace_panel, st.session_state.chatbot.session_id)
@@ -0,0 +1,204 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+import math
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from .result_cache import get_data_version
+from .schema import get_cached_schema
+from .sql_runner import to_json_value
+
+# Per-column statistics shown with the schema, so the agent does not spend steps on exploratory queries.
+# Profiles are computed in a background thread once per data version (SQLite) or every COLUMN_PROFILE_TTL
+# seconds (server databases), from a sample of COLUMN_PROFILE_SAMPLE_ROWS rows on larger tables.
+COLUMN_PROFILES_ENABLED = os.getenv("COLUMN_PROFILES_ENABLED", "true").lower() in ("1", "true", "yes")
+COLUMN_PROFILE_SAMPLE_ROWS = int(os.getenv("COLUMN_PROFILE_SAMPLE_ROWS", "100000"))
+COLUMN_PROFILE_TTL = int(os.getenv("COLUMN_PROFILE_TTL", "3600"))
+COLUMN_PROFILE_TOP_K = int(os.getenv("COLUMN_PROFILE_TOP_K", "3"))
+COLUMN_PROFILE_BINS = int(os.getenv("COLUMN_PROFILE_BINS", "4"))
+
+# Text values longer than this are cut in profiles
+_MAX_VALUE_CHARS = 24
+# Most common values are listed when the top one covers at least this share of the non-null values
+_TOP_MIN_SHARE = 0.05
+
+# Profiles by engine URL: {"data_version", "computed_at", "schema", "tables": {table: profile}}
+_profiles = {}
+_running = set()
+_lock = threading.Lock()
+
+
+def _table_rows(connection, dialect: str, quoted_table: str, table: str) -> int:
+    """
+    Row count of a table; PostgreSQL and MySQL use the catalog's estimate, which avoids a full scan.
+    """
+    if dialect == "postgresql":
+        estimate = connection.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"), {"table": quoted_table}
+        ).scalar()
+        if estimate is not None and estimate > 0:
+            return int(estimate)
+    elif dialect in ("mysql", "mariadb"):
+        estimate = connection.execute(
+            text("SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table"),
+            {"table": table},
+        ).scalar()
+        if estimate:
+            return int(estimate)
+    return int(connection.execute(text(f"SELECT COUNT(*) FROM {quoted_table}")).scalar())
+
+
+def _sample_query(dialect: str, quoted_table: str, rows: int) -> str:
+    """
+    A query returning about COLUMN_PROFILE_SAMPLE_ROWS rows spread over the table.
+    """
+    sample = COLUMN_PROFILE_SAMPLE_ROWS
+    if dialect == "sqlite":
+        return f"SELECT * FROM {quoted_table} WHERE rowid % {math.ceil(rows / sample)} = 0 LIMIT {sample}"
+    if dialect == "postgresql":
+        return f"SELECT * FROM {quoted_table} TABLESAMPLE SYSTEM ({min(100, 100 * sample / rows * 1.2):.4f}) LIMIT {sample}"
+    if dialect in ("mysql", "mariadb"):
+        return f"SELECT * FROM {quoted_table} WHERE RAND() < {sample / rows * 1.2:.6f} LIMIT {sample}"
+    return f"SELECT * FROM {quoted_table} LIMIT {sample}"
+
+
+def _profile_value(value):
+    value = to_json_value(value)
+    if isinstance(value, str) and len(value) > _MAX_VALUE_CHARS:
+        return value[:_MAX_VALUE_CHARS - 1] + "…"
+    return value
+
+
+def profile_column(series: pd.Series, total_rows: int) -> dict:
+    """
+    Null fraction, distinct estimate, min/max, most common values and histogram of one column,
+    from all its values or a sample of total_rows.
+    """
+    values = series.dropna()
+    sampled = len(series) < total_rows
+    profile = {"null_fraction": round(1 - len(values) / len(series), 4) if len(series) else 0.0}
+    if values.empty:
+        return profile
+    try:
+        counts = values.value_counts()
+    except TypeError:
+        # Unhashable values (e.g. JSON columns) have no distinct count or ordering
+        return profile
+    distinct = len(counts)
+    if sampled:
+        # Guaranteed-error estimator: values seen once in the sample stand for many unseen ones
+        singletons = int((counts == 1).sum())
+        non_null_total = total_rows * len(values) / len(series)
+        distinct = min(round(math.sqrt(non_null_total / len(values)) * singletons + distinct - singletons), round(non_null_total))
+    profile["distinct"] = distinct
+    profile["sampled"] = sampled
+    # A sample cannot show that values never repeat
+    profile["unique"] = not sampled and int(counts.iloc[0]) == 1
+    try:
+        profile["min"], profile["max"] = _profile_value(values.min()), _profile_value(values.max())
+    except TypeError:
+        pass
+    if len(counts) > 1 and counts.iloc[0] / len(values) >= _TOP_MIN_SHARE:
+        profile["top"] = [
+            [_profile_value(value), round(count / len(values), 3)] for value, count in counts.head(COLUMN_PROFILE_TOP_K).items()
+        ]
+    elif (
+        not profile["unique"] and pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+        and len(counts) > COLUMN_PROFILE_BINS and COLUMN_PROFILE_BINS > 1
+    ):
+        bin_counts, edges = np.histogram(values.to_numpy(dtype=float), bins=COLUMN_PROFILE_BINS)
+        profile["histogram"] = [
+            [float(edges[i]), float(edges[i + 1]), round(int(count) / len(values), 3)] for i, count in enumerate(bin_counts)
+        ]
+    return profile
+
+
+def profile_table(connection, table: str) -> dict:
+    """
+    Profiles every column of a table from one scan of the table, or of a sample of it when it is large.
+    """
+    dialect = connection.dialect.name
+    quoted_table = connection.dialect.identifier_preparer.quote(table)
+    rows = _table_rows(connection, dialect, quoted_table, table)
+    sampled = rows > COLUMN_PROFILE_SAMPLE_ROWS
+    if sampled:
+        try:
+            df = pd.read_sql_query(text(_sample_query(dialect, quoted_table, rows)), connection)
+        except SQLAlchemyError:
+            # e.g. SQLite tables WITHOUT ROWID; the first rows stand in for a sample
+            connection.rollback()
+            df = pd.read_sql_query(text(f"SELECT * FROM {quoted_table} LIMIT {COLUMN_PROFILE_SAMPLE_ROWS}"), connection)
+    else:
+        df = pd.read_sql_query(text(f"SELECT * FROM {quoted_table}"), connection)
+    if df.empty:
+        return {"rows": rows, "sample_rows": 0 if sampled else None, "columns": {}}
+    rows = max(rows, len(df))
+    return {
+        "rows": rows,
+        "sample_rows": len(df) if sampled else None,
+        "columns": {str(name): profile_column(df.iloc[:, i], rows) for i, name in enumerate(df.columns)},
+    }
+
+
+def profile_database(engine: Engine) -> dict:
+    """
+    Profiles every table of the database and stores the result for get_column_profiles.
+    Tables that cannot be read are left out.
+    """
+    key = engine.url.render_as_string(hide_password=False)
+    data_version = get_data_version(key)
+    schema = get_cached_schema(engine)
+    tables = {}
+    with engine.connect() as connection:
+        for table in schema:
+            try:
+                tables[table] = profile_table(connection, table)
+            except (SQLAlchemyError, ValueError, TypeError):
+                connection.rollback()
+    entry = {"data_version": data_version, "computed_at": time.time(), "schema": schema, "tables": tables}
+    with _lock:
+        _profiles[key] = entry
+    return tables
+
+
+def _profile_in_background(engine: Engine, key: str):
+    try:
+        profile_database(engine)
+    except SQLAlchemyError:
+        pass
+    finally:
+        with _lock:
+            _running.discard(key)
+
+
+def get_column_profiles(engine: Engine, wait: bool = False) -> dict:
+    """
+    Returns the column profiles of the engine's database as {table: profile}, or None if they are not computed yet.
+    Missing or outdated profiles are computed in a background thread (or right away with wait=True);
+    outdated ones are still returned meanwhile, since approximate statistics remain useful.
+    """
+    if not COLUMN_PROFILES_ENABLED:
+        return None
+    key = engine.url.render_as_string(hide_password=False)
+    schema = get_cached_schema(engine)
+    with _lock:
+        entry = _profiles.get(key)
+    if entry is not None and entry["schema"] is schema:
+        data_version = get_data_version(key)
+        if data_version is None:
+            fresh = time.time() - entry["computed_at"] <= COLUMN_PROFILE_TTL
+        else:
+            # In-memory SQLite databases (False) are never rechecked
+            fresh = data_version is False or data_version == entry["data_version"]
+        if fresh:
+            return entry["tables"]
+    if wait:
+        return profile_database(engine)
+    with _lock:
+        if key not in _running:
+            _running.add(key)
+            threading.Thread(target=_profile_in_background, args=(engine, key), daemon=True, name="column-profiler").start()
+    return entry["tables"] if entry is not None and entry["schema"] is schema else None
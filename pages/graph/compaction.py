@@ -0,0 +1,173 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+import json
+import os
+from .schema_index import estimate_tokens
+
+# Approximate token budget for the conversation sent to the model each step (the system prompt is not counted)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "16000"))
+# Number of most recent turns, including the current one, kept verbatim
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "2"))
+# Number of intermediate outputs kept in the checkpointed graph state and the Agent Actions tab
+INTERMEDIATE_OUTPUTS_MAX = int(os.getenv("INTERMEDIATE_OUTPUTS_MAX", "100"))
+# Number of figure ids kept in the checkpointed graph state; answers find their figures through the tool messages
+OUTPUT_FIGURE_IDS_MAX = int(os.getenv("OUTPUT_FIGURE_IDS_MAX", "100"))
+
+# Longest text kept from stdout, stderr or schema output in a compacted tool message
+TOOL_TEXT_MAX_CHARS = 500
+
+# Tool output fields kept when an older tool message is compacted. The thought and code are already
+# in the AIMessage's tool call, and previews, column summaries and figures were used when the agent answered.
+_COMPACT_FIELDS = ("query", "query_id", "row_count", "columns", "truncated", "tables", "variables", "figures_created", "message")
+_TEXT_FIELDS = ("output", "stderr", "schema")
+_USED_FIELDS = ("preview", "column_summary")
+# Tool output fields shown in the UI only; they vary between otherwise identical runs.
+# Figure ids are random, so the model is told how many figures were created instead.
+_UI_ONLY_FIELDS = ("cache", "output_figure_ids")
+
+
+def _truncate(text: str, max_chars: int = TOOL_TEXT_MAX_CHARS) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"... [{len(text) - max_chars} characters omitted]"
+
+
+def compact_tool_output(content: str, drop_only_used: bool = False) -> str:
+    """
+    Shrinks a tool message's JSON content. With drop_only_used, only the preview and column summary,
+    which the agent has already answered from, are removed; otherwise only the essential fields are kept
+    and long text is truncated.
+    """
+    try:
+        output = json.loads(content)
+    except (json.JSONDecodeError, TypeError):
+        return _truncate(str(content))
+    if not isinstance(output, dict):
+        return _truncate(content)
+
+    if drop_only_used:
+        compact = {key: value for key, value in output.items() if key not in _USED_FIELDS + _UI_ONLY_FIELDS}
+    else:
+        compact = {key: output[key] for key in _COMPACT_FIELDS if key in output}
+        for key in _TEXT_FIELDS:
+            if output.get(key):
+                compact[key] = _truncate(str(output[key]))
+    return json.dumps(compact, default=str)
+
+
+def _without_ui_fields(message):
+    if not isinstance(message, ToolMessage) or not any(f'"{field}"' in message.content for field in _UI_ONLY_FIELDS):
+        return message
+    try:
+        output = json.loads(message.content)
+    except (json.JSONDecodeError, TypeError):
+        return message
+    if not isinstance(output, dict):
+        return message
+    figure_ids = output.get("output_figure_ids")
+    output = {key: value for key, value in output.items() if key not in _UI_ONLY_FIELDS}
+    if figure_ids:
+        output["figures_created"] = len(figure_ids)
+    return message.model_copy(update={"content": json.dumps(output, default=str)})
+
+
+def message_tokens(message) -> int:
+    tokens = estimate_tokens(message.content if isinstance(message.content, str) else json.dumps(message.content))
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += estimate_tokens(json.dumps(tool_call["args"], default=str))
+    return tokens
+
+
+def _split_turns(messages: list) -> list:
+    """
+    Groups messages into turns, each starting at a HumanMessage.
+    """
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _compact_turn(turn: list, drop_only_used: bool) -> list:
+    return [
+        message.model_copy(update={"content": compact_tool_output(message.content, drop_only_used)})
+        if isinstance(message, ToolMessage) else message
+        for message in turn
+    ]
+
+
+def _collapse_turn(turn: list) -> list:
+    """
+    Reduces a turn to the user's question and the agent's final answer.
+    """
+    collapsed = [message for message in turn if isinstance(message, HumanMessage)]
+    answers = [message for message in turn if isinstance(message, AIMessage) and not message.tool_calls and message.content]
+    if answers:
+        collapsed.append(AIMessage(content=answers[-1].content))
+    return collapsed
+
+
+def compact_messages(messages: list, token_budget: int = None, recent_turns: int = None) -> list:
+    """
+    Builds the conversation sent to the model so its size stays roughly constant as a session grows:
+    1. Schema summaries from earlier turns are dropped, since the latest one is always included,
+       and fields meant only for the UI are removed from tool outputs.
+    2. The most recent turns are kept verbatim, except for previews the agent has already answered from.
+       Tool outputs in older turns are reduced to their essential fields.
+    3. While over the token budget, the oldest turns are collapsed to question and answer, then omitted.
+    The rest of the current turn is never changed.
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    recent_turns = CONTEXT_RECENT_TURNS if recent_turns is None else recent_turns
+
+    last_system_index = max((i for i, message in enumerate(messages) if isinstance(message, SystemMessage)), default=None)
+    messages = [
+        _without_ui_fields(message) for i, message in enumerate(messages)
+        if not isinstance(message, SystemMessage) or i == last_system_index
+    ]
+
+    turns = _split_turns(messages)
+    first_recent = max(len(turns) - max(recent_turns, 1), 0)
+    turns = [
+        turn if i == len(turns) - 1 else _compact_turn(turn, drop_only_used=i >= first_recent)
+        for i, turn in enumerate(turns)
+    ]
+
+    turn_tokens = [sum(message_tokens(message) for message in turn) for turn in turns]
+    total = sum(turn_tokens)
+    for i in range(len(turns) - 1):
+        if total <= token_budget:
+            break
+        turns[i] = _collapse_turn(turns[i])
+        new_tokens = sum(message_tokens(message) for message in turns[i])
+        total += new_tokens - turn_tokens[i]
+        turn_tokens[i] = new_tokens
+
+    omitted = 0
+    while total > token_budget and omitted < len(turns) - 1:
+        total -= turn_tokens[omitted]
+        omitted += 1
+
+    compacted = [message for turn in turns[omitted:] for message in turn]
+    if omitted:
+        note = SystemMessage(content=(
+            f"{omitted} earlier turn(s) of this conversation were omitted to save space. "
+            "Variables and query results from them are still available in Python."
+        ))
+        compacted.insert(0, note)
+    return compacted
+
+
+def trim_intermediate_outputs(outputs: list) -> list:
+    """
+    Keeps the most recent INTERMEDIATE_OUTPUTS_MAX intermediate outputs.
+    """
+    return outputs[-INTERMEDIATE_OUTPUTS_MAX:] if INTERMEDIATE_OUTPUTS_MAX > 0 else outputs
+
+
+def trim_figure_ids(figure_ids: list) -> list:
+    """
+    Keeps the most recent OUTPUT_FIGURE_IDS_MAX figure ids.
+    """
+    return figure_ids[-OUTPUT_FIGURE_IDS_MAX:] if OUTPUT_FIGURE_IDS_MAX > 0 else figure_ids
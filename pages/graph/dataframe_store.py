@@ -0,0 +1,183 @@
+from collections import OrderedDict
+import os
+import pickle
+import tempfile
+import threading
+import uuid
+import pandas as pd
+
+# Memory budget for resident DataFrames, and where evicted frames are spilled
+DATAFRAME_STORE_MAX_BYTES = int(os.getenv("DATAFRAME_STORE_MAX_BYTES", str(1024 ** 3)))
+DATAFRAME_SPILL_DIR = os.getenv("DATAFRAME_SPILL_DIR", os.path.join(tempfile.gettempdir(), "dataframe_store"))
+
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def write_frame_file(df: pd.DataFrame, path: str) -> str:
+    """
+    Writes a DataFrame to an uncompressed Arrow IPC file so it can be memory-mapped back.
+    Frames Arrow cannot represent (e.g. duplicate column names) fall back to pickle.
+    """
+    try:
+        import pyarrow as pa
+
+        # RangeIndexes are kept as metadata rather than materialized as a column
+        table = pa.Table.from_pandas(df, preserve_index=None)
+        with pa.OSFile(path + ".arrow", "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return path + ".arrow"
+    except Exception:
+        with open(path + ".pickle", "wb") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path + ".pickle"
+
+
+def read_frame_file(path: str) -> pd.DataFrame:
+    if path.endswith(".arrow"):
+        import pyarrow as pa
+
+        with pa.memory_map(path, "r") as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class DataFrameStore:
+    """
+    Dict-like store for query results with a memory budget.
+    Least recently used frames are spilled to disk once the resident bytes exceed max_bytes,
+    and are transparently reloaded (memory-mapped) when accessed again. Frames larger than max_bytes
+    are never resident: they stay on disk and are read from there on each access.
+    """
+
+    def __init__(self, max_bytes: int = None, spill_dir: str = None):
+        self.max_bytes = DATAFRAME_STORE_MAX_BYTES if max_bytes is None else max_bytes
+        self.spill_dir = DATAFRAME_SPILL_DIR if spill_dir is None else spill_dir
+        self._resident = OrderedDict()
+        self._resident_bytes = {}
+        self._spilled = {}
+        self._spilled_bytes = {}
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "spill_hits": 0, "misses": 0, "evictions": 0}
+
+    def __setitem__(self, key: str, df: pd.DataFrame):
+        with self._lock:
+            self._discard(key)
+            nbytes = dataframe_nbytes(df)
+            if nbytes > self.max_bytes:
+                # Holding it would push every other frame out and then spill it anyway
+                self._spill(key, df, nbytes)
+                return
+            self._resident[key] = df
+            self._resident_bytes[key] = nbytes
+            self._evict()
+
+    def __getitem__(self, key: str) -> pd.DataFrame:
+        with self._lock:
+            if key in self._resident:
+                self._stats["hits"] += 1
+                self._resident.move_to_end(key)
+                return self._resident[key]
+            if key in self._spilled:
+                self._stats["spill_hits"] += 1
+                df = read_frame_file(self._spilled[key])
+                if self._spilled_bytes[key] > self.max_bytes:
+                    return df
+                remove_file(self._spilled.pop(key))
+                del self._spilled_bytes[key]
+                self._resident[key] = df
+                self._resident_bytes[key] = dataframe_nbytes(df)
+                self._evict()
+                return df
+            self._stats["misses"] += 1
+            raise KeyError(key)
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            self._discard(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._resident or key in self._spilled
+
+    def __len__(self) -> int:
+        return len(self._resident) + len(self._spilled)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._resident) + list(self._spilled)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self._lock:
+            for key in self.keys():
+                self._discard(key)
+
+    def stats(self) -> dict:
+        """
+        Returns memory accounting and hit-rate counters for the store.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["spill_hits"] + stats["misses"]
+            stats.update({
+                "frames_resident": len(self._resident),
+                "frames_spilled": len(self._spilled),
+                "bytes_resident": sum(self._resident_bytes.values()),
+                "bytes_spilled": sum(self._spilled_bytes.values()),
+                "max_bytes": self.max_bytes,
+                "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+            })
+        return stats
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._resident_bytes.values())
+
+    def shrink(self, max_bytes: int) -> int:
+        """
+        Spills least recently used frames until at most max_bytes are resident. Returns the bytes spilled.
+        """
+        with self._lock:
+            before = self.resident_bytes()
+            self._evict(max_bytes)
+            return before - self.resident_bytes()
+
+    def _discard(self, key: str):
+        if key in self._resident:
+            del self._resident[key]
+            del self._resident_bytes[key]
+        if key in self._spilled:
+            remove_file(self._spilled.pop(key))
+            del self._spilled_bytes[key]
+
+    def _evict(self, max_bytes: int = None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        while self._resident and sum(self._resident_bytes.values()) > max_bytes:
+            key, df = self._resident.popitem(last=False)
+            self._spill(key, df, self._resident_bytes.pop(key))
+            self._stats["evictions"] += 1
+
+    def _spill(self, key: str, df: pd.DataFrame, nbytes: int):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._spilled[key] = write_frame_file(df, os.path.join(self.spill_dir, uuid.uuid4().hex))
+        self._spilled_bytes[key] = nbytes
@@ -1,18 +1,231 @@
-from sqlalchemy import create_engine, inspect
-from sqlalchemy.engine import Engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import Session
-from contextlib import contextmanager
+from sqlalchemy.pool import NullPool
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import os
+import threading
+import time
 from .state import AgentState
 
+# Pool configuration, overridable through the environment
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+ENGINE_IDLE_TIMEOUT = int(os.getenv("DB_ENGINE_IDLE_TIMEOUT", "3600"))
+
+# Process-wide engine registry, keyed by normalized db_uri
+_engine_registry = {}
+_engine_last_used = {}
+_registry_lock = threading.Lock()
+
+# Async engines, keyed by normalized db_uri; each is tied to the event loop that created it
+_async_engine_registry = {}
+
+# Async DBAPI drivers used for each backend by the asyncio code path
+_ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+pool_stats = {
+    "engine_hits": 0,
+    "engine_misses": 0,
+    "engines_disposed": 0,
+    "checkouts": 0,
+    "new_connections": 0,
+    "checkout_wait_seconds": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _record(key: str, amount=1):
+    with _stats_lock:
+        pool_stats[key] += amount
+
+
+def normalize_db_uri(db_uri: str) -> str:
+    """
+    Normalizes a database URI so that equivalent URIs share one engine.
+    SQLite file paths are made absolute; other URIs are rendered in SQLAlchemy's canonical form.
+    """
+    url = make_url(db_uri)
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        url = url.set(database=os.path.abspath(url.database))
+    return url.render_as_string(hide_password=False)
+
+
+def _pool_kwargs(db_uri: str) -> dict:
+    url = make_url(db_uri)
+    kwargs = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    # In-memory SQLite uses a singleton pool that does not accept sizing arguments
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        kwargs["pool_size"] = POOL_SIZE
+        kwargs["max_overflow"] = POOL_MAX_OVERFLOW
+    return kwargs
+
+
+def _create_pooled_engine(db_uri: str) -> Engine:
+    engine = create_engine(db_uri, **_pool_kwargs(db_uri))
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        _record("new_connections")
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        _record("checkouts")
+
+    return engine
+
+
+def get_engine_for_uri(db_uri: str) -> Engine:
+    """
+    Returns the shared, pooled engine for a database URI, creating it on first use.
+    Engines that have been idle for longer than ENGINE_IDLE_TIMEOUT are disposed along the way.
+    """
+    key = normalize_db_uri(db_uri)
+    dispose_idle_engines()
+    with _registry_lock:
+        engine = _engine_registry.get(key)
+        if engine is None:
+            _record("engine_misses")
+            engine = _create_pooled_engine(key)
+            _engine_registry[key] = engine
+        else:
+            _record("engine_hits")
+        _engine_last_used[key] = time.monotonic()
+    return engine
+
+
 def get_db_engine(state: AgentState) -> Engine:
     """
-    Creates and returns an SQLAlchemy engine based on the database configuration in the state.
-    The engine is created with the appropriate database type and URI from the state.
+    Returns the shared SQLAlchemy engine for the database configuration in the state.
+    Engines are pooled per normalized db_uri and reused across calls and sessions.
     """
     if "db_type" not in state["input_data"] or "db_uri" not in state["input_data"]:
         raise ValueError("Database configuration (db_type and db_uri) must be provided in the state")
-    
-    return create_engine(state["input_data"]["db_uri"])
+
+    return get_engine_for_uri(state["input_data"]["db_uri"])
+
+
+def dispose_idle_engines(max_idle: float = None) -> int:
+    """
+    Disposes engines that have not been requested for more than max_idle seconds.
+    Returns the number of engines disposed.
+    """
+    max_idle = ENGINE_IDLE_TIMEOUT if max_idle is None else max_idle
+    now = time.monotonic()
+    with _registry_lock:
+        idle_keys = [key for key, last_used in _engine_last_used.items() if now - last_used > max_idle]
+        idle_engines = [_engine_registry.pop(key) for key in idle_keys]
+        for key in idle_keys:
+            del _engine_last_used[key]
+    for engine in idle_engines:
+        engine.dispose()
+    if idle_engines:
+        _record("engines_disposed", len(idle_engines))
+    return len(idle_engines)
+
+
+def dispose_all_engines():
+    """
+    Disposes every registered engine, e.g. on shutdown or in tests.
+    """
+    dispose_idle_engines(max_idle=-1)
+
+
+def get_pool_stats() -> dict:
+    """
+    Returns a snapshot of the engine registry and connection pool counters.
+    """
+    with _stats_lock:
+        stats = dict(pool_stats)
+    checkouts = stats["checkouts"]
+    stats["pool_hits"] = max(checkouts - stats["new_connections"], 0)
+    stats["pool_hit_rate"] = stats["pool_hits"] / checkouts if checkouts else 0.0
+    with _registry_lock:
+        stats["engines"] = {key: engine.pool.status() for key, engine in _engine_registry.items()}
+    return stats
+
+
+def _async_uri(db_uri: str):
+    """
+    The async-driver form of a database URI, or None if the backend has no supported async driver.
+    """
+    url = make_url(db_uri)
+    backend = url.get_backend_name()
+    driver = _ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        return None
+    return url.set(drivername=f"{backend}+{driver}").render_as_string(hide_password=False)
+
+
+def get_async_engine_for_uri(db_uri: str):
+    """
+    Returns the shared async engine for a database URI, or None if no async driver is installed for it,
+    in which case callers fall back to the synchronous engine in a worker thread.
+    Engines are recreated if they were created under a different event loop.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    key = normalize_db_uri(db_uri)
+    loop = asyncio.get_running_loop()
+    with _registry_lock:
+        entry = _async_engine_registry.get(key)
+        if entry is not None and (entry[0] is None or entry[1] is loop):
+            _record("engine_hits")
+            return entry[0]
+        _record("engine_misses")
+        if entry is not None:
+            # Connections belong to the old loop; drop them without awaiting the loop that owns them
+            entry[0].sync_engine.dispose(close=False)
+
+        async_uri = _async_uri(key)
+        if make_url(key).get_backend_name() == "sqlite":
+            # aiosqlite runs each open connection on its own non-daemon thread, so pooled connections
+            # would keep the process alive after the event loop exits; opening a SQLite file is cheap
+            kwargs = {"poolclass": NullPool}
+        else:
+            kwargs = _pool_kwargs(key)
+        try:
+            engine = create_async_engine(async_uri, **kwargs) if async_uri else None
+        except ImportError:
+            engine = None
+        if engine is not None:
+            event.listen(engine.sync_engine, "connect", lambda *args: _record("new_connections"))
+            event.listen(engine.sync_engine, "checkout", lambda *args: _record("checkouts"))
+        _async_engine_registry[key] = (engine, loop)
+    return engine
+
+
+async def dispose_async_engines():
+    """
+    Closes the pooled connections of async engines created under the running event loop, e.g. on server shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    with _registry_lock:
+        keys = [key for key, (engine, engine_loop) in _async_engine_registry.items() if engine_loop is loop]
+        engines = [_async_engine_registry.pop(key)[0] for key in keys]
+    for engine in engines:
+        if engine is not None:
+            await engine.dispose()
+    _record("engines_disposed", sum(engine is not None for engine in engines))
+
+
+def get_async_db_engine(state: AgentState):
+    """
+    Returns the shared async engine for the database configuration in the state, or None if no
+    async driver is available for it.
+    """
+    if "db_type" not in state["input_data"] or "db_uri" not in state["input_data"]:
+        raise ValueError("Database configuration (db_type and db_uri) must be provided in the state")
+
+    return get_async_engine_for_uri(state["input_data"]["db_uri"])
+
 
 @contextmanager
 def get_db_session(state: AgentState):
@@ -32,14 +245,32 @@ def get_db_session(state: AgentState):
 @contextmanager
 def get_db_connection(state: AgentState):
     """
-    Provides a database connection context manager that automatically handles connection cleanup.
+    Provides a pooled database connection context manager that automatically returns the connection to the pool.
     Usage:
         with get_db_connection(state) as connection:
             # Use connection here
     """
     engine = get_db_engine(state)
+    start = time.perf_counter()
     connection = engine.connect()
+    _record("checkout_wait_seconds", time.perf_counter() - start)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+@asynccontextmanager
+async def get_async_db_connection(engine):
+    """
+    Provides a pooled async database connection that is returned to the pool on exit.
+    Usage:
+        async with get_async_db_connection(engine) as connection:
+            df, result_info = await connection.run_sync(read_sql, sql)
+    """
+    start = time.perf_counter()
+    connection = await engine.connect()
+    _record("checkout_wait_seconds", time.perf_counter() - start)
     try:
         yield connection
     finally:
-        connection.close() 
\ No newline at end of file
+        await connection.close()
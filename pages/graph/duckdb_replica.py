@@ -0,0 +1,408 @@
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import warnings
+import pandas as pd
+from .db_utils import normalize_db_uri
+from .dataframe_store import dataframe_nbytes
+from .result_cache import get_data_version
+from .schema import get_cached_schema
+from .sql_guard import SQL_STATEMENT_TIMEOUT, statement_timeout_error
+from .sql_runner import ColumnSummary, ingest_result, SQL_CHUNK_SIZE, SQL_MAX_ROWS, SQL_MAX_BYTES, SQL_DTYPE_BACKEND
+
+# Optional local DuckDB replica of the connected database for make_sql_query (requires duckdb 1.4 or later).
+# Tables are copied on first use and kept in a file under DUCKDB_REPLICA_DIR. SQLite sources are rechecked when
+# the database file changes, server databases at most every DUCKDB_REPLICA_REFRESH seconds: new rows are appended
+# by integer primary key, and other changes reload the table.
+DUCKDB_REPLICA_ENABLED = os.getenv("DUCKDB_REPLICA_ENABLED", "false").lower() in ("1", "true", "yes")
+DUCKDB_REPLICA_DIR = os.getenv("DUCKDB_REPLICA_DIR", os.path.join(tempfile.gettempdir(), "duckdb_replicas"))
+DUCKDB_REPLICA_REFRESH = float(os.getenv("DUCKDB_REPLICA_REFRESH", "30"))
+# Seconds after which a server table is reloaded in full, to pick up updates that leave its row count unchanged
+DUCKDB_REPLICA_MAX_AGE = float(os.getenv("DUCKDB_REPLICA_MAX_AGE", "3600"))
+
+# Rows copied from the source database per batch
+_COPY_CHUNK_SIZE = 50000
+# Cheap check before the replica is opened; _is_single_select decides with DuckDB's parser
+_READ_ONLY = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+# Replicated tables and how far each has been copied, stored alongside them in the replica file
+_METADATA_TABLE = "_replica_tables"
+# DuckDB's NULL ordering for ORDER BY without NULLS FIRST/LAST, by source dialect. MySQL is not replicated:
+# its default collations compare and group text case-insensitively, unlike DuckDB.
+_NULL_ORDER = {
+    "sqlite": "nulls_first_on_asc_last_on_desc",
+    "postgresql": "nulls_last_on_asc_first_on_desc",
+}
+# Only scans, joins, filters and aggregates run on the replica. Expressions and functions outside these lists
+# (LIKE, GLOB, regular expressions, COLLATE, casts, division, date and window functions) behave differently in
+# DuckDB than in the source dialects, so queries using them run on the source database.
+_PORTABLE_EXPRESSIONS = {
+    "COLUMN_REF", "CONSTANT", "STAR", "COMPARISON", "CONJUNCTION", "OPERATOR", "BETWEEN", "CASE", "SUBQUERY", "FUNCTION",
+}
+_PORTABLE_FUNCTIONS = {
+    "count", "count_star", "sum", "avg", "min", "max", "coalesce", "abs", "round", "upper", "lower", "length",
+    "+", "-", "*", "||",
+}
+_PORTABLE_TABLES = {"BASE_TABLE", "JOIN", "SUBQUERY"}
+_TABLE_TYPES = {"BASE_TABLE", "JOIN", "SUBQUERY", "TABLE_FUNCTION", "EXPRESSION_LIST", "PIVOT", "SHOW_REF", "COLUMN_DATA"}
+
+# Replicas by normalized db_uri; False when the replica file could not be opened (e.g. locked by another process)
+_replicas = {}
+_replicas_lock = threading.Lock()
+_stats = {"queries": 0, "fallbacks": 0, "not_portable": 0, "tables_loaded": 0, "rows_appended": 0}
+_stats_lock = threading.Lock()
+
+
+def _record(key: str, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _import_duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        warnings.warn("DUCKDB_REPLICA_ENABLED is set but duckdb is not installed; queries run on the source database.")
+        return None
+    return duckdb
+
+
+def _arrow_to_pandas(table):
+    """
+    Converts a DuckDB result to pandas without copying where Arrow allows it: with the "pyarrow" dtype backend
+    every column keeps its Arrow buffers, otherwise numeric columns without nulls are wrapped as numpy arrays.
+    """
+    import pyarrow as pa
+
+    # Wide integer aggregates (SUM of BIGINT) arrive as decimal128 and would become Python Decimal objects
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            try:
+                column = table.column(i).cast(pa.int64() if field.type.scale == 0 else pa.float64())
+            except pa.ArrowInvalid:
+                column = table.column(i).cast(pa.float64(), safe=False)
+            table = table.set_column(i, field.name, column)
+    if SQL_DTYPE_BACKEND == "pyarrow":
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _is_single_select(duckdb, sql_query: str) -> bool:
+    """
+    Whether the text is exactly one SELECT statement. Anything else, including several statements, is not run on the replica.
+    """
+    try:
+        statements = duckdb.extract_statements(sql_query)
+    except duckdb.Error:
+        return False
+    return len(statements) == 1 and statements[0].type == duckdb.StatementType.SELECT
+
+
+def _is_portable(node) -> bool:
+    """
+    Whether a query parsed by DuckDB's json_serialize_sql uses only expressions, functions and table references
+    that give the same results on the replica as on the source database.
+    """
+    if isinstance(node, list):
+        return all(_is_portable(item) for item in node)
+    if not isinstance(node, dict):
+        return True
+    if "class" in node:
+        if node["class"] not in _PORTABLE_EXPRESSIONS:
+            return False
+        if node["class"] == "FUNCTION" and node.get("function_name", "").lower() not in _PORTABLE_FUNCTIONS:
+            return False
+    elif isinstance(node.get("type"), str):
+        if node["type"] in _TABLE_TYPES and node["type"] not in _PORTABLE_TABLES or node["type"] == "RECURSIVE_CTE_NODE":
+            return False
+    return all(_is_portable(value) for value in node.values())
+
+
+class Replica:
+    """
+    DuckDB copy of one source database, holding the tables queried so far.
+    """
+
+    def __init__(self, duckdb, engine):
+        self.duckdb = duckdb
+        self.engine = engine
+        self.db_uri = normalize_db_uri(engine.url.render_as_string(hide_password=False))
+        os.makedirs(DUCKDB_REPLICA_DIR, exist_ok=True)
+        self.path = os.path.join(DUCKDB_REPLICA_DIR, hashlib.sha256(self.db_uri.encode()).hexdigest()[:16] + ".duckdb")
+        # Agent SQL runs here, so the replica cannot read files or URLs, attach databases or load extensions.
+        # Tables are still filled from Arrow batches registered by this process.
+        self.connection = duckdb.connect(self.path, config={"enable_external_access": False})
+        # Match the source's integer arithmetic and NULL ordering
+        self.connection.execute("SET GLOBAL integer_division = true")
+        self.connection.execute(f"SET GLOBAL default_null_order = '{_NULL_ORDER[engine.dialect.name]}'")
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {_METADATA_TABLE} (name VARCHAR PRIMARY KEY, columns VARCHAR, "
+            "key_column VARCHAR, high_water BIGINT, row_count BIGINT, data_version VARCHAR, loaded_at DOUBLE)"
+        )
+        # No query can change the settings above once they are in place
+        self.connection.execute("SET lock_configuration = true")
+        self.tables = {
+            row[0]: dict(zip(("columns", "key_column", "high_water", "row_count", "data_version", "loaded_at"), row[1:]))
+            for row in self.connection.execute(f"SELECT * FROM {_METADATA_TABLE}").fetchall()
+        }
+        self.checked_at = {}
+        # Tables whose data could not be copied; queries using them run on the source database
+        self.unsupported = set()
+        # Held while tables are copied or refreshed; queries run on their own cursors meanwhile
+        self.lock = threading.Lock()
+
+    def _quote(self, name: str) -> str:
+        return self.engine.dialect.identifier_preparer.quote(name)
+
+    def _copy(self, source_connection, select_sql: str, target: str, create: bool) -> int:
+        """
+        Streams the rows of a source query into a replica table through Arrow batches. Returns the rows copied.
+        """
+        import pyarrow as pa
+
+        rows = 0
+        streaming = source_connection.execution_options(stream_results=True, max_row_buffer=_COPY_CHUNK_SIZE)
+        for chunk in pd.read_sql_query(select_sql, streaming, chunksize=_COPY_CHUNK_SIZE):
+            batch = pa.Table.from_pandas(chunk, preserve_index=False)
+            if create:
+                # Columns that are all NULL in the first batch get a text type rather than DuckDB's NULL type
+                batch = batch.cast(pa.schema([
+                    pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field for field in batch.schema
+                ]))
+            self.connection.register("replica_batch", batch)
+            try:
+                if create:
+                    self.connection.execute(f'CREATE OR REPLACE TABLE "{target}" AS SELECT * FROM replica_batch')
+                    create = False
+                else:
+                    self.connection.execute(f'INSERT INTO "{target}" SELECT * FROM replica_batch')
+            finally:
+                self.connection.unregister("replica_batch")
+            rows += len(chunk)
+        return rows
+
+    def _load(self, source_connection, table: str, columns: list):
+        """
+        Copies a whole table into a staging table, then swaps it in so queries never see a partial copy.
+        """
+        staging = f"{table}__loading"
+        self.connection.execute(f'DROP TABLE IF EXISTS "{staging}"')
+        self._copy(source_connection, f"SELECT * FROM {self._quote(table)}", staging, create=True)
+        if not self.connection.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [staging]
+        ).fetchone()[0]:
+            # Empty tables may yield no batches; create them with the source's column names
+            column_list = ", ".join(f'NULL::VARCHAR AS "{column}"' for column in columns)
+            self.connection.execute(f'CREATE TABLE "{staging}" AS SELECT {column_list} LIMIT 0')
+        self.connection.execute("BEGIN TRANSACTION")
+        self.connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+        self.connection.execute(f'ALTER TABLE "{staging}" RENAME TO "{table}"')
+        self.connection.execute("COMMIT")
+        _record("tables_loaded")
+
+    def sync_table(self, table: str, table_info: dict) -> bool:
+        """
+        Copies a table on first use, or brings it up to date with the source. Returns False if it cannot be replicated.
+        """
+        if table in self.unsupported:
+            return False
+        data_version = get_data_version(self.db_uri)
+        columns = [column["name"] for column in table_info["columns"]]
+        state = self.tables.get(table)
+        current = state is not None and state["columns"] == ",".join(columns)
+        if current and data_version and data_version == state["data_version"]:
+            return True
+        if current and not data_version and time.monotonic() - self.checked_at.get(table, float("-inf")) < DUCKDB_REPLICA_REFRESH:
+            return True
+
+        keys = [column for column in table_info["columns"] if column["primary_key"]]
+        key = keys[0]["name"] if len(keys) == 1 and "INT" in keys[0]["type"].upper() else None
+        try:
+            with self.engine.connect() as source_connection:
+                high_water_sql = f"MAX({self._quote(key)})" if key else "NULL"
+                row_count, high_water = source_connection.execute(
+                    text(f"SELECT COUNT(*), {high_water_sql} FROM {self._quote(table)}")
+                ).one()
+                # SQLite versions cover every write to the file, so only server tables expire by age
+                fresh = current and (data_version or time.time() - state["loaded_at"] < DUCKDB_REPLICA_MAX_AGE)
+                loaded_at = state["loaded_at"] if fresh else time.time()
+                if fresh and (row_count, high_water) == (state["row_count"], state["high_water"]):
+                    pass
+                elif fresh and key and state["high_water"] is not None and row_count > state["row_count"]:
+                    appended = self._copy(
+                        source_connection,
+                        f"SELECT * FROM {self._quote(table)} WHERE {self._quote(key)} > {int(state['high_water'])}",
+                        table, create=False,
+                    ) if high_water > state["high_water"] else 0
+                    _record("rows_appended", appended)
+                    if self.connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] != row_count:
+                        # Rows were also deleted or inserted below the high-water mark
+                        self._load(source_connection, table, columns)
+                        loaded_at = time.time()
+                else:
+                    self._load(source_connection, table, columns)
+        except SQLAlchemyError:
+            # The source is unreachable or the table changed underneath; the query's own error surfaces from the source
+            return False
+        except (self.duckdb.Error, ValueError, TypeError, NotImplementedError):
+            # Values Arrow or DuckDB cannot represent, e.g. mixed types in one column (Arrow errors subclass these)
+            self.unsupported.add(table)
+            return False
+
+        state = {
+            "columns": ",".join(columns), "key_column": key, "high_water": high_water, "row_count": row_count,
+            "data_version": data_version or None, "loaded_at": loaded_at,
+        }
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO {_METADATA_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)", [table, *state.values()]
+        )
+        self.tables[table] = state
+        self.checked_at[table] = time.monotonic()
+        return True
+
+    def is_portable(self, sql_query: str) -> bool:
+        """
+        Whether a query gives the same result on the replica as on the source database; see _is_portable.
+        """
+        cursor = self.connection.cursor()
+        try:
+            parsed = json.loads(cursor.execute("SELECT json_serialize_sql(?)", [sql_query]).fetchone()[0])
+        except self.duckdb.Error:
+            return False
+        finally:
+            cursor.close()
+        return not parsed.get("error") and _is_portable(parsed["statements"])
+
+    def read_sql(self, sql_query: str):
+        """
+        Runs a query on the replica with the same row and memory caps, statement timeout, column summary
+        and dtype compaction as read_sql on the source.
+        """
+        import pyarrow as pa
+
+        cursor = self.connection.cursor()
+        timer = threading.Timer(SQL_STATEMENT_TIMEOUT, cursor.interrupt) if SQL_STATEMENT_TIMEOUT else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            result = cursor.execute(sql_query)
+            reader = result.to_arrow_reader(SQL_CHUNK_SIZE) if hasattr(result, "to_arrow_reader") else result.fetch_record_batch(SQL_CHUNK_SIZE)
+            batches, rows, nbytes, truncated = [], 0, 0, None
+            for batch in reader:
+                if rows >= SQL_MAX_ROWS:
+                    truncated = "row" if batch.num_rows else truncated
+                    break
+                if batch.num_rows > SQL_MAX_ROWS - rows:
+                    batch = batch.slice(0, SQL_MAX_ROWS - rows)
+                    truncated = "row"
+                batches.append(batch)
+                rows += batch.num_rows
+                nbytes += batch.nbytes
+                if truncated:
+                    break
+                if nbytes >= SQL_MAX_BYTES:
+                    truncated = "byte"
+                    break
+            table = pa.Table.from_batches(batches, schema=reader.schema)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cursor.close()
+
+        df = _arrow_to_pandas(table)
+        summary = ColumnSummary()
+        summary.update(df)
+        df, result_info = ingest_result(df, {
+            "column_summary": summary.to_dict(), "truncated": truncated, "nbytes": dataframe_nbytes(df),
+        })
+        result_info["engine"] = "duckdb"
+        # The cost guard protects the source database and is not applied to queries served here
+        result_info["guard"] = {
+            "action": "bypassed", "estimate": None,
+            "hint": "Run on the DuckDB replica, so the source database's cost guard was not applied.",
+        }
+        return df, result_info
+
+
+def get_replica(engine):
+    """
+    Returns the DuckDB replica of the engine's database, opening it on first use,
+    or None if the dialect is not replicated, duckdb is not installed or the replica file cannot be opened.
+    """
+    if engine.dialect.name not in _NULL_ORDER:
+        return None
+    duckdb = _import_duckdb()
+    if duckdb is None:
+        return None
+    key = normalize_db_uri(engine.url.render_as_string(hide_password=False))
+    with _replicas_lock:
+        replica = _replicas.get(key)
+        if replica is None:
+            try:
+                replica = Replica(duckdb, engine)
+            except duckdb.Error:
+                replica = False
+            _replicas[key] = replica
+    return replica or None
+
+
+def replica_read_sql(engine, sql_query: str):
+    """
+    Runs a read query on the DuckDB replica when DUCKDB_REPLICA_ENABLED is set and the query is portable,
+    copying or refreshing the tables it uses first. Raises TimeoutError if the query exceeds SQL_STATEMENT_TIMEOUT.
+
+    Returns:
+        tuple: (DataFrame, result_info as from read_sql, with "engine": "duckdb" and the bypassed "guard"),
+        or None when the query should run on the source database instead
+    """
+    if not DUCKDB_REPLICA_ENABLED or not _READ_ONLY.match(sql_query):
+        return None
+    replica = get_replica(engine)
+    if replica is None or not _is_single_select(replica.duckdb, sql_query):
+        return None
+    if not replica.is_portable(sql_query):
+        _record("not_portable")
+        return None
+    schema = get_cached_schema(engine)
+    tables = [
+        table for table in schema
+        if re.search(rf"(?<![\w$]){re.escape(table)}(?![\w$])", sql_query, re.IGNORECASE)
+    ]
+    if not tables:
+        return None
+    with replica.lock:
+        replicated = all(replica.sync_table(table, schema[table]) for table in tables)
+    if not replicated:
+        _record("fallbacks")
+        return None
+    try:
+        result = replica.read_sql(sql_query)
+    except replica.duckdb.InterruptException:
+        raise statement_timeout_error()
+    except replica.duckdb.Error:
+        # Syntax or functions DuckDB does not support, e.g. another dialect's date functions
+        _record("fallbacks")
+        return None
+    _record("queries")
+    return result
+
+
+def get_replica_stats() -> dict:
+    """
+    Queries served by the replicas, sent to the source database because they were not portable or could not run
+    on the replica, and the tables replicated so far.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    with _replicas_lock:
+        replicas = [replica for replica in _replicas.values() if replica]
+    stats["replicas"] = {
+        replica.path: {table: state["row_count"] for table, state in replica.tables.items()} for replica in replicas
+    }
+    return stats
@@ -0,0 +1,217 @@
+import math
+import os
+import warnings
+import numpy as np
+
+# Maximum number of points sent to the browser per figure; 0 disables decimation
+FIGURE_POINT_BUDGET = int(os.getenv("FIGURE_POINT_BUDGET", "20000"))
+# Traces are never reduced below this many points, however many traces a figure has
+MIN_POINTS_PER_TRACE = 500
+
+# Per-point trace attributes that must be subset together with x and y
+_PER_POINT_ATTRIBUTES = ("text", "hovertext", "customdata", "ids")
+_PER_POINT_MARKER_ATTRIBUTES = ("color", "size", "symbol", "opacity")
+
+
+def _numeric(values):
+    """
+    Converts x or y values to float64 for geometry, or returns None if they are not numeric.
+    Datetimes are converted to nanoseconds.
+    """
+    array = np.asarray(values)
+    if np.issubdtype(array.dtype, np.datetime64):
+        return array.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    if array.dtype == object or array.dtype.kind in "US":
+        try:
+            return array.astype(np.float64)
+        except (ValueError, TypeError):
+            pass
+        try:
+            import pandas as pd
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                dates = pd.to_datetime(array)
+            return dates.values.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+        except (ValueError, TypeError, OverflowError):
+            return None
+    if np.issubdtype(array.dtype, np.number) or array.dtype == bool:
+        return array.astype(np.float64)
+    return None
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling: indices of the points that best preserve the visual shape of a series.
+    Each bucket is anchored on the previous bucket's average rather than its selected point,
+    which lets all buckets be computed at once with numpy.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.nan_to_num(x)
+    y = np.nan_to_num(y)
+
+    # Interior points 1..n-2 are split into threshold - 2 buckets
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    starts = edges[:-1]
+    sizes = np.diff(edges)
+    bucket_ids = np.repeat(np.arange(threshold - 2), sizes)
+    mean_x = np.add.reduceat(x[1:n - 1], starts - 1) / sizes
+    mean_y = np.add.reduceat(y[1:n - 1], starts - 1) / sizes
+
+    anchor_x = np.concatenate(([x[0]], mean_x[:-1]))
+    anchor_y = np.concatenate(([y[0]], mean_y[:-1]))
+    next_x = np.concatenate((mean_x[1:], [x[-1]]))
+    next_y = np.concatenate((mean_y[1:], [y[-1]]))
+
+    interior_x, interior_y = x[1:n - 1], y[1:n - 1]
+    area = np.abs(
+        (anchor_x[bucket_ids] - next_x[bucket_ids]) * (interior_y - anchor_y[bucket_ids])
+        - (anchor_x[bucket_ids] - interior_x) * (next_y[bucket_ids] - anchor_y[bucket_ids])
+    )
+    # First point in each bucket with the bucket's largest triangle
+    is_max = area == np.maximum.reduceat(area, starts - 1)[bucket_ids]
+    candidates = np.flatnonzero(is_max)
+    _, first = np.unique(bucket_ids[candidates], return_index=True)
+    return np.concatenate(([0], candidates[first] + 1, [n - 1]))
+
+
+def grid_thin_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Keeps one point per occupied cell of a grid over the scatter's extent, so clusters are thinned
+    while the overall shape and outliers remain visible.
+    """
+    bins = max(int(math.sqrt(threshold)), 1)
+    valid = ~(np.isnan(x) | np.isnan(y))
+
+    def cell(values):
+        low, high = np.nanmin(values), np.nanmax(values)
+        scale = (high - low) or 1.0
+        return np.clip(((np.nan_to_num(values, nan=low) - low) / scale * bins).astype(np.int64), 0, bins - 1)
+
+    cells = np.where(valid, cell(x) * bins + cell(y), -1)
+    _, indices = np.unique(cells, return_index=True)
+    indices = np.sort(indices[cells[indices] >= 0])
+    if len(indices) > threshold:
+        indices = indices[::math.ceil(len(indices) / threshold)]
+    return indices
+
+
+def _subset_trace(trace_json: dict, indices: np.ndarray, n: int) -> dict:
+    for key in ("x", "y") + _PER_POINT_ATTRIBUTES:
+        values = trace_json.get(key)
+        if values is not None and not isinstance(values, str) and len(values) == n:
+            trace_json[key] = np.asarray(values)[indices]
+    marker = trace_json.get("marker") or {}
+    for key in _PER_POINT_MARKER_ATTRIBUTES:
+        values = marker.get(key)
+        if values is not None and not isinstance(values, (str, int, float)) and len(values) == n:
+            marker[key] = np.asarray(values)[indices]
+    return trace_json
+
+
+def _decimate_scatter(trace, budget: int):
+    """
+    Returns (new trace JSON, points kept, original points) for an oversized scatter trace, or None.
+    """
+    x, y = trace.x, trace.y
+    if y is None or isinstance(y, str):
+        return None
+    n = len(y)
+    if n <= budget:
+        return None
+    y_values = _numeric(y)
+    if y_values is None:
+        return None
+    x_values = _numeric(x) if x is not None and len(x) == n else None
+    if x_values is None:
+        x_values = np.arange(n, dtype=np.float64)
+
+    mode = trace.mode or "lines"
+    if "lines" in mode:
+        indices = lttb_indices(x_values, y_values, budget)
+    else:
+        indices = grid_thin_indices(x_values, y_values, budget)
+
+    trace_json = _subset_trace(trace.to_plotly_json(), indices, n)
+    # WebGL renders large point counts far faster than SVG
+    trace_json["type"] = "scattergl"
+    return trace_json, len(indices), n
+
+
+def _aggregate_histogram(trace, budget: int):
+    """
+    Pre-bins an oversized histogram of raw values into a bar trace, or returns None.
+    """
+    values = trace.x if trace.x is not None else trace.y
+    if values is None or isinstance(values, str) or len(values) <= budget:
+        return None
+    if trace.histfunc not in (None, "count") or trace.histnorm or (trace.x is not None and trace.y is not None):
+        return None
+    numeric = _numeric(values)
+    if numeric is None:
+        return None
+    numeric = numeric[~np.isnan(numeric)]
+    bins = trace.nbinsx or trace.nbinsy or "auto"
+    counts, edges = np.histogram(numeric, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    widths = np.diff(edges)
+    trace_json = {
+        "type": "bar",
+        "name": trace.name,
+        "marker": trace.marker.to_plotly_json() if trace.marker else None,
+        "showlegend": trace.showlegend,
+        "legendgroup": trace.legendgroup,
+        "xaxis": trace.xaxis,
+        "yaxis": trace.yaxis,
+        "offsetgroup": trace.offsetgroup,
+    }
+    if trace.x is not None:
+        trace_json.update({"x": centers, "y": counts, "width": widths})
+    else:
+        trace_json.update({"y": centers, "x": counts, "width": widths, "orientation": "h"})
+    return {key: value for key, value in trace_json.items() if value is not None}, len(counts), len(values)
+
+
+def decimate_figure(figure, point_budget: int = None):
+    """
+    Downsamples oversized line and scatter traces and pre-aggregates oversized histograms so the
+    figure stays within the point budget. Returns the original figure if nothing needed reducing,
+    otherwise a new figure with a note giving the original number of points.
+    """
+    import plotly.graph_objects as go
+
+    point_budget = FIGURE_POINT_BUDGET if point_budget is None else point_budget
+    if not point_budget or not isinstance(figure, go.Figure) or not figure.data:
+        return figure
+
+    per_trace_budget = max(point_budget // len(figure.data), MIN_POINTS_PER_TRACE)
+    traces = []
+    kept_points = original_points = 0
+    changed = False
+    for trace in figure.data:
+        reduced = None
+        if trace.type in ("scatter", "scattergl"):
+            reduced = _decimate_scatter(trace, per_trace_budget)
+        elif trace.type == "histogram":
+            reduced = _aggregate_histogram(trace, per_trace_budget)
+        if reduced is None:
+            traces.append(trace)
+            continue
+        trace_json, kept, original = reduced
+        traces.append(trace_json)
+        kept_points += kept
+        original_points += original
+        changed = True
+
+    if not changed:
+        return figure
+
+    decimated = go.Figure(data=traces, layout=figure.layout)
+    decimated.add_annotation(
+        text=f"Reduced for display from {original_points:,} points to {kept_points:,}",
+        xref="paper", yref="paper", x=1, y=1, xanchor="right", yanchor="bottom",
+        showarrow=False, font={"size": 10, "color": "gray"},
+    )
+    return decimated
@@ -0,0 +1,165 @@
+from collections import OrderedDict
+import os
+import re
+import threading
+import uuid
+import time
+from .sessions import SESSION_CHECKPOINTS_ENABLED, SESSION_RESUME_TTL, SESSION_STORE_DIR
+from .dataframe_store import remove_file
+
+# Memory budget for serialized figures; least recently used figures are dropped beyond it
+FIGURE_REGISTRY_MAX_BYTES = int(os.getenv("FIGURE_REGISTRY_MAX_BYTES", str(256 * 1024 ** 2)))
+# With session checkpoints, figures are also written to disk so resumed conversations can show them again.
+# Least recently used files are removed beyond FIGURE_STORE_MAX_BYTES, and files unused for FIGURE_STORE_MAX_AGE
+# seconds (by default as long as a resume link stays valid).
+FIGURE_STORE_DIR = os.path.join(SESSION_STORE_DIR, "figures")
+FIGURE_STORE_MAX_BYTES = int(os.getenv("FIGURE_STORE_MAX_BYTES", str(1024 ** 3)))
+FIGURE_STORE_MAX_AGE = float(os.getenv("FIGURE_STORE_MAX_AGE", str(SESSION_RESUME_TTL)))
+
+# Process-wide registry of Plotly figures as JSON, keyed by figure id
+_figures = OrderedDict()
+_registry_lock = threading.Lock()
+_registry_bytes = 0
+
+
+def serialize_figure(figure) -> str:
+    """
+    Serializes a Plotly figure to JSON; numpy arrays are encoded as compact base64 binary arrays.
+    """
+    import plotly.io as pio
+
+    return pio.to_json(figure, validate=False)
+
+
+def _figure_path(figure_id: str):
+    """
+    File of a persisted figure, or None if the id is not one register_figure could have issued.
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", figure_id):
+        return None
+    return os.path.join(FIGURE_STORE_DIR, figure_id + ".json")
+
+
+def _remember(figure_id: str, figure_json: str):
+    global _registry_bytes
+    with _registry_lock:
+        if figure_id in _figures:
+            return
+        _figures[figure_id] = figure_json
+        _registry_bytes += len(figure_json)
+        while _registry_bytes > FIGURE_REGISTRY_MAX_BYTES and len(_figures) > 1:
+            _, evicted = _figures.popitem(last=False)
+            _registry_bytes -= len(evicted)
+
+
+def _forget(figure_ids: list):
+    global _registry_bytes
+    with _registry_lock:
+        for figure_id in figure_ids:
+            figure_json = _figures.pop(figure_id, None)
+            if figure_json is not None:
+                _registry_bytes -= len(figure_json)
+
+
+def _evict_files():
+    """
+    Removes persisted figures beyond FIGURE_STORE_MAX_BYTES or older than FIGURE_STORE_MAX_AGE, least recently
+    used first, and drops their in-memory copies so a figure is either available or gone everywhere.
+    """
+    entries = []
+    for name in os.listdir(FIGURE_STORE_DIR):
+        if name.startswith("."):
+            continue
+        path = os.path.join(FIGURE_STORE_DIR, name)
+        try:
+            entries.append((os.path.getmtime(path), os.path.getsize(path), name))
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    oldest_kept = time.time() - FIGURE_STORE_MAX_AGE
+    evicted = []
+    for mtime, size, name in sorted(entries):
+        if total <= FIGURE_STORE_MAX_BYTES and mtime >= oldest_kept:
+            break
+        remove_file(os.path.join(FIGURE_STORE_DIR, name))
+        evicted.append(name.split(".")[0])
+        total -= size
+    _forget(evicted)
+
+
+def register_figure(figure_json: str) -> str:
+    """
+    Stores a serialized figure and returns its id.
+    """
+    figure_id = uuid.uuid4().hex
+    _remember(figure_id, figure_json)
+    if SESSION_CHECKPOINTS_ENABLED:
+        try:
+            os.makedirs(FIGURE_STORE_DIR, exist_ok=True)
+            # Write under a temporary name and rename, so a concurrent read never sees a partial figure
+            tmp_path = os.path.join(FIGURE_STORE_DIR, f".{figure_id}.tmp")
+            with open(tmp_path, "w") as f:
+                f.write(figure_json)
+            os.replace(tmp_path, _figure_path(figure_id))
+            _evict_files()
+        except OSError:
+            # The in-memory copy still serves this session
+            pass
+    return figure_id
+
+
+def get_figure_json(figure_id: str):
+    """
+    Returns the serialized figure, or None if it is unknown or was evicted and not persisted.
+    """
+    with _registry_lock:
+        figure_json = _figures.get(figure_id)
+        if figure_json is not None:
+            _figures.move_to_end(figure_id)
+    path = _figure_path(figure_id)
+    if not SESSION_CHECKPOINTS_ENABLED or path is None:
+        return figure_json
+    if figure_json is not None:
+        try:
+            # Marks the file as recently used for _evict_files
+            os.utime(path)
+        except OSError:
+            pass
+        return figure_json
+    try:
+        with open(path, "r") as f:
+            figure_json = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    _remember(figure_id, figure_json)
+    return figure_json
+
+
+def get_figure(figure_id: str):
+    """
+    Returns the figure as a plotly.graph_objects.Figure, or None if it is unknown or was evicted.
+    """
+    import plotly.io as pio
+
+    figure_json = get_figure_json(figure_id)
+    if figure_json is None:
+        return None
+    return pio.from_json(figure_json, skip_invalid=True)
+
+
+def discard_figures(figure_ids: list):
+    """
+    Removes figures that are no longer needed, from memory and from disk.
+    """
+    _forget(figure_ids)
+    if SESSION_CHECKPOINTS_ENABLED:
+        for figure_id in figure_ids:
+            path = _figure_path(figure_id)
+            if path is not None:
+                remove_file(path)
+
+
+def get_figure_registry_stats() -> dict:
+    with _registry_lock:
+        return {"figures": len(_figures), "bytes": _registry_bytes, "max_bytes": FIGURE_REGISTRY_MAX_BYTES}
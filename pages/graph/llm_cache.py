@@ -0,0 +1,161 @@
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import uuid
+import warnings
+from .dataframe_store import remove_file
+
+# LLM response cache. "cache" serves repeated prompts from disk and records new responses, "record" always
+# calls the model and records, "replay" serves recorded responses only and never calls the model, "off" disables it.
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "cache").lower()
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "llm_response_cache"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+
+# Recorded and replayed runs must send identical prompts, so inputs that are otherwise computed
+# in the background (column profiles) are waited for in these modes
+LLM_CACHE_DETERMINISTIC = LLM_CACHE_MODE in ("record", "replay")
+
+# Message fields that change from run to run without changing what the model sees
+_VOLATILE_FIELDS = ("id", "response_metadata", "usage_metadata")
+
+# "mode" is that of the cache in use, once one is created
+llm_cache_stats = {"hits": 0, "misses": 0, "writes": 0, "mode": None}
+_stats_lock = threading.Lock()
+
+
+class ReplayMissError(RuntimeError):
+    """
+    Raised in replay mode when no response was recorded for a prompt.
+    """
+
+
+def _record(key: str, amount=1):
+    with _stats_lock:
+        llm_cache_stats[key] += amount
+
+
+def _normalize_prompt(prompt: str) -> str:
+    """
+    Removes message ids and per-run metadata from serialized messages, so identical conversations
+    from different runs produce the same key.
+    """
+    try:
+        serialized = json.loads(prompt)
+    except ValueError:
+        return prompt
+
+    def strip(node):
+        if isinstance(node, list):
+            return [strip(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        node = {key: strip(value) for key, value in node.items()}
+        if isinstance(node.get("kwargs"), dict):
+            node["kwargs"] = {key: value for key, value in node["kwargs"].items() if key not in _VOLATILE_FIELDS}
+        return node
+
+    return json.dumps(strip(serialized), sort_keys=True)
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """
+    Hash of the rendered messages and the model configuration, which includes the model name,
+    its parameters and the bound tool schemas.
+    """
+    return hashlib.sha256((_normalize_prompt(prompt) + "\n" + llm_string).encode("utf-8")).hexdigest()
+
+
+class DiskLLMCache(BaseCache):
+    """
+    Exact-match cache of chat model responses, stored as one JSON file per prompt and shared by every
+    process using the same directory. Least recently used entries are removed beyond max_bytes.
+    """
+
+    def __init__(self, mode: str = None, cache_dir: str = None, max_bytes: int = None):
+        self.mode = LLM_CACHE_MODE if mode is None else mode
+        self.cache_dir = LLM_CACHE_DIR if cache_dir is None else cache_dir
+        self.max_bytes = LLM_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        with _stats_lock:
+            llm_cache_stats["mode"] = self.mode
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def lookup(self, prompt: str, llm_string: str):
+        if self.mode == "record":
+            return None
+        path = self._path(cache_key(prompt, llm_string))
+        try:
+            with open(path, "r") as f, warnings.catch_warnings():
+                # langchain_core marks loads as beta
+                warnings.simplefilter("ignore")
+                generations = loads(f.read())
+            # Touch the entry so eviction is least-recently-used
+            os.utime(path)
+        except (OSError, ValueError):
+            _record("misses")
+            if self.mode == "replay":
+                raise ReplayMissError(
+                    "No recorded model response for this conversation. "
+                    "Run it once with LLM_CACHE_MODE=record or cache to record it."
+                )
+            return None
+        _record("hits")
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        if self.mode == "replay":
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write under a temporary name and rename, so other processes never read a partial entry
+        tmp_path = os.path.join(self.cache_dir, f".{uuid.uuid4().hex}.json")
+        with open(tmp_path, "w") as f:
+            f.write(dumps(return_val))
+        os.replace(tmp_path, self._path(cache_key(prompt, llm_string)))
+        _record("writes")
+        self._evict()
+
+    def clear(self, **kwargs):
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                remove_file(os.path.join(self.cache_dir, name))
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("."):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            remove_file(path)
+            total -= size
+
+
+def get_llm_cache():
+    """
+    Returns the response cache for the configured LLM_CACHE_MODE, or None when caching is off.
+    """
+    if LLM_CACHE_MODE not in ("cache", "record", "replay"):
+        return None
+    return DiskLLMCache()
+
+
+def get_llm_cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(llm_cache_stats)
+    if stats["mode"] is None:
+        stats["mode"] = LLM_CACHE_MODE if LLM_CACHE_MODE in ("cache", "record", "replay") else "off"
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,198 @@
+import ast
+import json
+import os
+import pickle
+import shutil
+import sys
+import types
+import pandas as pd
+
+# Methods that commonly modify their object in place, e.g. df.drop(..., inplace=True) or items.append(x)
+_MUTATING_METHODS = {
+    "append", "extend", "insert", "remove", "pop", "clear", "update", "setdefault", "add", "discard",
+    "sort", "reverse", "drop", "rename", "fillna", "dropna", "reset_index", "set_index", "sort_values",
+    "sort_index", "replace", "drop_duplicates", "update_layout", "update_traces", "add_trace",
+}
+
+
+def _mutated_names(tree: ast.AST) -> set:
+    """
+    Names whose objects a piece of code modifies in place, through item or attribute
+    assignment, augmented assignment, del or a mutating method call.
+    """
+    def root_name(node):
+        while isinstance(node, (ast.Subscript, ast.Attribute)):
+            node = node.value
+        return node.id if isinstance(node, ast.Name) else None
+
+    names = set()
+    for node in ast.walk(tree):
+        targets = []
+        if isinstance(node, (ast.Assign, ast.Delete)):
+            targets = node.targets
+        elif isinstance(node, (ast.AugAssign, ast.AnnAssign)):
+            targets = [node.target]
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in _MUTATING_METHODS:
+            targets = [node.func]
+        for target in targets:
+            for element in (target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]):
+                if isinstance(element, (ast.Subscript, ast.Attribute)):
+                    name = root_name(element)
+                    if name:
+                        names.add(name)
+    return names
+
+
+def describe_value(value) -> str:
+    """
+    Short description of a variable for tool output, without rendering its contents.
+    """
+    if isinstance(value, pd.DataFrame):
+        return f"DataFrame ({value.shape[0]} rows x {value.shape[1]} columns)"
+    if isinstance(value, pd.Series):
+        return f"Series ({len(value)} values, dtype {value.dtype})"
+    if isinstance(value, (int, float, bool, str)) or value is None:
+        text = repr(value)
+        return text if len(text) <= 80 else text[:77] + "..."
+    if isinstance(value, (list, tuple, dict, set)):
+        return f"{type(value).__name__} ({len(value)} items)"
+    return type(value).__name__
+
+
+def value_nbytes(value) -> int:
+    """
+    Approximate memory held by a variable: deep size for pandas objects, nbytes for arrays, shallow size otherwise.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+class SessionNamespace:
+    """
+    Persistent globals for one session's Python code, created once and updated in place.
+    Each execute() records which names the code wrote, so only those need to be reported or checkpointed;
+    the bookkeeping is proportional to the number of names, not to the size of the values they hold.
+    The size of each user variable is kept up to date the same way, for memory accounting.
+    """
+
+    def __init__(self, base: dict = None):
+        self.globals = dict(base or {})
+        self.base_names = set(self.globals)
+        self.written = set()
+        self.deleted = set()
+        self.variable_bytes = {}
+
+    def execute(self, python_code: str):
+        """
+        Executes code in the namespace, updating written and deleted even if the code raises.
+        """
+        tree = ast.parse(python_code)
+        mutated = _mutated_names(tree)
+        # A shallow copy holds references only, so rebinding is detected with an identity check
+        before = dict(self.globals)
+        try:
+            exec(compile(tree, "<string>", "exec"), self.globals)
+        finally:
+            after = self.globals
+            self.written = {
+                name for name, value in after.items()
+                if (name not in before or before[name] is not value or name in mutated)
+                and not name.startswith("__")
+            }
+            self.deleted = {name for name in before if name not in after and not name.startswith("__")}
+            for name in self.deleted:
+                self.variable_bytes.pop(name, None)
+            for name, value in self.changed_values().items():
+                self.variable_bytes[name] = value_nbytes(value)
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory held by the user variables.
+        """
+        return sum(self.variable_bytes.values())
+
+    def user_variables(self) -> dict:
+        return {
+            name: value for name, value in self.globals.items()
+            if name not in self.base_names and not name.startswith("__")
+        }
+
+    def changed_values(self) -> dict:
+        """
+        Values of the user variables written by the last execute() call.
+        """
+        return {name: self.globals[name] for name in self.written if name not in self.base_names}
+
+    def describe_changes(self) -> dict:
+        """
+        Short descriptions of the user variables written by the last execute() call.
+        """
+        return {name: describe_value(value) for name, value in sorted(self.changed_values().items())}
+
+    def save(self, directory: str) -> dict:
+        """
+        Writes the user variables to directory, replacing any earlier snapshot: DataFrames as Arrow files,
+        modules as their import name and other values pickled. Values that cannot be pickled
+        (e.g. functions defined by the agent or open connections) are skipped.
+
+        Returns:
+            dict: names saved and names skipped
+        """
+        from .dataframe_store import write_frame_file
+
+        staging = directory + ".saving"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        manifest = {}
+        skipped = []
+        for i, (name, value) in enumerate(sorted(self.user_variables().items())):
+            path = os.path.join(staging, f"var{i}")
+            if isinstance(value, types.ModuleType):
+                manifest[name] = {"module": value.__name__}
+            elif isinstance(value, pd.DataFrame):
+                manifest[name] = {"file": os.path.basename(write_frame_file(value, path))}
+            else:
+                try:
+                    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    skipped.append(name)
+                    continue
+                with open(path + ".pickle", "wb") as f:
+                    f.write(data)
+                manifest[name] = {"file": f"var{i}.pickle"}
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        os.replace(staging, directory)
+        return {"saved": sorted(manifest), "skipped": skipped}
+
+    def restore(self, directory: str) -> list:
+        """
+        Loads variables saved by save() into the namespace. Returns the names restored.
+        """
+        import importlib
+        from .dataframe_store import read_frame_file
+
+        with open(os.path.join(directory, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        restored = []
+        for name, entry in manifest.items():
+            try:
+                if "module" in entry:
+                    value = importlib.import_module(entry["module"])
+                else:
+                    value = read_frame_file(os.path.join(directory, entry["file"]))
+            except Exception:
+                continue
+            self.globals[name] = value
+            self.variable_bytes[name] = value_nbytes(value)
+            restored.append(name)
+        return restored
@@ -1,82 +1,113 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import AIMessage, ToolMessage, HumanMessage, SystemMessage
+from langchain_core.messages import ToolMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from .state import AgentState
+import asyncio
 import json
+import threading
 from typing import Literal
-from .tools import make_sql_query, complete_python_task
-from langgraph.prebuilt import ToolNode
+from .tools import make_sql_query, complete_python_task, describe_tables
+from .tool_executor import ConcurrentToolNode
 import os
-from sqlalchemy import inspect
-from .db_utils import get_db_session
+from .db_utils import get_db_engine
+from .schema_index import get_schema_index
+from .column_profiles import get_column_profiles
+from .compaction import compact_messages
+from .llm_cache import get_llm_cache, LLM_CACHE_MODE, LLM_CACHE_DETERMINISTIC
+from .tracing import record_llm_usage
+from .startup import timed_phase
 
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+tools = [make_sql_query, complete_python_task, describe_tables]
+tool_node = ConcurrentToolNode(tools)
 
-tools = [make_sql_query, complete_python_task]
+# The LLM client and the prompt-plus-model chain are created on first use and shared by every session
+llm = None
+chat_template = None
+model = None
+_model_lock = threading.Lock()
 
-model = llm.bind_tools(tools)
-tool_node = ToolNode(tools)
 
-with open(os.path.join(os.path.dirname(__file__), "../prompts/main_prompt.md"), "r") as file:
-    prompt = file.read()
+def get_chat_template() -> ChatPromptTemplate:
+    global chat_template
+    with _model_lock:
+        if chat_template is None:
+            with open(os.path.join(os.path.dirname(__file__), "../prompts/main_prompt.md"), "r") as file:
+                prompt = file.read()
+            chat_template = ChatPromptTemplate.from_messages([
+                ("system", prompt),
+                ("placeholder", "{messages}"),
+            ])
+    return chat_template
 
-chat_template = ChatPromptTemplate.from_messages([
-    ("system", prompt),
-    ("placeholder", "{messages}"),
-])
-model = chat_template | model
+
+def get_model():
+    """
+    Returns the system prompt piped into the tool-bound LLM, creating the OpenAI client on first call.
+    """
+    global llm, model
+    if model is not None:
+        return model
+    template = get_chat_template()
+    with _model_lock:
+        if model is None:
+            if llm is None:
+                with timed_phase("llm_client"):
+                    from langchain_openai import ChatOpenAI
+
+                    # Replay mode never calls the model, so it runs without an API key
+                    replay_without_key = LLM_CACHE_MODE == "replay" and not os.getenv("OPENAI_API_KEY")
+                    llm = ChatOpenAI(
+                        model="gpt-4o",
+                        temperature=0,
+                        cache=get_llm_cache(),
+                        # Report token usage when streaming too, for tracing
+                        stream_usage=True,
+                        **({"api_key": "replay-mode"} if replay_without_key else {}),
+                    )
+            model = template | llm.bind_tools(tools)
+    return model
 
 def get_table_schema(state: AgentState):
     summary = "The following is available to you:"
     if "db_type" in state["input_data"]:
         summary += f"Database Type: {state['input_data']['db_type']}\n"
         
-        # Get database schema information
+        # Get the schema of the tables relevant to the latest question
         try:
-            with get_db_session(state) as session:
-                inspector = inspect(session.get_bind())
-                tables = inspector.get_table_names()
-                
-                summary += "Database Schema:\n"
-                for table in tables:
-                    summary += f"\nTable: {table}\n"
-                    
-                    # Get columns
-                    columns = inspector.get_columns(table)
-                    summary += "Columns:\n"
-                    for column in columns:
-                        summary += f"  - {column['name']}: {column['type']}"
-                        if column.get('nullable') is False:
-                            summary += " (NOT NULL)"
-                        if column.get('primary_key'):
-                            summary += " (PRIMARY KEY)"
-                        summary += "\n"
-                    
-                    # Get foreign keys
-                    foreign_keys = inspector.get_foreign_keys(table)
-                    if foreign_keys:
-                        summary += "Foreign Keys:\n"
-                        for fk in foreign_keys:
-                            summary += f"  - {', '.join(fk['constrained_columns'])} -> {fk['referred_table']}.{', '.join(fk['referred_columns'])}\n"
-                    
-                    # Get indexes
-                    indexes = inspector.get_indexes(table)
-                    if indexes:
-                        summary += "Indexes:\n"
-                        for idx in indexes:
-                            summary += f"  - {idx['name']}: {', '.join(idx['column_names'])}"
-                            if idx.get('unique'):
-                                summary += " (UNIQUE)"
-                            summary += "\n"
-                    
-                    summary += "\n"
+            engine = get_db_engine(state)
+            # Profiles are computed in the background; the first turns may go without them
+            index = get_schema_index(engine, get_column_profiles(engine, wait=LLM_CACHE_DETERMINISTIC))
+            question = next(
+                (message.content for message in reversed(state["messages"]) if isinstance(message, HumanMessage)),
+                ""
+            )
+            selected_tables = index.select_tables(question)
+
+            summary += "Database Schema:\n"
+            for table in selected_tables:
+                summary += f"\n{index.rendered[table]}\n"
+
+            other_tables = [table for table in index.schema if table not in selected_tables]
+            if other_tables:
+                summary += "\nOther tables (use the `describe_tables` tool to see their columns):\n"
+                summary += ", ".join(other_tables) + "\n"
         except Exception as e:
             summary += f"\nNote: Could not retrieve schema information: {str(e)}\n"
     return {"messages": [SystemMessage(content=summary)]}
 
+async def aget_table_schema(state: AgentState):
+    # The schema comes from the cache after the first turn; misses are loaded in a worker thread
+    return await asyncio.to_thread(get_table_schema, state)
+
 def brain_node(state: AgentState):
-    llm_outputs = model.invoke(state)
+    # The model sees a compacted view of the conversation; the full history stays in the state
+    llm_outputs = get_model().invoke({**state, "messages": compact_messages(state["messages"])})
+    record_llm_usage(llm_outputs)
+    return {"messages": [llm_outputs]}
+
+async def abrain_node(state: AgentState):
+    llm_outputs = await get_model().ainvoke({**state, "messages": compact_messages(state["messages"])})
+    record_llm_usage(llm_outputs)
     return {"messages": [llm_outputs]}
 
 def route_to_tools(state: AgentState,) -> Literal["tools", "__end__"]:
@@ -94,20 +125,36 @@ def route_to_tools(state: AgentState,) -> Literal["tools", "__end__"]:
         return "tools"
     return "__end__"
 
+def tool_output_from_message(message: ToolMessage):
+    """
+    Parses a tool message into an intermediate output, or returns None if it is not a JSON object
+    (e.g. the error text of a failed tool call).
+    """
+    try:
+        tool_output = json.loads(message.content)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(tool_output, dict):
+        return None
+    for key in ("timing", "trace"):
+        if key in message.response_metadata:
+            tool_output[key] = message.response_metadata[key]
+    return tool_output
+
 def handle_tool_output(state: AgentState) -> AgentState:
     """
     Processes the output from the most recent tool calls and updates the state with intermediate outputs
-    and current variables. Returns the original state if there's an error processing any tool output.
+    and current variables. Returns an empty update if there are no valid tool outputs to record.
     """ 
     if not state.get("messages"):
-        return state
+        return {}
 
     try:
         # Initialize state update with empty lists
         state_update = {
             "intermediate_outputs": []
         }
-        image_paths = []
+        figure_ids = []
         
         # Find the last non-tool message to determine where to start processing
         last_non_tool_idx = -1
@@ -121,27 +168,26 @@ def handle_tool_output(state: AgentState) -> AgentState:
             if not isinstance(message, ToolMessage):
                 continue
                 
-            try:
-                tool_output = json.loads(message.content)
-                state_update["intermediate_outputs"].append(tool_output)
-                
-                # Accumulate image paths if present
-                if "output_image_paths" in tool_output:
-                    image_paths.extend(tool_output["output_image_paths"])
-            except (json.JSONDecodeError, TypeError):
+            tool_output = tool_output_from_message(message)
+            if tool_output is None:
                 # Skip invalid tool outputs but continue processing other messages
                 continue
+            state_update["intermediate_outputs"].append(tool_output)
+
+            # Accumulate figure ids if present
+            if "output_figure_ids" in tool_output:
+                figure_ids.extend(tool_output["output_figure_ids"])
         
-        # Only add output_image_paths to state update if we found any
-        if image_paths:
-            state_update["output_image_paths"] = image_paths
+        # Only add output_figure_ids to state update if we found any
+        if figure_ids:
+            state_update["output_figure_ids"] = figure_ids
             
         # Only return state update if we found valid tool outputs
         if state_update["intermediate_outputs"]:
             return state_update
-        return state
+        return {}
         
     except Exception:
-        # Return original state if there's any error in the overall process
-        return state
+        # Return no update if there's any error in the overall process
+        return {}
 
@@ -0,0 +1,487 @@
+from collections import OrderedDict
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from .sessions import SESSION_IDLE_TIMEOUT, namespace_snapshot_dir, has_namespace_snapshot, remove_namespace_snapshot
+
+# Python task execution settings. The "process" backend runs each session's code in its own
+# long-lived worker process; "inprocess" keeps the original exec inside the server process.
+PYTHON_EXECUTION_BACKEND = os.getenv("PYTHON_EXECUTION_BACKEND", "process")
+PYTHON_WORKER_POOL_SIZE = int(os.getenv("PYTHON_WORKER_POOL_SIZE", "4"))
+PYTHON_EXEC_TIMEOUT = float(os.getenv("PYTHON_EXEC_TIMEOUT", "120"))
+PYTHON_EXEC_MAX_MEMORY_MB = int(os.getenv("PYTHON_EXEC_MAX_MEMORY_MB", "4096"))
+# Workers started ahead of time, with the analysis libraries imported, for the next new sessions
+PYTHON_WORKER_STANDBY = int(os.getenv("PYTHON_WORKER_STANDBY", "1"))
+
+# Libraries a standby worker imports while it waits, so a new session's first task does not pay for them
+WARM_MODULES = ("pandas", "plotly.express", "plotly.graph_objects", "plotly.io", "sklearn")
+
+# How often the parent checks a running job for timeout and memory use
+_POLL_INTERVAL = 0.05
+_spawn_lock = threading.Lock()
+
+
+def serialize_figures(figures: list) -> list:
+    """
+    Serializes the figures collected in plotly_figures to Plotly JSON, skipping anything that is not a figure.
+    Oversized traces are decimated first so payloads stay within FIGURE_POINT_BUDGET.
+    """
+    from .figure_registry import serialize_figure
+    from .figure_decimation import decimate_figure
+
+    figure_jsons = []
+    for figure in figures:
+        try:
+            figure_jsons.append(serialize_figure(decimate_figure(figure)))
+        except (ValueError, TypeError):
+            continue
+    return figure_jsons
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module that is only imported when one of its attributes is first used.
+    """
+
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self.__name__), attribute)
+
+
+def base_namespace(get_dataframe) -> dict:
+    """
+    The names available to agent code before it defines any of its own. Plotly and sklearn
+    are imported on first use, so code that does not need them does not wait for them.
+    """
+    import pandas as pd
+
+    return {
+        "__name__": "__main__",
+        "go": LazyModule("plotly.graph_objects"),
+        "pio": LazyModule("plotly.io"),
+        "px": LazyModule("plotly.express"),
+        "pd": pd,
+        "sklearn": LazyModule("sklearn"),
+        "get_dataframe": get_dataframe,
+        "plotly_figures": [],
+    }
+
+
+def _worker_main(connection, restore_dir: str = None):
+    """
+    Entry point of a kernel worker process. Runs jobs sent over the connection in a namespace
+    that persists for the life of the process, and forwards get_dataframe calls to the parent.
+    The namespace starts from an offloaded snapshot if restore_dir is given.
+    """
+    import contextlib
+    import io
+    import traceback
+    from .namespace import SessionNamespace
+
+    def get_dataframe(query_id: str):
+        connection.send(("get_dataframe", query_id))
+        status, payload = connection.recv()
+        if status == "missing":
+            raise KeyError(payload)
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    namespace = SessionNamespace(base_namespace(get_dataframe))
+    if restore_dir:
+        try:
+            namespace.restore(restore_dir)
+        except (OSError, ValueError):
+            pass
+
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request[0] == "stop":
+            break
+        if request[0] == "save":
+            try:
+                connection.send(("saved", namespace.save(request[1])))
+            except Exception as e:
+                connection.send(("error", str(e)))
+            continue
+        if request[0] == "restore":
+            try:
+                namespace.restore(request[1])
+            except (OSError, ValueError):
+                pass
+            continue
+        if request[0] == "warm":
+            for module in request[1]:
+                try:
+                    importlib.import_module(module)
+                except ImportError:
+                    continue
+            continue
+
+        namespace.globals["plotly_figures"] = []
+        stdout, stderr = io.StringIO(), io.StringIO()
+        error = None
+        cpu_start, rss_start = time.process_time(), rss_bytes(os.getpid())
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                namespace.execute(request[1])
+        except BaseException:
+            error = traceback.format_exc()
+        cpu_seconds, memory_delta = time.process_time() - cpu_start, rss_bytes(os.getpid()) - rss_start
+
+        figure_jsons = serialize_figures(namespace.globals.get("plotly_figures", []))
+        namespace.globals["plotly_figures"] = []
+
+        connection.send(("result", {
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+            "error": error,
+            "figure_jsons": figure_jsons,
+            "variables": namespace.describe_changes(),
+            "cpu_seconds": cpu_seconds,
+            "memory_delta_bytes": memory_delta,
+            "variables_bytes": namespace.nbytes(),
+        }))
+
+
+def rss_bytes(pid: int) -> int:
+    """
+    Resident set size of a process, or 0 where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class KernelWorker:
+    """
+    A long-lived worker process holding one session's Python state.
+    """
+
+    def __init__(self, session_id: str = None, restore_dir: str = None):
+        context = multiprocessing.get_context("spawn")
+        self.session_id = session_id
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_connection, restore_dir), daemon=True,
+            name=f"python-kernel-{session_id or 'standby'}"
+        )
+        # Spawn re-runs the main script in the child first; under Streamlit that is the whole page,
+        # so workers are started with a bare __main__ and only import what _worker_main needs.
+        # The swap lasts only for start(), one spawn at a time, and a __main__ that a Streamlit
+        # script run installed meanwhile is left in place.
+        bare_main = types.ModuleType("__main__")
+        with _spawn_lock:
+            main_module = sys.modules["__main__"]
+            sys.modules["__main__"] = bare_main
+            try:
+                self.process.start()
+            finally:
+                if sys.modules.get("__main__") is bare_main:
+                    sys.modules["__main__"] = main_module
+        child_connection.close()
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.jobs = 0
+        self.restored_from = None
+        # Size of the session's variables, as reported after the last task
+        self.variables_bytes = 0
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def terminate(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+        self.connection.close()
+
+    def warm(self, modules=WARM_MODULES):
+        """
+        Asks an idle worker to import modules ahead of its first task.
+        """
+        self.connection.send(("warm", list(modules)))
+
+    def bind(self, session_id: str, restore_dir: str = None):
+        """
+        Assigns a standby worker to a session, loading the session's offloaded variables first if there are any.
+        """
+        self.session_id = session_id
+        if restore_dir:
+            self.connection.send(("restore", restore_dir))
+            self.restored_from = restore_dir
+
+    def save(self, directory: str, timeout: float = None) -> dict:
+        """
+        Asks the worker to write its user variables to directory.
+        """
+        timeout = PYTHON_EXEC_TIMEOUT if timeout is None else timeout
+        self.connection.send(("save", directory))
+        if not self.connection.poll(timeout):
+            raise TimeoutError(f"The Python worker did not save its variables within {timeout:.0f}s")
+        kind, payload = self.connection.recv()
+        if kind == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def run(self, python_code: str, dataframe_getter, timeout: float, max_memory_bytes: int) -> dict:
+        """
+        Runs code in the worker, serving get_dataframe requests until the result arrives.
+        The worker is terminated if the job exceeds its wall-clock or memory limit.
+        """
+        self.jobs += 1
+        self.connection.send(("run", python_code))
+        deadline = time.monotonic() + timeout
+        peak_rss = 0
+        while True:
+            if self.connection.poll(_POLL_INTERVAL):
+                try:
+                    kind, payload = self.connection.recv()
+                except (EOFError, OSError):
+                    raise RuntimeError("The Python worker exited unexpectedly; variables from earlier steps were lost.")
+                if kind == "get_dataframe":
+                    try:
+                        self.connection.send(("ok", dataframe_getter(payload)))
+                    except KeyError:
+                        self.connection.send(("missing", f"No dataframe stored under query_id {payload!r}"))
+                    except Exception as e:
+                        # Reloading a result can rerun its query, which may be rejected, time out or fail;
+                        # the worker is waiting for a reply either way
+                        self.connection.send(("error", f"Could not load query_id {payload!r}: {type(e).__name__}: {e}"))
+                    continue
+                payload["peak_rss_bytes"] = peak_rss
+                self.variables_bytes = payload.get("variables_bytes", 0)
+                return payload
+
+            if not self.process.is_alive():
+                raise RuntimeError(
+                    f"The Python worker exited unexpectedly (exit code {self.process.exitcode}); "
+                    "variables from earlier steps were lost."
+                )
+            if time.monotonic() > deadline:
+                self.terminate()
+                raise TimeoutError(
+                    f"Python task exceeded the {timeout:.0f}s time limit and was cancelled; "
+                    "variables from earlier steps were lost."
+                )
+            peak_rss = max(peak_rss, rss_bytes(self.process.pid))
+            if max_memory_bytes and peak_rss > max_memory_bytes:
+                self.terminate()
+                raise MemoryError(
+                    f"Python task exceeded the {max_memory_bytes // 1024 ** 2} MB memory limit and was cancelled; "
+                    "variables from earlier steps were lost. Work on smaller subsets of the data."
+                )
+
+
+# Process-wide pool of kernel workers keyed by session id, least recently used first
+_workers = OrderedDict()
+_pool_condition = threading.Condition()
+# Sessions whose worker is being offloaded; they are not restarted until the snapshot is written
+_offloading = set()
+# Started workers not yet assigned to a session
+_standby = []
+
+
+def _take_standby_worker():
+    """
+    Returns a live standby worker, or None. The caller holds _pool_condition.
+    """
+    while _standby:
+        worker = _standby.pop()
+        if worker.is_alive():
+            return worker
+        worker.terminate()
+    return None
+
+
+def prestart_workers() -> int:
+    """
+    Starts standby workers until PYTHON_WORKER_STANDBY are waiting. Each imports the analysis libraries
+    in its own process, so the next new session's first task starts warm. Returns the number started.
+    """
+    if PYTHON_EXECUTION_BACKEND != "process":
+        return 0
+    started = 0
+    with _pool_condition:
+        _standby[:] = [worker for worker in _standby if worker.is_alive()]
+        while len(_standby) < PYTHON_WORKER_STANDBY:
+            worker = KernelWorker()
+            worker.warm()
+            _standby.append(worker)
+            started += 1
+    return started
+
+
+def _offload_worker(worker: KernelWorker):
+    """
+    Saves the worker's variables to the session's snapshot directory, then stops it.
+    """
+    try:
+        if worker.is_alive():
+            worker.save(namespace_snapshot_dir(worker.session_id))
+    except (RuntimeError, TimeoutError, OSError, EOFError):
+        pass
+    finally:
+        worker.terminate()
+        with _pool_condition:
+            _offloading.discard(worker.session_id)
+            _pool_condition.notify_all()
+
+
+def _acquire_worker(session_id: str) -> KernelWorker:
+    while True:
+        evicted = None
+        with _pool_condition:
+            if session_id in _offloading:
+                _pool_condition.wait(timeout=1)
+                continue
+            worker = _workers.get(session_id)
+            if worker is not None and not worker.is_alive():
+                del _workers[session_id]
+                worker = None
+            if worker is None and len(_workers) >= PYTHON_WORKER_POOL_SIZE:
+                idle = next((w for w in _workers.values() if w.in_use == 0), None)
+                if idle is None:
+                    _pool_condition.wait(timeout=1)
+                    continue
+                # Offload the least recently used idle session to make room
+                del _workers[idle.session_id]
+                _offloading.add(idle.session_id)
+                evicted = idle
+            else:
+                if worker is None:
+                    # A session returning after being offloaded starts from its snapshot, which is then consumed
+                    restore_dir = namespace_snapshot_dir(session_id) if has_namespace_snapshot(session_id) else None
+                    worker = _take_standby_worker()
+                    if worker is None:
+                        worker = KernelWorker(session_id, restore_dir)
+                        worker.restored_from = restore_dir
+                    else:
+                        worker.bind(session_id, restore_dir)
+                        # Replace the standby worker in the background
+                        threading.Thread(target=prestart_workers, daemon=True).start()
+                    _workers[session_id] = worker
+                _workers.move_to_end(session_id)
+                worker.in_use += 1
+                return worker
+        _offload_worker(evicted)
+
+
+def _release_worker(worker: KernelWorker):
+    with _pool_condition:
+        worker.in_use -= 1
+        worker.last_used = time.monotonic()
+        if not worker.is_alive() and _workers.get(worker.session_id) is worker:
+            del _workers[worker.session_id]
+        _pool_condition.notify_all()
+
+
+def offload_idle_workers(max_idle: float = None) -> int:
+    """
+    Saves and stops the workers of sessions idle for more than max_idle seconds, freeing their memory.
+    The session's variables are restored when it next runs a task. Returns the number of workers offloaded.
+    """
+    max_idle = SESSION_IDLE_TIMEOUT if max_idle is None else max_idle
+    now = time.monotonic()
+    with _pool_condition:
+        idle = [w for w in _workers.values() if w.in_use == 0 and now - w.last_used > max_idle]
+        for worker in idle:
+            del _workers[worker.session_id]
+            _offloading.add(worker.session_id)
+    for worker in idle:
+        _offload_worker(worker)
+    return len(idle)
+
+
+def offload_session_worker(session_id: str) -> bool:
+    """
+    Saves and stops the session's worker if it is idle, so its variables are restored on the next task.
+    Returns whether a worker was offloaded.
+    """
+    with _pool_condition:
+        worker = _workers.get(session_id)
+        if worker is None or worker.in_use:
+            return False
+        del _workers[session_id]
+        _offloading.add(session_id)
+    _offload_worker(worker)
+    return True
+
+
+def session_variables_bytes(session_id: str) -> int:
+    """
+    Approximate memory held by the variables in the session's worker, or 0 if it has no worker.
+    """
+    with _pool_condition:
+        worker = _workers.get(session_id)
+    return worker.variables_bytes if worker is not None and worker.is_alive() else 0
+
+
+def run_python_task(session_id: str, python_code: str, dataframe_getter, timeout: float = None) -> dict:
+    """
+    Runs python_code in the session's kernel worker. Calls for the same session run one at a time;
+    different sessions run in parallel in separate processes.
+
+    Returns:
+        dict: stdout, stderr, error (traceback or None), figure_jsons, variables written, cpu_seconds,
+        memory_delta_bytes, variables_bytes and peak_rss_bytes
+    """
+    timeout = PYTHON_EXEC_TIMEOUT if timeout is None else timeout
+    worker = _acquire_worker(session_id)
+    try:
+        with worker.lock:
+            result = worker.run(python_code, dataframe_getter, timeout, PYTHON_EXEC_MAX_MEMORY_MB * 1024 ** 2)
+            # The snapshot now lives in the worker; a later crash should not bring back its stale state
+            if worker.restored_from:
+                remove_namespace_snapshot(session_id)
+                worker.restored_from = None
+            return result
+    finally:
+        _release_worker(worker)
+
+
+def cancel_session(session_id: str) -> bool:
+    """
+    Terminates the session's worker, cancelling any running job and discarding its variables.
+    """
+    with _pool_condition:
+        worker = _workers.pop(session_id, None)
+        _pool_condition.notify_all()
+    remove_namespace_snapshot(session_id)
+    if worker is None:
+        return False
+    worker.terminate()
+    return True
+
+
+def get_worker_pool_stats() -> dict:
+    """
+    Returns the state of the kernel worker pool.
+    """
+    with _pool_condition:
+        return {
+            "backend": PYTHON_EXECUTION_BACKEND,
+            "pool_size": PYTHON_WORKER_POOL_SIZE,
+            "standby": len(_standby),
+            "workers": {
+                session_id: {
+                    "pid": worker.process.pid,
+                    "busy": worker.in_use > 0,
+                    "jobs": worker.jobs,
+                    "rss_bytes": rss_bytes(worker.process.pid),
+                    "idle_seconds": round(time.monotonic() - worker.last_used, 1),
+                }
+                for session_id, worker in _workers.items()
+            },
+        }
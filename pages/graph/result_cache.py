@@ -0,0 +1,311 @@
+from collections import OrderedDict
+from sqlalchemy.engine import make_url
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import pandas as pd
+from .db_utils import normalize_db_uri
+from .dataframe_store import dataframe_nbytes, write_frame_file, read_frame_file, remove_file
+from .sql_runner import SQL_MAX_ROWS, SQL_MAX_BYTES
+
+# Result cache settings. The memory tier is per process; the disk tier is shared by every
+# worker process pointing at the same SQL_CACHE_DIR.
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_CACHE_MAX_BYTES = int(os.getenv("SQL_CACHE_MAX_BYTES", str(256 * 1024 ** 2)))
+SQL_CACHE_DISK_MAX_BYTES = int(os.getenv("SQL_CACHE_DISK_MAX_BYTES", str(2 * 1024 ** 3)))
+SQL_CACHE_DIR = os.getenv("SQL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sql_result_cache"))
+# Server databases expose no cheap data version, so their entries expire after a TTL
+SQL_CACHE_TTL = int(os.getenv("SQL_CACHE_TTL", "300"))
+
+_memory_cache = OrderedDict()
+_memory_bytes = {}
+_cache_lock = threading.Lock()
+
+cache_stats = {
+    "hits": 0,
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "saved_db_seconds": 0.0,
+}
+
+_SQL_KEYWORDS = {
+    "select", "from", "where", "and", "or", "not", "in", "is", "null", "as", "on", "join", "inner", "left",
+    "right", "full", "outer", "cross", "natural", "using", "group", "by", "order", "having", "limit", "offset",
+    "distinct", "all", "union", "intersect", "except", "with", "recursive", "case", "when", "then", "else",
+    "end", "asc", "desc", "nulls", "first", "last", "between", "like", "ilike", "exists", "any", "some",
+    "cast", "over", "partition", "rows", "range", "preceding", "following", "unbounded", "current", "row",
+    "count", "sum", "avg", "min", "max", "coalesce", "true", "false", "filter", "lateral", "fetch", "next",
+    "only", "escape", "collate",
+}
+
+# Functions whose results change between executions, so queries using them are never cached
+_VOLATILE_PATTERN = re.compile(
+    r"\b(random|rand|now|sysdate|uuid|gen_random_uuid|newid|clock_timestamp|current_timestamp|"
+    r"current_date|current_time|localtime|localtimestamp|statement_timestamp)\b"
+)
+
+_SQL_TOKEN_PATTERN = re.compile(
+    r"(?P<string>'(?:[^']|'')*')"
+    r"|(?P<quoted>\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\])"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<space>\s+)"
+    r"|(?P<number>(?<![\w$])(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?(?![\w$]))"
+    r"|(?P<word>[A-Za-z_][\w$]*)"
+    r"|(?P<symbol>.)",
+    re.S,
+)
+
+
+def _normalize_number(token: str) -> str:
+    if "e" in token.lower():
+        return token.lower()
+    if "." not in token:
+        return str(int(token))
+    # Keep the decimal point, since 5/2 and 5/2.0 differ in SQL
+    integer, fraction = token.split(".")
+    fraction = fraction.rstrip("0") or "0"
+    return f"{int(integer or '0')}.{fraction}"
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Canonical form of a query for cache keys: comments and redundant whitespace are removed,
+    keywords are lowercased and numeric literals are written in a single form.
+    String literals and quoted identifiers are kept verbatim.
+    """
+    parts = []
+    previous_is_word = False
+    for match in _SQL_TOKEN_PATTERN.finditer(sql_query):
+        kind, token = match.lastgroup, match.group()
+        if kind in ("space", "comment"):
+            continue
+        if kind == "number":
+            token = _normalize_number(token)
+        elif kind == "word" and token.lower() in _SQL_KEYWORDS:
+            token = token.lower()
+        is_word = kind in ("string", "quoted", "number", "word")
+        if is_word and previous_is_word:
+            parts.append(" ")
+        parts.append(token)
+        previous_is_word = is_word
+    return "".join(parts).rstrip(";")
+
+
+def _is_cacheable(normalized_sql: str) -> bool:
+    return not _VOLATILE_PATTERN.search(normalized_sql.lower())
+
+
+def get_data_version(db_uri: str):
+    """
+    Returns a token that changes whenever the data behind the URI may have changed.
+    SQLite databases use the size and mtime of the database and WAL files; server databases
+    return None and rely on SQL_CACHE_TTL instead.
+    """
+    url = make_url(db_uri)
+    if url.get_backend_name() != "sqlite":
+        return None
+    if url.database in (None, "", ":memory:"):
+        return False
+    version = []
+    for path in (url.database, url.database + "-wal"):
+        try:
+            stat = os.stat(path)
+            version.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            version.append("-")
+    return "|".join(version)
+
+
+def _cache_key(db_uri: str, sql_query: str):
+    """
+    Returns (key, data_version), or (None, None) when the query must not be cached.
+    """
+    normalized_sql = normalize_sql(sql_query)
+    data_version = get_data_version(db_uri)
+    if data_version is False or not _is_cacheable(normalized_sql):
+        return None, None
+    payload = json.dumps([normalize_db_uri(db_uri), normalized_sql, data_version, SQL_MAX_ROWS, SQL_MAX_BYTES])
+    return hashlib.sha256(payload.encode()).hexdigest(), data_version
+
+
+def _is_fresh(entry: dict) -> bool:
+    return entry["data_version"] is not None or time.time() - entry["created_at"] <= SQL_CACHE_TTL
+
+
+def _record(key: str, amount=1):
+    with _cache_lock:
+        cache_stats[key] += amount
+
+
+def _cache_info(hit: bool, tier: str = None) -> dict:
+    with _cache_lock:
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        return {
+            "hit": hit,
+            "tier": tier,
+            "hit_ratio": round(cache_stats["hits"] / lookups, 3) if lookups else 0.0,
+            "saved_db_seconds": round(cache_stats["saved_db_seconds"], 3),
+        }
+
+
+def _read_disk_entry(key: str):
+    meta_path = os.path.join(SQL_CACHE_DIR, key + ".json")
+    try:
+        with open(meta_path, "r") as f:
+            entry = json.load(f)
+        df = read_frame_file(os.path.join(SQL_CACHE_DIR, entry["data_file"]))
+    except (OSError, ValueError, KeyError):
+        return None, None
+    # Touch the metadata so disk eviction is least-recently-used
+    try:
+        os.utime(meta_path)
+    except OSError:
+        pass
+    return entry, df
+
+
+def _write_disk_entry(key: str, entry: dict, df: pd.DataFrame):
+    os.makedirs(SQL_CACHE_DIR, exist_ok=True)
+    # Write under temporary names and rename, so other workers never read a partial entry
+    tmp_data_path = write_frame_file(df, os.path.join(SQL_CACHE_DIR, f".{uuid.uuid4().hex}"))
+    data_file = key + os.path.splitext(tmp_data_path)[1]
+    os.replace(tmp_data_path, os.path.join(SQL_CACHE_DIR, data_file))
+    tmp_meta_path = os.path.join(SQL_CACHE_DIR, f".{uuid.uuid4().hex}.json")
+    with open(tmp_meta_path, "w") as f:
+        json.dump(dict(entry, data_file=data_file), f)
+    os.replace(tmp_meta_path, os.path.join(SQL_CACHE_DIR, key + ".json"))
+    _evict_disk()
+
+
+def _evict_disk():
+    try:
+        names = os.listdir(SQL_CACHE_DIR)
+    except OSError:
+        return
+    # Group metadata and data files by cache key; temporary files start with "."
+    files_by_key = {}
+    for name in names:
+        if not name.startswith("."):
+            files_by_key.setdefault(name.split(".")[0], []).append(os.path.join(SQL_CACHE_DIR, name))
+    entries = []
+    total = 0
+    for key, paths in files_by_key.items():
+        try:
+            size = sum(os.path.getsize(path) for path in paths)
+            last_used = os.path.getmtime(os.path.join(SQL_CACHE_DIR, key + ".json"))
+        except OSError:
+            last_used = 0
+            size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+        entries.append((last_used, size, paths))
+        total += size
+    for last_used, size, paths in sorted(entries, key=lambda entry: entry[0]):
+        if total <= SQL_CACHE_DISK_MAX_BYTES:
+            break
+        for path in paths:
+            remove_file(path)
+        total -= size
+
+
+def _store_memory_entry(key: str, entry: dict, df: pd.DataFrame):
+    nbytes = dataframe_nbytes(df)
+    if nbytes > SQL_CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        if key in _memory_cache:
+            del _memory_cache[key]
+            del _memory_bytes[key]
+        _memory_cache[key] = (entry, df)
+        _memory_bytes[key] = nbytes
+        while sum(_memory_bytes.values()) > SQL_CACHE_MAX_BYTES:
+            evicted_key, _ = _memory_cache.popitem(last=False)
+            del _memory_bytes[evicted_key]
+
+
+def lookup_result(db_uri: str, sql_query: str):
+    """
+    Looks up a cached result for the query, checking the process memory tier and then the shared disk tier.
+
+    Returns:
+        tuple: (DataFrame, result_info, cache_info) on a hit, or (None, None, cache_info) on a miss
+    """
+    if not SQL_CACHE_ENABLED:
+        return None, None, None
+    key, data_version = _cache_key(db_uri, sql_query)
+    if key is None:
+        return None, None, None
+
+    tier = None
+    with _cache_lock:
+        cached = _memory_cache.get(key)
+        if cached is not None and _is_fresh(cached[0]):
+            _memory_cache.move_to_end(key)
+            entry, df = cached[0], cached[1].copy()
+            tier = "memory"
+    if tier is None:
+        entry, df = _read_disk_entry(key)
+        if entry is not None and _is_fresh(entry):
+            tier = "disk"
+            _store_memory_entry(key, entry, df.copy())
+
+    if tier is None:
+        _record("misses")
+        return None, None, _cache_info(hit=False)
+
+    _record("hits")
+    _record(f"{tier}_hits")
+    _record("saved_db_seconds", entry["db_seconds"])
+    return df, entry["result_info"], _cache_info(hit=True, tier=tier)
+
+
+def store_result(db_uri: str, sql_query: str, df: pd.DataFrame, result_info: dict, db_seconds: float):
+    """
+    Adds a freshly fetched query result to both cache tiers.
+    """
+    if not SQL_CACHE_ENABLED:
+        return
+    key, data_version = _cache_key(db_uri, sql_query)
+    if key is None:
+        return
+    entry = {
+        "result_info": result_info,
+        "db_seconds": db_seconds,
+        "data_version": data_version,
+        "created_at": time.time(),
+    }
+    _store_memory_entry(key, entry, df.copy())
+    try:
+        _write_disk_entry(key, entry, df)
+    except OSError:
+        # The disk tier is best effort; the memory tier still serves this process
+        pass
+
+
+def get_result_cache_stats() -> dict:
+    """
+    Returns result cache counters together with the current memory tier size.
+    """
+    with _cache_lock:
+        stats = dict(cache_stats)
+        stats["memory_entries"] = len(_memory_cache)
+        stats["memory_bytes"] = sum(_memory_bytes.values())
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def clear_result_cache(disk: bool = False):
+    """
+    Empties the memory tier, and the shared disk tier when disk is True.
+    """
+    with _cache_lock:
+        _memory_cache.clear()
+        _memory_bytes.clear()
+    if disk and os.path.isdir(SQL_CACHE_DIR):
+        for name in os.listdir(SQL_CACHE_DIR):
+            remove_file(os.path.join(SQL_CACHE_DIR, name))
@@ -0,0 +1,327 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+import threading
+
+# Schema cache keyed by normalized db_uri: {db_uri: (fingerprint, schema)}
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+# Bulk catalog queries per dialect. Each returns rows for every table at once,
+# so reflecting a database costs a fixed number of round trips instead of 3 per table.
+_SQLITE_FINGERPRINT = "PRAGMA schema_version"
+
+_SQLITE_COLUMNS = """
+SELECT m.name AS table_name, p.name AS column_name, p.type AS data_type,
+       p."notnull" AS not_null, p.pk AS primary_key
+FROM sqlite_master m JOIN pragma_table_info(m.name) p
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+ORDER BY m.name, p.cid
+"""
+
+_SQLITE_FOREIGN_KEYS = """
+SELECT m.name AS table_name, f.id AS fk_id, f."from" AS column_name,
+       f."table" AS referred_table, f."to" AS referred_column
+FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+ORDER BY m.name, f.id, f.seq
+"""
+
+_SQLITE_INDEXES = """
+SELECT m.name AS table_name, il.name AS index_name, il."unique" AS is_unique, ii.name AS column_name
+FROM sqlite_master m JOIN pragma_index_list(m.name) il JOIN pragma_index_info(il.name) ii
+WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND il.name NOT LIKE 'sqlite_autoindex%'
+ORDER BY m.name, il.name, ii.seqno
+"""
+
+_POSTGRES_FINGERPRINT = """
+SELECT md5(
+    coalesce(string_agg(c.oid::text || ':' || a.attname || ':' || a.atttypid::text || ':' || a.attnotnull::text,
+                        ',' ORDER BY c.oid, a.attnum), '')
+    || (SELECT count(*) FROM pg_constraint con JOIN pg_namespace cn ON cn.oid = con.connamespace
+        WHERE cn.nspname = current_schema())::text
+    || (SELECT count(*) FROM pg_index i JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_namespace inn ON inn.oid = ic.relnamespace WHERE inn.nspname = current_schema())::text
+)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+"""
+
+_POSTGRES_COLUMNS = """
+SELECT c.relname AS table_name, a.attname AS column_name,
+       format_type(a.atttypid, a.atttypmod) AS data_type,
+       a.attnotnull AS not_null, (pk.indrelid IS NOT NULL) AS primary_key
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+LEFT JOIN pg_index pk ON pk.indrelid = c.oid AND pk.indisprimary AND a.attnum = ANY(pk.indkey::int2[])
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p')
+ORDER BY c.relname, a.attnum
+"""
+
+_POSTGRES_FOREIGN_KEYS = """
+SELECT cl.relname AS table_name, con.conname AS fk_id, a.attname AS column_name,
+       rcl.relname AS referred_table, ra.attname AS referred_column
+FROM pg_constraint con
+JOIN pg_class cl ON cl.oid = con.conrelid
+JOIN pg_namespace n ON n.oid = cl.relnamespace
+JOIN pg_class rcl ON rcl.oid = con.confrelid
+CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, refattnum, ord)
+JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+JOIN pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.refattnum
+WHERE con.contype = 'f' AND n.nspname = current_schema()
+ORDER BY cl.relname, con.conname, k.ord
+"""
+
+_POSTGRES_INDEXES = """
+SELECT t.relname AS table_name, ic.relname AS index_name, i.indisunique AS is_unique, a.attname AS column_name
+FROM pg_index i
+JOIN pg_class t ON t.oid = i.indrelid
+JOIN pg_class ic ON ic.oid = i.indexrelid
+JOIN pg_namespace n ON n.oid = t.relnamespace
+CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+WHERE n.nspname = current_schema() AND NOT i.indisprimary AND t.relkind IN ('r', 'p')
+ORDER BY t.relname, ic.relname, k.ord
+"""
+
+_MYSQL_FINGERPRINT = """
+SELECT CONCAT(
+    COUNT(*), ':',
+    COALESCE(SUM(CRC32(CONCAT_WS(':', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY))), 0), ':',
+    (SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()), ':',
+    (SELECT COUNT(*) FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = DATABASE())
+)
+FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+_MYSQL_COLUMNS = """
+SELECT c.TABLE_NAME AS table_name, c.COLUMN_NAME AS column_name, c.COLUMN_TYPE AS data_type,
+       (c.IS_NULLABLE = 'NO') AS not_null, (c.COLUMN_KEY = 'PRI') AS primary_key
+FROM information_schema.COLUMNS c
+JOIN information_schema.TABLES t ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+WHERE c.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+_MYSQL_FOREIGN_KEYS = """
+SELECT TABLE_NAME AS table_name, CONSTRAINT_NAME AS fk_id, COLUMN_NAME AS column_name,
+       REFERENCED_TABLE_NAME AS referred_table, REFERENCED_COLUMN_NAME AS referred_column
+FROM information_schema.KEY_COLUMN_USAGE
+WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+"""
+
+_MYSQL_INDEXES = """
+SELECT TABLE_NAME AS table_name, INDEX_NAME AS index_name, (NON_UNIQUE = 0) AS is_unique, COLUMN_NAME AS column_name
+FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND INDEX_NAME <> 'PRIMARY'
+ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+"""
+
+_CATALOG_QUERIES = {
+    "sqlite": (_SQLITE_FINGERPRINT, _SQLITE_COLUMNS, _SQLITE_FOREIGN_KEYS, _SQLITE_INDEXES),
+    "postgresql": (_POSTGRES_FINGERPRINT, _POSTGRES_COLUMNS, _POSTGRES_FOREIGN_KEYS, _POSTGRES_INDEXES),
+    "mysql": (_MYSQL_FINGERPRINT, _MYSQL_COLUMNS, _MYSQL_FOREIGN_KEYS, _MYSQL_INDEXES),
+}
+
+
+def _bulk_load_schema(connection, columns_sql: str, foreign_keys_sql: str, indexes_sql: str) -> dict:
+    schema = {}
+
+    for row in connection.execute(text(columns_sql)).mappings():
+        table = schema.setdefault(row["table_name"], {"columns": [], "foreign_keys": [], "indexes": []})
+        table["columns"].append({
+            "name": row["column_name"],
+            "type": row["data_type"],
+            "nullable": not row["not_null"],
+            "primary_key": bool(row["primary_key"]),
+        })
+
+    foreign_keys = {}
+    for row in connection.execute(text(foreign_keys_sql)).mappings():
+        if row["table_name"] not in schema or row["referred_column"] is None:
+            continue
+        fk = foreign_keys.get((row["table_name"], row["fk_id"]))
+        if fk is None:
+            fk = {"constrained_columns": [], "referred_table": row["referred_table"], "referred_columns": []}
+            foreign_keys[(row["table_name"], row["fk_id"])] = fk
+            schema[row["table_name"]]["foreign_keys"].append(fk)
+        fk["constrained_columns"].append(row["column_name"])
+        fk["referred_columns"].append(row["referred_column"])
+
+    indexes = {}
+    for row in connection.execute(text(indexes_sql)).mappings():
+        if row["table_name"] not in schema or row["column_name"] is None:
+            continue
+        idx = indexes.get((row["table_name"], row["index_name"]))
+        if idx is None:
+            idx = {"name": row["index_name"], "column_names": [], "unique": bool(row["is_unique"])}
+            indexes[(row["table_name"], row["index_name"])] = idx
+            schema[row["table_name"]]["indexes"].append(idx)
+        idx["column_names"].append(row["column_name"])
+
+    return dict(sorted(schema.items()))
+
+
+def _inspect_schema(engine: Engine) -> dict:
+    # Fallback for dialects without a bulk catalog query
+    inspector = inspect(engine)
+    schema = {}
+    for table in inspector.get_table_names():
+        schema[table] = {
+            "columns": [
+                {
+                    "name": column["name"],
+                    "type": str(column["type"]),
+                    "nullable": column.get("nullable", True),
+                    "primary_key": bool(column.get("primary_key")),
+                }
+                for column in inspector.get_columns(table)
+            ],
+            "foreign_keys": [
+                {
+                    "constrained_columns": fk["constrained_columns"],
+                    "referred_table": fk["referred_table"],
+                    "referred_columns": fk["referred_columns"],
+                }
+                for fk in inspector.get_foreign_keys(table)
+            ],
+            "indexes": [
+                {"name": idx["name"], "column_names": idx["column_names"], "unique": bool(idx.get("unique"))}
+                for idx in inspector.get_indexes(table)
+            ],
+        }
+    return schema
+
+
+def get_schema_fingerprint(engine: Engine):
+    """
+    Returns a cheap token that changes whenever the database schema changes,
+    or None when the dialect has no fingerprint query.
+    """
+    queries = _CATALOG_QUERIES.get(engine.dialect.name)
+    if queries is None:
+        return None
+    with engine.connect() as connection:
+        return connection.execute(text(queries[0])).scalar()
+
+
+def get_cached_schema(engine: Engine) -> dict:
+    """
+    Returns the schema of the database behind the engine, shared by every caller in the process.
+    The schema is loaded with bulk catalog queries and reloaded only when the fingerprint changes.
+
+    Returns:
+        dict: {table_name: {"columns": [...], "foreign_keys": [...], "indexes": [...]}}
+    """
+    key = engine.url.render_as_string(hide_password=False)
+    queries = _CATALOG_QUERIES.get(engine.dialect.name)
+    if queries is None:
+        # Without a fingerprint the cache cannot be invalidated, so reflect every time
+        return _inspect_schema(engine)
+
+    with engine.connect() as connection:
+        fingerprint = connection.execute(text(queries[0])).scalar()
+        with _schema_lock:
+            cached = _schema_cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        schema = _bulk_load_schema(connection, *queries[1:])
+
+    with _schema_lock:
+        _schema_cache[key] = (fingerprint, schema)
+    return schema
+
+
+def _format_number(value: float) -> str:
+    if abs(value) >= 1000:
+        return f"{value:,.0f}"
+    return f"{value:.3g}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return _format_number(value)
+    return str(value)
+
+
+def _format_column_profile(profile: dict, key: str = None) -> str:
+    """
+    Renders a column profile compactly, e.g. "2% null, ~35 distinct, top: 0.99 91%, 1.99 9%".
+    Key columns ("primary" or "foreign") skip the histogram, whose even spread of ids says little.
+    """
+    if profile.get("null_fraction") == 1:
+        return "all null"
+    parts = []
+    if profile.get("null_fraction"):
+        parts.append(f"{profile['null_fraction']:.0%} null" if profile["null_fraction"] >= 0.005 else "<1% null")
+    if "distinct" in profile:
+        approximate = "~" if profile.get("sampled") else ""
+        unique = profile["unique"] or key == "primary"
+        parts.append("unique" if unique else f"{approximate}{profile['distinct']:,} distinct")
+    if "min" in profile and not profile.get("top"):
+        parts.append(f"{_format_value(profile['min'])}..{_format_value(profile['max'])}")
+    if profile.get("top"):
+        parts.append("top: " + ", ".join(f"{value!r} {share:.0%}" for value, share in profile["top"]))
+    if profile.get("histogram") and key is None:
+        parts.append("histogram: " + ", ".join(
+            f"{_format_number(low)}..{_format_number(high)} {share:.0%}" for low, high, share in profile["histogram"]
+        ))
+    return ", ".join(parts)
+
+
+def format_table_schema(table: str, table_info: dict, profile: dict = None) -> str:
+    """
+    Renders one table of a cached schema as the text block shown to the agent,
+    with row count and column statistics when a profile (see column_profiles) is given.
+    """
+    summary = f"Table: {table}\n"
+    if profile is not None:
+        summary += f"Rows: {profile['rows']:,}"
+        if profile["sample_rows"]:
+            summary += f" (statistics from a {profile['sample_rows']:,}-row sample)"
+        summary += "\n"
+
+    primary_keys = [column["name"] for column in table_info["columns"] if column.get("primary_key")]
+    foreign_keys = {name for fk in table_info["foreign_keys"] for name in fk["constrained_columns"]}
+
+    summary += "Columns:\n"
+    for column in table_info["columns"]:
+        summary += f"  - {column['name']}: {column['type']}"
+        if column.get('nullable') is False:
+            summary += " (NOT NULL)"
+        if column.get('primary_key'):
+            summary += " (PRIMARY KEY)"
+        column_profile = profile["columns"].get(column["name"]) if profile is not None else None
+        if column_profile:
+            key = "primary" if primary_keys == [column["name"]] else "foreign" if column["name"] in foreign_keys else None
+            summary += f" [{_format_column_profile(column_profile, key)}]"
+        summary += "\n"
+
+    if table_info["foreign_keys"]:
+        summary += "Foreign Keys:\n"
+        for fk in table_info["foreign_keys"]:
+            summary += f"  - {', '.join(fk['constrained_columns'])} -> {fk['referred_table']}.{', '.join(fk['referred_columns'])}\n"
+
+    if table_info["indexes"]:
+        summary += "Indexes:\n"
+        for idx in table_info["indexes"]:
+            summary += f"  - {idx['name']}: {', '.join(idx['column_names'])}"
+            if idx.get('unique'):
+                summary += " (UNIQUE)"
+            summary += "\n"
+
+    return summary
+
+
+def invalidate_schema_cache(engine: Engine = None):
+    """
+    Drops the cached schema for one engine, or for every engine when none is given.
+    """
+    with _schema_lock:
+        if engine is None:
+            _schema_cache.clear()
+        else:
+            _schema_cache.pop(engine.url.render_as_string(hide_password=False), None)
@@ -0,0 +1,113 @@
+from sqlalchemy.engine import Engine
+import os
+import re
+import threading
+from .schema import get_cached_schema, format_table_schema
+
+# Approximate prompt token budget for the schema section of the system message
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", "2000"))
+
+# Weight of a match on a table name relative to a match on one of its columns,
+# and the share of a table's score passed on to its foreign-key neighbours
+TABLE_NAME_WEIGHT = 3.0
+NEIGHBOR_WEIGHT = 0.5
+
+# Index cache keyed by db_uri: {db_uri: SchemaIndex}
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (about 4 characters per token) used for budgeting prompt sections.
+    """
+    return len(text) // 4 + 1
+
+
+def tokenize(text: str) -> set:
+    """
+    Splits identifiers and free text into lowercase terms, e.g. "InvoiceLine" -> {"invoice", "line"}.
+    Plural forms are folded to their singular so "customers" matches "Customer".
+    """
+    words = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    terms = set()
+    for word in re.findall(r"[a-z0-9]+", words.lower()):
+        terms.add(word)
+        if len(word) > 3 and word.endswith("ies"):
+            terms.add(word[:-3] + "y")
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            terms.add(word[:-1])
+    return terms
+
+
+class SchemaIndex:
+    """
+    Lexical index over table and column names of a cached schema, with foreign-key neighbourhoods.
+    """
+
+    def __init__(self, schema: dict, profiles: dict = None):
+        self.schema = schema
+        self.profiles = profiles
+        self.table_terms = {}
+        self.column_terms = {}
+        self.neighbors = {table: set() for table in schema}
+        self.rendered = {}
+        for table, table_info in schema.items():
+            self.table_terms[table] = tokenize(table)
+            self.column_terms[table] = set().union(*(tokenize(column["name"]) for column in table_info["columns"]))
+            self.rendered[table] = format_table_schema(table, table_info, (profiles or {}).get(table))
+            for fk in table_info["foreign_keys"]:
+                if fk["referred_table"] in self.neighbors and fk["referred_table"] != table:
+                    self.neighbors[table].add(fk["referred_table"])
+                    self.neighbors[fk["referred_table"]].add(table)
+
+    def rank_tables(self, question: str) -> list:
+        """
+        Returns tables relevant to the question, most relevant first.
+        """
+        terms = tokenize(question)
+        scores = {
+            table: TABLE_NAME_WEIGHT * len(terms & self.table_terms[table]) + len(terms & self.column_terms[table])
+            for table in self.schema
+        }
+        ranked = {}
+        for table, score in scores.items():
+            neighbor_score = max((scores[neighbor] for neighbor in self.neighbors[table]), default=0)
+            total = score + NEIGHBOR_WEIGHT * neighbor_score
+            if total > 0:
+                ranked[table] = total
+        return sorted(ranked, key=lambda table: (-ranked[table], table))
+
+    def select_tables(self, question: str, token_budget: int = None) -> list:
+        """
+        Picks the tables whose full schema is shown for a question, within the token budget.
+        Every table is selected when the whole schema fits.
+        """
+        token_budget = SCHEMA_TOKEN_BUDGET if token_budget is None else token_budget
+        if sum(estimate_tokens(text) for text in self.rendered.values()) <= token_budget:
+            return list(self.schema)
+
+        selected = []
+        used = 0
+        for table in self.rank_tables(question):
+            cost = estimate_tokens(self.rendered[table])
+            if used + cost > token_budget:
+                continue
+            selected.append(table)
+            used += cost
+        return selected
+
+
+def get_schema_index(engine: Engine, profiles: dict = None) -> SchemaIndex:
+    """
+    Returns the schema index for the engine's database, rebuilt only when the cached schema
+    or the column profiles rendered with it change.
+    """
+    schema = get_cached_schema(engine)
+    key = engine.url.render_as_string(hide_password=False)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is None or index.schema is not schema or index.profiles is not profiles:
+            index = SchemaIndex(schema, profiles)
+            _index_cache[key] = index
+    return index
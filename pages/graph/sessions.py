@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import os
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+# Durable session state: conversation checkpoints in SQLite, idle Python namespaces offloaded to disk
+SESSION_CHECKPOINTS_ENABLED = os.getenv("SESSION_CHECKPOINTS_ENABLED", "true").lower() in ("1", "true", "yes")
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR", os.path.join(tempfile.gettempdir(), "agent_sessions"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "900"))
+# How long a resume link stays valid; each link works once and is replaced by a new one when used
+SESSION_RESUME_TTL = float(os.getenv("SESSION_RESUME_TTL", str(7 * 24 * 3600)))
+# How often idle sessions are looked for
+SESSION_SWEEP_INTERVAL = 60
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+
+def session_dir_name(session_id: str) -> str:
+    """
+    A session id made safe to use as a directory name.
+    """
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id)
+
+
+def namespace_snapshot_dir(session_id: str) -> str:
+    """
+    Directory holding the offloaded Python variables of a session.
+    """
+    return os.path.join(SESSION_STORE_DIR, "namespaces", session_dir_name(session_id))
+
+
+def has_namespace_snapshot(session_id: str) -> bool:
+    return os.path.exists(os.path.join(namespace_snapshot_dir(session_id), "manifest.json"))
+
+
+def remove_namespace_snapshot(session_id: str):
+    shutil.rmtree(namespace_snapshot_dir(session_id), ignore_errors=True)
+
+
+def _resume_tokens():
+    os.makedirs(SESSION_STORE_DIR, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(SESSION_STORE_DIR, "resume_tokens.sqlite"))
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS resume_tokens (token_hash TEXT PRIMARY KEY, session_id TEXT NOT NULL, created_at REAL NOT NULL)"
+    )
+    return connection
+
+
+def _token_hash(token: str) -> str:
+    # Only hashes are stored, so the token file does not hand out working links
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_resume_token(session_id: str):
+    """
+    Returns a secret that resumes the session once, or None if sessions are not checkpointed.
+    Earlier tokens of the session stop working.
+    """
+    if not SESSION_CHECKPOINTS_ENABLED:
+        return None
+    token = secrets.token_urlsafe(32)
+    with closing(_resume_tokens()) as connection, connection:
+        connection.execute(
+            "DELETE FROM resume_tokens WHERE session_id = ? OR created_at < ?", (session_id, time.time() - SESSION_RESUME_TTL)
+        )
+        connection.execute("INSERT INTO resume_tokens VALUES (?, ?, ?)", (_token_hash(token), session_id, time.time()))
+    return token
+
+
+def redeem_resume_token(token: str):
+    """
+    Returns the session a resume token was issued for and invalidates the token, or None if it is
+    unknown, expired or was already used.
+    """
+    if not token or not SESSION_CHECKPOINTS_ENABLED:
+        return None
+    token_hash = _token_hash(token)
+    with closing(_resume_tokens()) as connection, connection:
+        row = connection.execute(
+            "SELECT session_id, created_at FROM resume_tokens WHERE token_hash = ?", (token_hash,)
+        ).fetchone()
+        # Only the first of two concurrent redemptions deletes the row
+        if row is None or connection.execute("DELETE FROM resume_tokens WHERE token_hash = ?", (token_hash,)).rowcount == 0:
+            return None
+    session_id, created_at = row
+    return session_id if time.time() - created_at <= SESSION_RESUME_TTL else None
+
+
+def get_checkpointer():
+    """
+    Returns the process-wide checkpointer that persists conversation state per thread id,
+    or None if checkpoints are disabled or langgraph-checkpoint-sqlite is not installed.
+    """
+    global _checkpointer
+    if not SESSION_CHECKPOINTS_ENABLED:
+        return None
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            try:
+                from langgraph.checkpoint.sqlite import SqliteSaver
+            except ImportError:
+                return None
+
+            class SessionCheckpointer(SqliteSaver):
+                """
+                SqliteSaver whose async methods run the sync ones in a worker thread,
+                so one checkpointer serves both invoke/stream and ainvoke/astream.
+                """
+
+                async def aget_tuple(self, config):
+                    return await asyncio.to_thread(self.get_tuple, config)
+
+                async def alist(self, config, *, filter=None, before=None, limit=None):
+                    checkpoints = await asyncio.to_thread(
+                        lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+                    )
+                    for checkpoint in checkpoints:
+                        yield checkpoint
+
+                async def aput(self, config, checkpoint, metadata, new_versions):
+                    return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+                async def aput_writes(self, config, writes, task_id, task_path=""):
+                    return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+                async def adelete_thread(self, thread_id):
+                    return await asyncio.to_thread(self.delete_thread, thread_id)
+
+            os.makedirs(SESSION_STORE_DIR, exist_ok=True)
+            # The saver serializes access with its own lock, so the connection can be shared across threads
+            connection = sqlite3.connect(os.path.join(SESSION_STORE_DIR, "checkpoints.sqlite"), check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            _checkpointer = SessionCheckpointer(connection)
+    return _checkpointer
@@ -0,0 +1,412 @@
+from contextlib import contextmanager
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+import json
+import os
+import re
+import threading
+from .sql_runner import ingest_result, read_sql, read_sql_streaming, SQL_MAX_ROWS
+
+# Pre-flight check of agent-generated SQL. The dialect's EXPLAIN gives an estimate of the rows examined
+# (or the planner cost) and the rows returned: queries over SQL_GUARD_MAX_COST are rejected with a hint,
+# and queries expected to return more than SQL_MAX_ROWS rows are limited ("limit") or rejected ("reject").
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_GUARD_ACTION = os.getenv("SQL_GUARD_ACTION", "limit")
+# Planner cost units on PostgreSQL, estimated rows examined on SQLite and MySQL
+SQL_GUARD_MAX_COST = float(os.getenv("SQL_GUARD_MAX_COST", "1e8"))
+# Seconds a statement may run before it is cancelled; 0 disables the timeout
+SQL_STATEMENT_TIMEOUT = float(os.getenv("SQL_STATEMENT_TIMEOUT", "60"))
+
+# Estimates used when SQLite has no statistics (no ANALYZE) for a table or index
+_DEFAULT_TABLE_ROWS = 1000
+_DEFAULT_ROWS_PER_KEY = 10
+# Plan lines included in estimates and hints
+_MAX_PLAN_LINES = 12
+
+_TABLE_REFERENCE = re.compile(
+    r"(?:\bFROM|\bJOIN|,)\s*([\w.\"`\[\]]+)(?:\s+(?:AS\s+)?(?!(?:FROM|ON|USING|WHERE|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL"
+    r"|GROUP|ORDER|LIMIT|UNION|EXCEPT|INTERSECT|HAVING|WINDOW)\b)(\w+))?",
+    re.IGNORECASE,
+)
+# Aggregates and grouping in the outermost query, matched after string literals and parenthesized
+# subqueries are blanked out; window functions (OVER) return a row per input row and do not count
+_AGGREGATE = re.compile(
+    r"\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(\)(?!\s*(?:FILTER\s*\(\)\s*)?OVER\b)", re.IGNORECASE
+)
+_GROUPING = re.compile(r"\bGROUP\s+BY\b|\bSELECT\s+DISTINCT\b", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+# Comments, matched together with quoted strings and identifiers so that "--" or "/*" inside them is left alone
+_COMMENT_OR_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|--[^\n]*|/\*.*?(?:\*/|$)", re.DOTALL)
+_TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+)(?:\s+OFFSET\s+\d+)?\s*;?\s*$", re.IGNORECASE)
+# Messages of the errors raised when a statement is cancelled by its timeout
+_TIMEOUT_ERRORS = ("interrupted", "statement timeout", "maximum statement execution time", "max_statement_time")
+
+
+class QueryRejected(Exception):
+    """
+    Raised when the cost guard rejects a query; verdict holds the estimate and a hint for the agent.
+    """
+
+    def __init__(self, verdict: dict):
+        super().__init__(verdict["hint"])
+        self.verdict = verdict
+
+
+def _unquote(name: str) -> str:
+    return name.split(".")[-1].strip('"`[]')
+
+
+def _sqlite_statistics(connection) -> tuple:
+    """
+    Table row counts and per-index average rows per key prefix from sqlite_stat1, when ANALYZE has been run.
+    """
+    tables, indexes = {}, {}
+    try:
+        rows = connection.execute(text("SELECT tbl, idx, stat FROM sqlite_stat1")).fetchall()
+    except DBAPIError:
+        return tables, indexes
+    for table, index, stat in rows:
+        numbers = [int(value) for value in str(stat).split() if value.isdigit()]
+        if numbers:
+            tables[table.lower()] = numbers[0]
+            if index:
+                indexes[index.lower()] = numbers
+    return tables, indexes
+
+
+def _estimate_sqlite(connection, sql_query: str) -> dict:
+    """
+    SQLite's EXPLAIN QUERY PLAN has no row estimates, so they are derived from the plan's loop structure:
+    each SCAN or SEARCH line is a nested loop over the ones before it, sized by table statistics
+    (sqlite_stat1, else MAX(rowid)) and, for index searches, the average rows per key.
+    """
+    plan = connection.execute(text("EXPLAIN QUERY PLAN " + sql_query)).fetchall()
+    children = {}
+    for node_id, parent, _, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    table_stats, index_stats = _sqlite_statistics(connection)
+    known_tables = {
+        name.lower(): name for (name,) in connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
+        ).fetchall()
+    }
+    aliases = {}
+    for table, alias in _TABLE_REFERENCE.findall(sql_query):
+        if _unquote(table).lower() in known_tables:
+            aliases[(alias or _unquote(table)).lower()] = known_tables[_unquote(table).lower()]
+    subquery_rows = {}
+    full_scans = []
+
+    def table_rows(name: str) -> float:
+        if name in subquery_rows:
+            return subquery_rows[name]
+        table = aliases.get(name.lower()) or known_tables.get(name.lower())
+        if table is None:
+            return _DEFAULT_TABLE_ROWS
+        if table.lower() not in table_stats:
+            try:
+                count = connection.execute(text(f'SELECT MAX(rowid) FROM "{table}"')).scalar()
+            except DBAPIError:
+                count = None
+            table_stats[table.lower()] = count if count is not None else _DEFAULT_TABLE_ROWS
+        return table_stats[table.lower()]
+
+    def search_rows(name: str, using: str) -> float:
+        constraint = using[using.find("("):] if "(" in using else ""
+        equalities = constraint.count("=?")
+        if "AUTOMATIC" in using:
+            rows = _DEFAULT_ROWS_PER_KEY
+        elif "PRIMARY KEY" in using and equalities:
+            rows = 1
+        else:
+            index = re.search(r"INDEX (\S+)", using)
+            per_key = index_stats.get(index.group(1).lower(), []) if index else []
+            if equalities and len(per_key) > equalities:
+                rows = per_key[equalities]
+            else:
+                rows = _DEFAULT_ROWS_PER_KEY if equalities else table_rows(name)
+        if ">" in constraint or "<" in constraint:
+            rows = max(rows / 4, 1)
+        return rows
+
+    def block(parent: int) -> tuple:
+        rows, examined = 1.0, 0.0
+        for node_id, detail in children.get(parent, []):
+            access = re.match(r"(SCAN|SEARCH) (\S+)(?: USING (.*))?", detail)
+            if access:
+                kind, name, using = access.groups()
+                if name == "CONSTANT":
+                    continue
+                if kind == "SCAN":
+                    factor = table_rows(name)
+                    if rows > 1:
+                        full_scans.append(aliases.get(name.lower(), name))
+                else:
+                    factor = search_rows(name, using or "")
+                    if "AUTOMATIC" in (using or ""):
+                        # Building the automatic index reads the whole table once
+                        examined += table_rows(name)
+                rows *= factor
+                examined += rows
+            elif detail.startswith("COMPOUND QUERY"):
+                results = [block(child_id) for child_id, _ in children.get(node_id, [])]
+                rows *= sum(result[0] for result in results)
+                examined += sum(result[1] for result in results)
+            elif re.match(r"(?:MATERIALIZE|CO-ROUTINE) ", detail):
+                sub_rows, sub_examined = block(node_id)
+                subquery_rows[detail.split(" ", 1)[1]] = sub_rows
+                examined += sub_examined
+            elif detail.startswith("CORRELATED"):
+                # Runs once per row of the loops around it
+                examined += block(node_id)[1] * rows
+            elif node_id in children:
+                examined += block(node_id)[1]
+        return rows, examined
+
+    rows, examined = block(0)
+    return {
+        "rows": rows,
+        "cost": examined,
+        "plan": [detail for _, _, _, detail in plan][:_MAX_PLAN_LINES],
+        "full_scans_in_joins": full_scans,
+    }
+
+
+def _estimate_postgresql(connection, sql_query: str) -> dict:
+    result = connection.execute(text("EXPLAIN (FORMAT JSON) " + sql_query)).scalar()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]["Plan"]
+    lines = []
+
+    def describe(node: dict, depth: int):
+        if len(lines) < _MAX_PLAN_LINES:
+            relation = f" on {node['Relation Name']}" if "Relation Name" in node else ""
+            lines.append(f"{'  ' * depth}{node['Node Type']}{relation} (rows={node['Plan Rows']}, cost={node['Total Cost']})")
+        for child in node.get("Plans", []):
+            describe(child, depth + 1)
+
+    describe(plan, 0)
+    full_scans = []
+    if plan.get("Node Type") == "Nested Loop":
+        full_scans = [child["Relation Name"] for child in plan.get("Plans", [])[1:] if child.get("Node Type") == "Seq Scan"]
+    return {"rows": plan["Plan Rows"], "cost": plan["Total Cost"], "plan": lines, "full_scans_in_joins": full_scans}
+
+
+def _estimate_mysql(connection, sql_query: str) -> dict:
+    plan = connection.execute(text("EXPLAIN " + sql_query)).mappings().fetchall()
+    rows, examined = 1.0, 0.0
+    full_scans = []
+    for line in plan:
+        line_rows = float(line.get("rows") or 1) * float(line.get("filtered") or 100) / 100
+        if str(line.get("id")) == "1":
+            if line.get("type") == "ALL" and rows > 1:
+                full_scans.append(line.get("table"))
+            rows *= line_rows
+            examined += rows
+        else:
+            examined += line_rows
+    return {
+        "rows": rows,
+        "cost": examined,
+        "plan": [f"{line.get('select_type')} {line.get('table')}: {line.get('type')} (rows={line.get('rows')})" for line in plan][:_MAX_PLAN_LINES],
+        "full_scans_in_joins": full_scans,
+    }
+
+
+_ESTIMATORS = {
+    "sqlite": _estimate_sqlite,
+    "postgresql": _estimate_postgresql,
+    "mysql": _estimate_mysql,
+    "mariadb": _estimate_mysql,
+}
+
+
+def _outer_query(sql_query: str) -> str:
+    """
+    The query with string literals emptied and everything inside parentheses removed, leaving the outermost
+    SELECT's clauses; e.g. "SELECT a, COUNT(*) FROM (SELECT ...) t" becomes "SELECT a, COUNT() FROM () t".
+    """
+    text = _STRING_LITERAL.sub("''", sql_query)
+    outer = []
+    depth = 0
+    for char in text:
+        if char == ")":
+            depth = max(depth - 1, 0)
+        if depth == 0:
+            outer.append(char)
+        if char == "(":
+            depth += 1
+    return "".join(outer)
+
+
+def _strip_comments(sql_query: str) -> str:
+    """
+    The query with its comments replaced by spaces, so it can be embedded in another statement.
+    """
+    return _COMMENT_OR_QUOTED.sub(
+        lambda match: " " if match.group().startswith(("--", "/*")) else match.group(), sql_query
+    )
+
+
+def _limit_query(connection, sql_query: str, max_rows: int) -> str:
+    """
+    Wraps a query in a derived table with a LIMIT, checked with EXPLAIN.
+
+    Returns:
+        str: the limited query, or None when the database cannot build the derived table
+        (e.g. duplicate column names from a join on MySQL)
+    """
+    limited = f"SELECT * FROM (\n{_strip_comments(sql_query).strip().rstrip(';')}\n) AS guarded_query LIMIT {max_rows}"
+    explain = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    try:
+        connection.execute(text(explain + limited)).fetchall()
+    except DBAPIError:
+        connection.rollback()
+        return None
+    return limited
+
+
+def estimate_query(connection, sql_query: str) -> dict:
+    """
+    Estimates a query's cost and result rows with the dialect's EXPLAIN.
+
+    Returns:
+        dict: dialect, rows (None when unknown), grouped (rows is only an upper bound), cost, plan lines and tables
+        fully scanned inside joins;
+        or None if the dialect is not supported or the query cannot be explained (its error then surfaces when it runs)
+    """
+    sql_query = sql_query.strip().rstrip(";")
+    estimator = _ESTIMATORS.get(connection.dialect.name)
+    if estimator is None:
+        return None
+    try:
+        estimate = estimator(connection, sql_query)
+    except DBAPIError:
+        # A failed statement aborts the transaction on some databases, so start the query from a clean one
+        connection.rollback()
+        return None
+    estimate["grouped"] = False
+    if connection.dialect.name != "postgresql":
+        outer_query = _outer_query(sql_query)
+        if _GROUPING.search(outer_query):
+            # The rows examined only bound the number of groups from above
+            estimate["grouped"] = True
+        elif _AGGREGATE.search(outer_query):
+            # An aggregate over the whole outer query returns a single row
+            estimate["rows"] = 1
+    limit = _TRAILING_LIMIT.search(sql_query)
+    if limit and estimate["rows"] is not None:
+        estimate["rows"] = min(estimate["rows"], int(limit.group(1)))
+    estimate["rows"] = None if estimate["rows"] is None else int(estimate["rows"])
+    estimate["cost"] = round(estimate["cost"], 1)
+    return {"dialect": connection.dialect.name, **estimate}
+
+
+def _rejection_hint(estimate: dict, reason: str) -> str:
+    hint = reason
+    if estimate["full_scans_in_joins"]:
+        hint += f" Tables scanned in full inside a join: {', '.join(estimate['full_scans_in_joins'])}; check the join conditions."
+    return hint + " Add filters on indexed columns, join on keys, aggregate in SQL or add a LIMIT, then try again."
+
+
+def check_query(connection, sql_query: str) -> tuple:
+    """
+    Decides whether a query runs as written, runs with a LIMIT or is rejected.
+
+    Returns:
+        tuple: (SQL to run, verdict dict with "action" ("run", "limit", "cap" or "reject"), "estimate" and, unless it runs,
+        "hint"; or None when there is no estimate). "cap" means the query could not be limited in SQL and its result is
+        cut off at SQL_MAX_ROWS rows while it is read.
+    """
+    estimate = estimate_query(connection, sql_query)
+    if estimate is None:
+        return sql_query, None
+    unit = "planner cost" if estimate["dialect"] == "postgresql" else "rows examined"
+    if estimate["cost"] > SQL_GUARD_MAX_COST:
+        reason = (f"Query rejected before running: the estimated {unit} ({estimate['cost']:,.0f}) "
+                  f"exceed the limit of {SQL_GUARD_MAX_COST:,.0f}.")
+        return sql_query, {"action": "reject", "estimate": estimate, "hint": _rejection_hint(estimate, reason)}
+    if estimate["rows"] is not None and estimate["rows"] > SQL_MAX_ROWS:
+        # Grouped queries are limited rather than rejected, since most return far fewer rows than estimated
+        if SQL_GUARD_ACTION == "reject" and not estimate["grouped"]:
+            reason = (f"Query rejected before running: it would return about {estimate['rows']:,} rows, "
+                      f"more than the {SQL_MAX_ROWS:,} row cap.")
+            return sql_query, {"action": "reject", "estimate": estimate, "hint": _rejection_hint(estimate, reason)}
+        # One row past the cap lets the reader report the result as truncated
+        limited = _limit_query(connection, sql_query, SQL_MAX_ROWS + 1)
+        if limited is None:
+            hint = f"Expected about {estimate['rows']:,} rows, so only the first {SQL_MAX_ROWS:,} rows were read."
+            return sql_query, {"action": "cap", "estimate": estimate, "hint": hint}
+        hint = f"Expected about {estimate['rows']:,} rows, so the query was run with LIMIT {SQL_MAX_ROWS:,}."
+        return limited, {"action": "limit", "estimate": estimate, "hint": hint}
+    return sql_query, {"action": "run", "estimate": estimate}
+
+
+@contextmanager
+def statement_timeout(connection, seconds: float = None):
+    """
+    Applies a statement timeout to the queries run on connection inside the block: statement_timeout on PostgreSQL,
+    max_execution_time on MySQL (max_statement_time on MariaDB), and an interrupt from a timer on SQLite.
+    """
+    seconds = SQL_STATEMENT_TIMEOUT if seconds is None else seconds
+    dialect = connection.dialect.name
+    timer = None
+    if seconds and dialect == "postgresql":
+        # Lasts until the transaction ends, i.e. when the connection goes back to the pool
+        connection.execute(text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+    elif seconds and dialect == "mysql":
+        connection.execute(text(f"SET SESSION max_execution_time = {int(seconds * 1000)}"))
+    elif seconds and dialect == "mariadb":
+        connection.execute(text(f"SET SESSION max_statement_time = {seconds}"))
+    elif seconds and dialect == "sqlite":
+        driver_connection = connection.connection.driver_connection
+        # aiosqlite wraps the sqlite3 connection; interrupt() may be called from any thread
+        sqlite_connection = getattr(driver_connection, "_conn", driver_connection)
+        timer = threading.Timer(seconds, sqlite_connection.interrupt)
+        timer.daemon = True
+        timer.start()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if seconds and dialect in ("mysql", "mariadb") and not connection.closed:
+            variable = "max_execution_time" if dialect == "mysql" else "max_statement_time"
+            try:
+                connection.execute(text(f"SET SESSION {variable} = 0"))
+            except DBAPIError:
+                pass
+
+
+def statement_timeout_error() -> TimeoutError:
+    return TimeoutError(
+        f"SQL query exceeded the {SQL_STATEMENT_TIMEOUT:g}s statement timeout and was cancelled. "
+        "Add filters, join on indexed keys or aggregate in SQL to make it cheaper."
+    )
+
+
+def guarded_read_sql(connection, sql_query: str):
+    """
+    Runs a query for make_sql_query behind the cost guard and the statement timeout.
+    Raises QueryRejected if the guard rejects it and TimeoutError if it is cancelled.
+
+    Returns:
+        tuple: (DataFrame, result_info as from read_sql, with "guard" when the query was limited or capped)
+    """
+    sql_to_run, verdict = check_query(connection, sql_query) if SQL_GUARD_ENABLED else (sql_query, None)
+    if verdict is not None and verdict["action"] == "reject":
+        raise QueryRejected(verdict)
+    try:
+        with statement_timeout(connection):
+            if verdict is not None and verdict["action"] == "cap":
+                # Streams the result even with SQL_STREAMING off, so the row cap applies while reading
+                df, result_info = ingest_result(*read_sql_streaming(connection, sql_to_run))
+            else:
+                df, result_info = read_sql(connection, sql_to_run)
+    except DBAPIError as e:
+        if any(message in str(e.orig).lower() for message in _TIMEOUT_ERRORS):
+            raise statement_timeout_error() from e
+        raise
+    if verdict is not None and verdict["action"] in ("limit", "cap"):
+        result_info["guard"] = verdict
+    return df, result_info
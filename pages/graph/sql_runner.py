@@ -0,0 +1,230 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from .dataframe_store import dataframe_nbytes
+
+# Streaming execution settings for make_sql_query
+SQL_STREAMING = os.getenv("SQL_STREAMING", "true").lower() in ("1", "true", "yes")
+SQL_CHUNK_SIZE = int(os.getenv("SQL_CHUNK_SIZE", "10000"))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "1000000"))
+SQL_MAX_BYTES = int(os.getenv("SQL_MAX_BYTES", str(512 * 1024 ** 2)))
+
+# Distinct values are tracked per column up to this many, then reported as a lower bound
+SUMMARY_MAX_DISTINCT = 1000
+
+# Compact dtypes for fetched results: low-cardinality text becomes categorical, integers are downcast
+# (to int32 at the smallest, so arithmetic on them does not easily overflow), floats become float32 when lossless
+# and ISO date text is parsed. With the "pyarrow" backend, other text and the converted numbers and dates
+# use Arrow-backed dtypes.
+SQL_COMPACT_DTYPES = os.getenv("SQL_COMPACT_DTYPES", "true").lower() in ("1", "true", "yes")
+SQL_DTYPE_BACKEND = os.getenv("SQL_DTYPE_BACKEND", "numpy")
+# Text columns with at most this ratio of distinct to non-null values are made categorical
+SQL_CATEGORY_MAX_RATIO = float(os.getenv("SQL_CATEGORY_MAX_RATIO", "0.5"))
+
+_ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+# Non-null values checked against _ISO_DATE before a whole column is parsed
+_DATE_SAMPLE_SIZE = 100
+
+
+def to_json_value(value):
+    """
+    Converts numpy/pandas scalars into plain JSON-serializable Python values.
+    """
+    if value is None or (not isinstance(value, (list, dict, str)) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class ColumnSummary:
+    """
+    Per-column statistics accumulated chunk by chunk: nulls, distinct values (capped), min, max and mean.
+    """
+
+    def __init__(self):
+        self.columns = {}
+
+    def update(self, chunk: pd.DataFrame):
+        for position, name in enumerate(chunk.columns):
+            series = chunk.iloc[:, position]
+            stats = self.columns.setdefault(str(name), {
+                "dtype": str(series.dtype), "count": 0, "nulls": 0, "distinct": set(),
+                "min": None, "max": None, "sum": 0.0,
+                "numeric": pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series),
+            })
+            values = series.dropna()
+            stats["count"] += len(series)
+            stats["nulls"] += len(series) - len(values)
+            if values.empty:
+                continue
+            try:
+                if len(stats["distinct"]) <= SUMMARY_MAX_DISTINCT:
+                    stats["distinct"].update(values.unique()[:SUMMARY_MAX_DISTINCT + 1].tolist())
+                chunk_min, chunk_max = values.min(), values.max()
+                stats["min"] = chunk_min if stats["min"] is None else min(stats["min"], chunk_min)
+                stats["max"] = chunk_max if stats["max"] is None else max(stats["max"], chunk_max)
+            except TypeError:
+                # Unhashable or mixed-type object values have no distinct count or ordering
+                continue
+            if stats["numeric"]:
+                stats["sum"] += float(values.sum())
+
+    def to_dict(self) -> dict:
+        summary = {}
+        for name, stats in self.columns.items():
+            non_null = stats["count"] - stats["nulls"]
+            distinct = len(stats["distinct"])
+            column = {
+                "dtype": stats["dtype"],
+                "nulls": stats["nulls"],
+                "distinct": f">{SUMMARY_MAX_DISTINCT}" if distinct > SUMMARY_MAX_DISTINCT else distinct,
+                "min": to_json_value(stats["min"]),
+                "max": to_json_value(stats["max"]),
+            }
+            if stats["numeric"]:
+                column["mean"] = stats["sum"] / non_null if non_null else None
+            summary[name] = column
+        return summary
+
+
+def _compact_text(series: pd.Series):
+    if pd.api.types.infer_dtype(series, skipna=True) != "string":
+        return None
+    values = series.dropna()
+    sample = values.iloc[:_DATE_SAMPLE_SIZE]
+    if sample.map(lambda value: bool(_ISO_DATE.match(value))).all():
+        parsed = pd.to_datetime(series, format="ISO8601", errors="coerce")
+        if parsed.notna().sum() == len(values):
+            return parsed
+    if values.nunique() <= SQL_CATEGORY_MAX_RATIO * len(values):
+        return series.astype("category")
+    if SQL_DTYPE_BACKEND == "pyarrow":
+        return series.astype("string[pyarrow]")
+    return None
+
+
+def _compact_numeric(series: pd.Series):
+    if pd.api.types.is_bool_dtype(series):
+        return None
+    if pd.api.types.is_integer_dtype(series) and series.dtype.itemsize > 4:
+        if series.empty or (series.min() >= np.iinfo(np.int32).min and series.max() <= np.iinfo(np.int32).max):
+            return series.astype(np.int32)
+        return None
+    if series.dtype == np.float64:
+        narrowed = series.astype(np.float32)
+        if np.array_equal(narrowed.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+            return narrowed
+    return None
+
+
+def compact_dtypes(df: pd.DataFrame):
+    """
+    Converts the columns of a fetched result to compact dtypes, keeping each conversion only if it saves memory.
+
+    Returns:
+        tuple: (DataFrame, dict with "bytes_before", "bytes_after" and "converted", the new dtype of each changed column)
+    """
+    bytes_before = dataframe_nbytes(df)
+    columns = {}
+    converted = {}
+    for position, name in enumerate(df.columns):
+        series = df.iloc[:, position]
+        if series.dtype == object:
+            compacted = _compact_text(series)
+        elif pd.api.types.is_numeric_dtype(series):
+            compacted = _compact_numeric(series)
+        else:
+            compacted = None
+        if compacted is not None and SQL_DTYPE_BACKEND == "pyarrow" and not isinstance(compacted.dtype, pd.CategoricalDtype):
+            compacted = compacted.convert_dtypes(dtype_backend="pyarrow")
+        if compacted is not None and (
+            pd.api.types.is_datetime64_any_dtype(compacted)
+            or compacted.memory_usage(index=False, deep=True) < series.memory_usage(index=False, deep=True)
+        ):
+            columns[position] = compacted
+            converted[str(name)] = str(compacted.dtype)
+    if columns:
+        df = df.copy(deep=False)
+        for position, compacted in columns.items():
+            df.isetitem(position, compacted)
+    return df, {"bytes_before": bytes_before, "bytes_after": dataframe_nbytes(df), "converted": converted}
+
+
+def ingest_result(df: pd.DataFrame, result_info: dict):
+    """
+    Applies compact_dtypes to a fetched result, updating the column summary's dtypes and nbytes.
+    """
+    if not SQL_COMPACT_DTYPES or df.empty:
+        return df, result_info
+    df, memory = compact_dtypes(df)
+    for name, dtype in memory["converted"].items():
+        if name in result_info["column_summary"]:
+            result_info["column_summary"][name]["dtype"] = dtype
+    result_info["nbytes"] = memory["bytes_after"]
+    result_info["memory"] = memory
+    return df, result_info
+
+
+def read_sql_streaming(connection, sql_query: str, chunk_size: int = None, max_rows: int = None, max_bytes: int = None):
+    """
+    Fetches a query result in chunks through a server-side cursor, stopping at the row or byte cap.
+
+    Returns:
+        tuple: (DataFrame with the fetched rows, dict with "column_summary", "truncated" and "nbytes")
+    """
+    chunk_size = SQL_CHUNK_SIZE if chunk_size is None else chunk_size
+    max_rows = SQL_MAX_ROWS if max_rows is None else max_rows
+    max_bytes = SQL_MAX_BYTES if max_bytes is None else max_bytes
+
+    summary = ColumnSummary()
+    chunks = []
+    rows = 0
+    nbytes = 0
+    truncated = None
+
+    streaming_connection = connection.execution_options(stream_results=True, max_row_buffer=chunk_size)
+    chunk_iterator = pd.read_sql_query(sql_query, streaming_connection, chunksize=chunk_size)
+    try:
+        for chunk in chunk_iterator:
+            if rows >= max_rows:
+                if len(chunk):
+                    truncated = "row"
+                break
+            if len(chunk) > max_rows - rows:
+                chunk = chunk.iloc[:max_rows - rows]
+                truncated = "row"
+            chunks.append(chunk)
+            summary.update(chunk)
+            rows += len(chunk)
+            nbytes += dataframe_nbytes(chunk)
+            if truncated:
+                break
+            if nbytes >= max_bytes:
+                truncated = "byte"
+                break
+    finally:
+        # Closing the generator releases the cursor without fetching the remaining rows
+        chunk_iterator.close()
+
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else (chunks[0] if chunks else pd.DataFrame())
+    return df, {"column_summary": summary.to_dict(), "truncated": truncated, "nbytes": nbytes}
+
+
+def read_sql(connection, sql_query: str):
+    """
+    Runs a query for make_sql_query, streaming it when SQL_STREAMING is enabled, and compacts the result's dtypes
+    when SQL_COMPACT_DTYPES is enabled.
+
+    Returns:
+        tuple: (DataFrame, dict with "column_summary", "truncated", "nbytes" and, if compacted, "memory")
+    """
+    if SQL_STREAMING:
+        return ingest_result(*read_sql_streaming(connection, sql_query))
+    df = pd.read_sql_query(sql_query, connection)
+    summary = ColumnSummary()
+    summary.update(df)
+    return ingest_result(df, {"column_summary": summary.to_dict(), "truncated": None, "nbytes": dataframe_nbytes(df)})
@@ -0,0 +1,54 @@
+import contextlib
+import os
+import threading
+import time
+
+# Warm the LLM client, the compiled graph and a standby Python worker in the background when the app starts
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+startup_timings = {}
+_timings_lock = threading.Lock()
+_module_loaded_at = time.time()
+
+
+def process_start_time() -> float:
+    """
+    Unix time at which this process started, read from /proc; falls back to when this module was imported.
+    """
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # The command name may contain spaces, so fields are counted from its closing parenthesis
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return _module_loaded_at
+
+
+@contextlib.contextmanager
+def timed_phase(name: str):
+    """
+    Records how long a one-off startup step took, e.g. importing the backend or creating the LLM client.
+    Only the first run of each phase is kept, so code that reruns (like a Streamlit page) reports its cold cost.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _timings_lock:
+            startup_timings.setdefault(name, round(time.perf_counter() - start, 4))
+
+
+def get_startup_report() -> dict:
+    """
+    Seconds spent in each recorded startup phase, and how long after the process started each report was taken.
+    """
+    started = process_start_time()
+    with _timings_lock:
+        phases = dict(startup_timings)
+    return {
+        "process_started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(started)),
+        "uptime_seconds": round(time.time() - started, 3),
+        "phases": phases,
+    }
@@ -1,10 +1,26 @@
 from typing import TypedDict, Annotated, Sequence, List
 from langchain_core.messages import BaseMessage
 from langgraph.graph import add_messages
-import operator
+from .compaction import trim_figure_ids, trim_intermediate_outputs
+
+
+def add_intermediate_outputs(left: List[dict], right: List[dict]) -> List[dict]:
+    """
+    Appends a step's intermediate outputs, keeping only the most recent INTERMEDIATE_OUTPUTS_MAX
+    so the checkpointed thread state does not grow with every step.
+    """
+    return trim_intermediate_outputs(left + right)
+
+
+def add_output_figure_ids(left: List[str], right: List[str]) -> List[str]:
+    """
+    Appends a step's figure ids, keeping only the most recent OUTPUT_FIGURE_IDS_MAX.
+    """
+    return trim_figure_ids(left + right)
+
 
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
-    intermediate_outputs: Annotated[List[dict], operator.add]
+    intermediate_outputs: Annotated[List[dict], add_intermediate_outputs]
     input_data: dict
-    output_image_paths: Annotated[List[str], operator.add]
\ No newline at end of file
+    output_figure_ids: Annotated[List[str], add_output_figure_ids]
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.prebuilt import ToolNode
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from .db_utils import POOL_SIZE
+from .tracing import collect_metrics
+
+# Upper bound on tool calls running at once across all sessions; defaults to the connection pool size
+TOOL_CALL_MAX_CONCURRENCY = int(os.getenv("TOOL_CALL_MAX_CONCURRENCY", str(POOL_SIZE)))
+
+# Tools that share per-session state and therefore run one after another, in call order
+SEQUENTIAL_TOOLS = ("complete_python_task",)
+
+_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_MAX_CONCURRENCY, thread_name_prefix="tool-call")
+
+tool_step_stats = {
+    "steps": 0,
+    "tool_calls": 0,
+    "tool_seconds": 0.0,
+    "wall_seconds": 0.0,
+    "saved_seconds": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+class ConcurrentToolNode(RunnableLambda):
+    """
+    Graph node that runs the independent tool calls of one agent step (SQL queries, schema lookups)
+    in parallel on a bounded thread pool, while Python tasks run in order on the calling thread,
+    each after the calls requested before it have finished.
+    Each call goes through ToolNode.invoke on its own, so tool lookup, state injection and error handling
+    are ToolNode's. Results are returned in the original tool-call order, each carrying its timing
+    and traced metrics in response_metadata.
+    Under ainvoke the same split is applied with asyncio tasks instead of threads.
+    """
+
+    def __init__(self, tools, *, sequential_tools=SEQUENTIAL_TOOLS, name="tools", messages_key="messages", **kwargs):
+        self.tool_node = ToolNode(tools, name=name, messages_key=messages_key, **kwargs)
+        self.messages_key = messages_key
+        self.sequential_tools = set(sequential_tools)
+        super().__init__(self._run, afunc=self._arun, name=name)
+
+    def _call_inputs(self, state: dict) -> list:
+        """
+        One input per tool call of the last message: the state with that message narrowed to the single call,
+        so tools that read the conversation still see all of it.
+        """
+        messages = state[self.messages_key]
+        last = messages[-1]
+        return [
+            (call, {**state, self.messages_key: [*messages[:-1], last.model_copy(update={"tool_calls": [call]})]})
+            for call in last.tool_calls
+        ]
+
+    def _combine(self, results: list) -> dict:
+        key = self.messages_key
+        return {key: [message for result in results for message in result[key]]}
+
+    def _run(self, state: dict, config) -> dict:
+        call_inputs = self._call_inputs(state)
+        results = [None] * len(call_inputs)
+        durations = [0.0] * len(call_inputs)
+        traces = [None] * len(call_inputs)
+
+        def run(index):
+            start = time.perf_counter()
+            with collect_metrics() as metrics:
+                results[index] = self.tool_node.invoke(call_inputs[index][1], config)
+            durations[index] = time.perf_counter() - start
+            traces[index] = metrics
+
+        step_start = time.perf_counter()
+        # Each call gets its own copy of the context so callbacks and tracing follow it into the pool
+        futures = {
+            index: _executor.submit(contextvars.copy_context().run, run, index)
+            for index, (call, _) in enumerate(call_inputs)
+            if call["name"] not in self.sequential_tools
+        }
+        for index, (call, _) in enumerate(call_inputs):
+            if call["name"] in self.sequential_tools:
+                # A Python task may use the results of the queries requested before it
+                for earlier in range(index):
+                    if earlier in futures:
+                        futures[earlier].result()
+                run(index)
+        for future in futures.values():
+            future.result()
+        wall_seconds = time.perf_counter() - step_start
+
+        output = self._combine(results)
+        self._record_step(output[self.messages_key], durations, wall_seconds, traces)
+        return output
+
+    async def _arun(self, state: dict, config) -> dict:
+        call_inputs = self._call_inputs(state)
+        results = [None] * len(call_inputs)
+        durations = [0.0] * len(call_inputs)
+        traces = [None] * len(call_inputs)
+        semaphore = asyncio.Semaphore(TOOL_CALL_MAX_CONCURRENCY)
+
+        async def run(index):
+            start = time.perf_counter()
+            with collect_metrics() as metrics:
+                results[index] = await self.tool_node.ainvoke(call_inputs[index][1], config)
+            durations[index] = time.perf_counter() - start
+            traces[index] = metrics
+
+        async def run_bounded(index):
+            async with semaphore:
+                await run(index)
+
+        step_start = time.perf_counter()
+        tasks = {
+            index: asyncio.ensure_future(run_bounded(index))
+            for index, (call, _) in enumerate(call_inputs)
+            if call["name"] not in self.sequential_tools
+        }
+
+        async def run_in_order():
+            for index, (call, _) in enumerate(call_inputs):
+                if call["name"] in self.sequential_tools:
+                    # A Python task may use the results of the queries requested before it
+                    earlier = [tasks[i] for i in range(index) if i in tasks]
+                    if earlier:
+                        await asyncio.wait(earlier)
+                    await run(index)
+
+        await asyncio.gather(run_in_order(), *tasks.values())
+        wall_seconds = time.perf_counter() - step_start
+
+        output = self._combine(results)
+        self._record_step(output[self.messages_key], durations, wall_seconds, traces)
+        return output
+
+    def _record_step(self, outputs: list, durations: list, wall_seconds: float, traces: list):
+        """
+        Attaches timing and the call's traced metrics (SQL rows and bytes, Python CPU time and memory)
+        to each ToolMessage and adds the step to the process-wide counters.
+        """
+        saved_seconds = max(sum(durations) - wall_seconds, 0.0)
+        for output, duration, trace in zip(outputs, durations, traces):
+            if isinstance(output, ToolMessage):
+                output.response_metadata["timing"] = {
+                    "duration_seconds": round(duration, 3),
+                    "step_wall_seconds": round(wall_seconds, 3),
+                    "step_saved_seconds": round(saved_seconds, 3),
+                }
+                if trace:
+                    output.response_metadata["trace"] = trace
+        with _stats_lock:
+            tool_step_stats["steps"] += 1
+            tool_step_stats["tool_calls"] += len(outputs)
+            tool_step_stats["tool_seconds"] += sum(durations)
+            tool_step_stats["wall_seconds"] += wall_seconds
+            tool_step_stats["saved_seconds"] += saved_seconds
+
+
+def get_tool_executor_stats() -> dict:
+    with _stats_lock:
+        return dict(tool_step_stats, max_concurrency=TOOL_CALL_MAX_CONCURRENCY)
@@ -1,34 +1,64 @@
 from langchain_core.tools import tool
-from typing import Tuple, Annotated
-from .state import AgentState
+from typing import Tuple, Annotated, List
 import pandas as pd
-from .db_utils import get_db_engine
-import uuid
+from .db_utils import get_db_connection, get_db_engine, get_async_db_engine, get_async_db_connection
+from .schema import get_cached_schema, format_table_schema
+from .column_profiles import get_column_profiles
+from .llm_cache import LLM_CACHE_DETERMINISTIC
+from .sql_runner import to_json_value, SQL_MAX_ROWS, SQL_MAX_BYTES
+from .sql_guard import guarded_read_sql, QueryRejected
+from .duckdb_replica import replica_read_sql
+from .result_cache import lookup_result, store_result
+from .python_executor import PYTHON_EXECUTION_BACKEND, run_python_task, serialize_figures, rss_bytes
+from .figure_registry import register_figure
+from .workspaces import get_workspace, enforce_quotas
+from .tracing import record_metrics
 from langgraph.prebuilt import InjectedState
-import plotly.graph_objects as go
-import plotly.io as pio
-import plotly.express as px
-import pandas as pd
-import sklearn
 import os
-import sys
+import contextlib
+import threading
 from io import StringIO
-import pickle
 import json
+import time
+import asyncio
+import hashlib
+from langchain_core.messages import ToolMessage
+
+# sys.stdout is process-wide, so in-process tasks of different threads take turns capturing it
+_stdout_lock = threading.Lock()
 
 
-dataframe_store = {}
-persistent_vars = {}
+def _run_python_in_process(session_id: str, python_code: str, dataframe_getter=None):
+    """
+    Executes code inside the server process, in the persistent namespace of the session's workspace.
+    Used when PYTHON_EXECUTION_BACKEND is "inprocess".
+
+    Returns:
+        tuple: (captured stdout, serialized figures, descriptions of variables written, CPU seconds, memory delta in bytes)
+    """
+    workspace = get_workspace(session_id)
+    # The lock keeps the namespace from being evicted while the code runs
+    with workspace.lock:
+        namespace = workspace.get_namespace()
+        namespace.globals["plotly_figures"] = []
+        if dataframe_getter is not None:
+            namespace.globals["get_dataframe"] = dataframe_getter
 
-code_to_save_plotly = """import pickle
-import uuid
-import plotly
+        # Capture stdout into a buffer of this call only
+        stdout = StringIO()
+
+        # CPU time of this thread only; the memory delta is the whole server process's
+        with _stdout_lock, contextlib.redirect_stdout(stdout):
+            cpu_start, rss_start = time.thread_time(), rss_bytes(os.getpid())
+            namespace.execute(python_code)
+            cpu_seconds, memory_delta = time.thread_time() - cpu_start, rss_bytes(os.getpid()) - rss_start
+        output = stdout.getvalue()
+
+        figure_jsons = serialize_figures(namespace.globals["plotly_figures"])
+        namespace.globals["plotly_figures"] = []
+
+        return output, figure_jsons, namespace.describe_changes(), cpu_seconds, memory_delta
 
-for figure in plotly_figures:
-    pickle_filename = f"images/plotly_figures/pickle/{uuid.uuid4()}.pickle"
-    with open(pickle_filename, 'wb') as f:
-        pickle.dump(figure, f)
-"""
 @tool(parse_docstring = True)
 def complete_python_task(
         graph_state: Annotated[dict, InjectedState],
@@ -42,47 +72,62 @@ def complete_python_task(
         thought: Internal thought about the next action to be taken, and the reasoning behind it. This should be formatted in MARKDOWN and be high quality.
         python_code: Python code to be executed to perform analyses, create a new dataset or create a visualization.
     """
-    if not os.path.exists("images/plotly_figures/pickle"):
-        os.makedirs("images/plotly_figures/pickle")
-    
-    current_image_pickle_files = os.listdir("images/plotly_figures/pickle")
-    
-    # Capture stdout
-    old_stdout = sys.stdout
-    sys.stdout = StringIO()
-
-    # Execute the code and capture the result
-    exec_globals = globals().copy()
-    exec_globals.update(persistent_vars)
-    exec_globals.update({"plotly_figures": []})
-
-    exec(python_code, exec_globals)
-    persistent_vars.update({k: v for k, v in exec_globals.items() if k not in globals()})
-
-    # Get the captured stdout
-    output = sys.stdout.getvalue()
-
-    # Restore stdout
-    sys.stdout = old_stdout
+    session_id = graph_state["input_data"].get("session_id", "default")
+    dataframe_getter = session_dataframe_getter(graph_state)
+    if PYTHON_EXECUTION_BACKEND == "inprocess":
+        output, figure_jsons, variables, cpu_seconds, memory_delta = _run_python_in_process(
+            session_id, python_code, dataframe_getter
+        )
+        record_metrics(python_tasks=1, python_cpu_seconds=cpu_seconds, python_memory_delta_bytes=memory_delta)
+        error_output = ""
+    else:
+        result = run_python_task(session_id, python_code, dataframe_getter)
+        record_metrics(
+            python_tasks=1,
+            python_cpu_seconds=result.get("cpu_seconds", 0.0),
+            python_memory_delta_bytes=result.get("memory_delta_bytes", 0),
+        )
+        if result["error"]:
+            error = result["error"]
+            if result["stdout"]:
+                error += f"\nOutput before the error:\n{result['stdout']}"
+            raise RuntimeError(error)
+        output, figure_jsons, error_output = result["stdout"], result["figure_jsons"], result["stderr"]
+        variables = result["variables"]
+    quota = enforce_quotas(session_id)
 
     message = {
         "thought": thought,
         "code": python_code,
         "output": output
     }
-
-    if 'plotly_figures' in exec_globals:
-        exec(code_to_save_plotly, exec_globals)
-        # Check if any images were created
-        new_image_folder_contents = os.listdir("images/plotly_figures/pickle")
-        new_image_files = [file for file in new_image_folder_contents if file not in current_image_pickle_files]
-        if new_image_files:
-            message["output_image_paths"] = new_image_files
-        
-        persistent_vars["plotly_figures"] = []
+    if error_output:
+        message["stderr"] = error_output
+    if variables:
+        message["variables"] = variables
+    if figure_jsons:
+        message["output_figure_ids"] = [register_figure(figure_json) for figure_json in figure_jsons]
+    if quota["over_quota_bytes"]:
+        message["memory_warning"] = (
+            f"This session's Python variables exceed its memory quota by {quota['over_quota_bytes'] / 1024 ** 2:.1f} MB. "
+            "Delete large variables that are no longer needed (del name) or work on smaller subsets of the data."
+        )
     
     return message
 
+async def acomplete_python_task(
+        graph_state: Annotated[dict, InjectedState],
+        thought: str,
+        python_code: str
+    ) -> Tuple[str, dict]:
+    """
+    Async implementation of complete_python_task. The task is CPU-bound, so it runs in a worker thread
+    that waits on the session's kernel worker (or executes in process) without blocking the event loop.
+    """
+    return await asyncio.to_thread(complete_python_task.func, graph_state, thought, python_code)
+
+complete_python_task.coroutine = acomplete_python_task
+
 @tool(parse_docstring = True)
 def make_sql_query(
     graph_state: Annotated[dict, InjectedState],
@@ -96,14 +141,99 @@ def make_sql_query(
         thought: Internal thought about the next action to be taken, and the reasoning behind it. This should be formatted in MARKDOWN and be high quality.
         sql_query: The SQL query to complete in order to retrieve data from the database.
     """
-    engine = get_db_engine(graph_state)
-    df = pd.read_sql_query(sql_query, engine)
-    # Store the DataFrame with a unique identifier
-    query_id = f"query_{hash(sql_query)}"
-    dataframe_store[query_id] = df
+    try:
+        df, result_info, cache_info = _execute_sql(graph_state, sql_query)
+    except QueryRejected as e:
+        return _rejected_query_message(thought, sql_query, e.verdict)
+    return _sql_query_message(graph_state, thought, sql_query, df, result_info, cache_info)
+
+def _execute_sql(graph_state: dict, sql_query: str):
+    """
+    Runs a query, or serves it from the result cache, and returns (df, result_info, cache_info).
+    Raises QueryRejected when the cost guard rejects the query.
+    """
+    db_uri = graph_state["input_data"].get("db_uri")
+    df, result_info, cache_info = lookup_result(db_uri, sql_query) if db_uri else (None, None, None)
+    if df is None:
+        start = time.perf_counter()
+        replica_result = replica_read_sql(get_db_engine(graph_state), sql_query)
+        if replica_result is not None:
+            df, result_info = replica_result
+        else:
+            with get_db_connection(graph_state) as connection:
+                df, result_info = guarded_read_sql(connection, sql_query)
+        store_result(db_uri, sql_query, df, result_info, time.perf_counter() - start)
+    _record_sql_metrics(df, result_info, cache_info)
+    return df, result_info, cache_info
+
+def _record_sql_metrics(df: pd.DataFrame, result_info: dict, cache_info):
+    if cache_info is not None and cache_info.get("hit"):
+        record_metrics(sql_queries=1, sql_cache_hits=1)
+    else:
+        record_metrics(sql_queries=1, sql_rows=len(df), sql_bytes=result_info.get("nbytes", 0))
+        if result_info.get("engine") == "duckdb":
+            record_metrics(sql_replica_queries=1)
+
+async def amake_sql_query(
+    graph_state: Annotated[dict, InjectedState],
+    thought: str,
+    sql_query: str
+) -> Tuple[str, dict]:
+    """
+    Async implementation of make_sql_query. Runs the query through the async engine, or in a worker thread
+    when no async driver is installed for the database.
+    """
+    engine = get_async_db_engine(graph_state)
+    if engine is None:
+        return await asyncio.to_thread(make_sql_query.func, graph_state, thought, sql_query)
+
+    db_uri = graph_state["input_data"].get("db_uri")
+    df, result_info, cache_info = await asyncio.to_thread(lookup_result, db_uri, sql_query)
+    if df is None:
+        start = time.perf_counter()
+        replica_result = await asyncio.to_thread(replica_read_sql, get_db_engine(graph_state), sql_query)
+        if replica_result is not None:
+            df, result_info = replica_result
+        else:
+            try:
+                async with get_async_db_connection(engine) as connection:
+                    df, result_info = await connection.run_sync(guarded_read_sql, sql_query)
+            except QueryRejected as e:
+                return _rejected_query_message(thought, sql_query, e.verdict)
+        await asyncio.to_thread(store_result, db_uri, sql_query, df, result_info, time.perf_counter() - start)
+    _record_sql_metrics(df, result_info, cache_info)
+    return _sql_query_message(graph_state, thought, sql_query, df, result_info, cache_info)
+
+make_sql_query.coroutine = amake_sql_query
+
+def _rejected_query_message(thought: str, sql_query: str, verdict: dict) -> dict:
+    """
+    Builds the tool output for a query the cost guard rejected, with the estimate and a hint to revise it.
+    """
+    record_metrics(sql_rejected=1)
+    return {
+        "thought": thought,
+        "query": sql_query,
+        "rejected": True,
+        "estimate": verdict["estimate"],
+        "message": verdict["hint"],
+    }
 
-    # Convert DataFrame to dict for JSON serialization
-    preview_dict = df.head(10).to_dict(orient="records")
+def _sql_query_message(graph_state: dict, thought: str, sql_query: str, df: pd.DataFrame, result_info: dict, cache_info) -> dict:
+    """
+    Stores a query result in the session's workspace for later Python tasks and builds the tool output describing it.
+    """
+    # Store the DataFrame under an identifier that is stable across processes and restarts
+    query_id = query_id_for(sql_query)
+    session_id = graph_state["input_data"].get("session_id", "default")
+    get_workspace(session_id).dataframes[query_id] = df
+    enforce_quotas(session_id)
+
+    # Convert DataFrame to dict for JSON serialization; dates and other non-JSON values become strings
+    preview_dict = [
+        {column: to_json_value(value) for column, value in row.items()}
+        for row in df.head(10).to_dict(orient="records")
+    ]
     
     message = {
         "thought": thought,
@@ -112,9 +242,95 @@ def make_sql_query(
         "row_count": len(df),
         "columns": list(df.columns),
         "preview": preview_dict,
+        "column_summary": result_info["column_summary"],
+        "truncated": result_info["truncated"] is not None,
         "message": "SQL query executed successfully."
     }
+    if cache_info is not None:
+        message["cache"] = cache_info
+    if "engine" in result_info:
+        message["engine"] = result_info["engine"]
+    if result_info.get("memory", {}).get("converted"):
+        message["memory"] = result_info["memory"]
+        if "category" in result_info["memory"]["converted"].values():
+            message["memory"]["note"] = "Categorical columns: pass observed=True to groupby to skip unused categories."
+    if "guard" in result_info:
+        message["guard"] = {"action": result_info["guard"]["action"], "estimate": result_info["guard"]["estimate"]}
+    if result_info["truncated"] == "row":
+        message["message"] = (
+            f"Result truncated to the first {len(df)} rows (row cap {SQL_MAX_ROWS}). "
+            "Refine the query with filters, aggregation or a LIMIT clause to get the complete result."
+        )
+    elif result_info["truncated"] == "byte":
+        message["message"] = (
+            f"Result truncated to the first {len(df)} rows (memory cap {SQL_MAX_BYTES} bytes). "
+            "Select fewer columns or aggregate in SQL to get the complete result."
+        )
+    return message
+
+@tool(parse_docstring = True)
+def describe_tables(
+    graph_state: Annotated[dict, InjectedState],
+    thought: str,
+    table_names: List[str]
+) -> Tuple[str, dict]:
+    """
+    Get the full schema (columns with statistics, foreign keys and indexes) of database tables that are not described in the system message.
+
+    Args:
+        thought: Internal thought about the next action to be taken, and the reasoning behind it. This should be formatted in MARKDOWN and be high quality.
+        table_names: Names of the tables to describe.
+    """
+    engine = get_db_engine(graph_state)
+    schema = get_cached_schema(engine)
+    profiles = get_column_profiles(engine, wait=LLM_CACHE_DETERMINISTIC) or {}
+    tables_by_name = {table.lower(): table for table in schema}
+
+    described = []
+    missing = []
+    for name in table_names:
+        table = tables_by_name.get(name.lower())
+        if table is None:
+            missing.append(name)
+        else:
+            described.append(format_table_schema(table, schema[table], profiles.get(table)))
+
+    message = {
+        "thought": thought,
+        "tables": table_names,
+        "schema": "\n".join(described),
+        "message": "Tables described successfully."
+    }
+    if missing:
+        message["message"] = f"Unknown tables: {', '.join(missing)}. Available tables: {', '.join(schema)}"
     return message
 
-def get_dataframe(query_id: str) -> pd.DataFrame:
-    return dataframe_store[query_id]
\ No newline at end of file
+def query_id_for(sql_query: str) -> str:
+    return "query_" + hashlib.sha1(sql_query.encode("utf-8")).hexdigest()[:16]
+
+def session_dataframe_getter(graph_state: dict):
+    """
+    Returns a get_dataframe for one session, reading from the session's workspace. If a result is no longer
+    stored, e.g. after a restart, it is rebuilt by re-running the query recorded in the session's tool messages,
+    usually from the result cache.
+    """
+    dataframes = get_workspace(graph_state["input_data"].get("session_id", "default")).dataframes
+
+    def get_session_dataframe(query_id: str) -> pd.DataFrame:
+        try:
+            return dataframes[query_id]
+        except KeyError:
+            pass
+        for message in reversed(graph_state.get("messages", [])):
+            if isinstance(message, ToolMessage) and message.name == "make_sql_query":
+                try:
+                    output = json.loads(message.content)
+                except (json.JSONDecodeError, TypeError):
+                    continue
+                if output.get("query_id") == query_id:
+                    df, _, _ = _execute_sql(graph_state, output["query"])
+                    dataframes[query_id] = df
+                    return df
+        raise KeyError(query_id)
+
+    return get_session_dataframe
\ No newline at end of file
@@ -0,0 +1,251 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import Runnable, RunnableLambda
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from .startup import get_startup_report
+
+# Per-node tracing of the agent graph. Spans are kept in memory for the Agent Actions tab, optionally
+# appended to a JSON lines file, and summarized as Prometheus metrics on TRACE_METRICS_PORT (0 disables it).
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")
+TRACE_METRICS_PORT = int(os.getenv("TRACE_METRICS_PORT", "0"))
+# Interface the metrics server listens on; traces include questions and SQL, so only local clients by default
+TRACE_METRICS_HOST = os.getenv("TRACE_METRICS_HOST", "127.0.0.1")
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "10000"))
+
+# Upper bounds in seconds of the node duration histogram buckets
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Metrics recorded inside a node, with the help text of their Prometheus counters
+METRIC_HELP = {
+    "llm_calls": "Model calls",
+    "prompt_tokens": "Prompt tokens sent to the model",
+    "completion_tokens": "Completion tokens generated by the model",
+    "sql_queries": "SQL queries run or served from the result cache",
+    "sql_cache_hits": "SQL queries served from the result cache",
+    "sql_rows": "Rows fetched from the database",
+    "sql_bytes": "Bytes of DataFrame memory fetched from the database",
+    "sql_rejected": "SQL queries rejected by the cost guard",
+    "sql_replica_queries": "SQL queries run on the DuckDB replica",
+    "python_tasks": "Python tasks executed",
+    "python_cpu_seconds": "CPU time of Python tasks",
+    "python_memory_growth_bytes": "Resident memory growth of Python tasks (increases only)",
+}
+
+_spans = deque(maxlen=TRACE_MAX_SPANS)
+_node_totals = {}
+_lock = threading.Lock()
+_current_metrics = contextvars.ContextVar("trace_metrics", default=())
+_metrics_server = None
+
+
+def record_metrics(**values):
+    """
+    Adds values to the metrics of the node span and tool call being traced in this context, if any.
+    """
+    targets = _current_metrics.get()
+    if not targets:
+        return
+    with _lock:
+        for metrics in targets:
+            for key, value in values.items():
+                metrics[key] = metrics.get(key, 0) + value
+
+
+def record_llm_usage(message):
+    """
+    Records a model call and its token usage, when the provider reports it.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    record_metrics(
+        llm_calls=1,
+        prompt_tokens=usage.get("input_tokens", 0),
+        completion_tokens=usage.get("output_tokens", 0),
+    )
+
+
+@contextlib.contextmanager
+def collect_metrics():
+    """
+    Collects the metrics recorded inside the block into the yielded dict, as well as into any enclosing span.
+    """
+    metrics = {}
+    token = _current_metrics.set(_current_metrics.get() + (metrics,))
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def _record_span(span: dict):
+    with _lock:
+        _spans.append(span)
+        totals = _node_totals.setdefault(span["node"], {
+            "count": 0, "errors": 0, "duration_sum": 0.0, "buckets": [0] * len(DURATION_BUCKETS), "metrics": {},
+        })
+        totals["count"] += 1
+        totals["errors"] += "error" in span
+        totals["duration_sum"] += span["duration_seconds"]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if span["duration_seconds"] <= bound:
+                totals["buckets"][i] += 1
+        for key, value in span["metrics"].items():
+            if key == "python_memory_delta_bytes":
+                key, value = "python_memory_growth_bytes", max(value, 0)
+            totals["metrics"][key] = totals["metrics"].get(key, 0) + value
+        if TRACE_LOG_PATH:
+            with open(TRACE_LOG_PATH, "a") as f:
+                f.write(json.dumps(span, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def node_span(node: str, state: dict, config: dict = None):
+    """
+    Traces one run of a graph node: its wall time and the metrics recorded while it runs.
+    """
+    if not TRACE_ENABLED:
+        yield None
+        return
+    span = {
+        "node": node,
+        "session_id": (state.get("input_data") or {}).get("session_id"),
+        # Turns are numbered by the user messages in the conversation so far
+        "turn": sum(isinstance(message, HumanMessage) for message in state.get("messages", [])),
+        "step": ((config or {}).get("metadata") or {}).get("langgraph_step"),
+        "start": time.time(),
+    }
+    start = time.perf_counter()
+    with collect_metrics() as metrics:
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = type(e).__name__
+            raise
+        finally:
+            span["duration_seconds"] = round(time.perf_counter() - start, 6)
+            span["metrics"] = {key: round(value, 6) if isinstance(value, float) else value for key, value in metrics.items()}
+            _record_span(span)
+
+
+def traced_node(name: str, node):
+    """
+    Wraps a graph node, sync and async, so each of its runs is recorded as a span.
+    """
+    node = node if isinstance(node, Runnable) else RunnableLambda(node)
+
+    def run(state, config):
+        with node_span(name, state, config):
+            return node.invoke(state, config)
+
+    async def arun(state, config):
+        with node_span(name, state, config):
+            return await node.ainvoke(state, config)
+
+    return RunnableLambda(run, afunc=arun, name=name)
+
+
+def get_spans(session_id: str = None, limit: int = None) -> list:
+    """
+    Returns the recorded spans, oldest first, optionally for one session and only the most recent limit.
+    """
+    with _lock:
+        spans = [span for span in _spans if session_id is None or span["session_id"] == session_id]
+    return spans[-limit:] if limit else spans
+
+
+def export_jsonl(spans: list = None) -> str:
+    """
+    Serializes spans (all recorded spans by default) as JSON lines.
+    """
+    spans = get_spans() if spans is None else spans
+    return "".join(json.dumps(span, default=str) + "\n" for span in spans)
+
+
+def render_prometheus() -> str:
+    """
+    Renders per-node totals in the Prometheus text exposition format.
+    """
+    with _lock:
+        totals = {node: {**values, "metrics": dict(values["metrics"])} for node, values in _node_totals.items()}
+
+    lines = [
+        "# HELP agent_node_duration_seconds Wall time of agent graph nodes.",
+        "# TYPE agent_node_duration_seconds histogram",
+    ]
+    for node, values in sorted(totals.items()):
+        for bound, count in zip(DURATION_BUCKETS, values["buckets"]):
+            lines.append(f'agent_node_duration_seconds_bucket{{node="{node}",le="{bound}"}} {count}')
+        lines.append(f'agent_node_duration_seconds_bucket{{node="{node}",le="+Inf"}} {values["count"]}')
+        lines.append(f'agent_node_duration_seconds_sum{{node="{node}"}} {values["duration_sum"]}')
+        lines.append(f'agent_node_duration_seconds_count{{node="{node}"}} {values["count"]}')
+
+    lines += ["# HELP agent_node_errors_total Graph node runs that raised.", "# TYPE agent_node_errors_total counter"]
+    lines += [f'agent_node_errors_total{{node="{node}"}} {values["errors"]}' for node, values in sorted(totals.items())]
+
+    for key, help_text in METRIC_HELP.items():
+        lines += [f"# HELP agent_{key}_total {help_text}.", f"# TYPE agent_{key}_total counter"]
+        lines += [
+            f'agent_{key}_total{{node="{node}"}} {values["metrics"][key]}'
+            for node, values in sorted(totals.items()) if key in values["metrics"]
+        ]
+
+    lines += [
+        "# HELP agent_startup_phase_seconds Seconds spent in each startup phase of this process.",
+        "# TYPE agent_startup_phase_seconds gauge",
+    ]
+    lines += [
+        f'agent_startup_phase_seconds{{phase="{phase}"}} {seconds}'
+        for phase, seconds in sorted(get_startup_report()["phases"].items())
+    ]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            body, content_type = render_prometheus(), "text/plain; version=0.0.4"
+        elif url.path == "/traces":
+            session_id = parse_qs(url.query).get("session_id", [None])[0]
+            body, content_type = export_jsonl(get_spans(session_id)), "application/x-ndjson"
+        elif url.path == "/startup":
+            body, content_type = json.dumps(get_startup_report()), "application/json"
+        else:
+            self.send_error(404)
+            return
+        payload = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = None):
+    """
+    Serves /metrics (Prometheus text), /traces (JSON lines, optionally ?session_id=) and /startup (JSON) on port
+    of TRACE_METRICS_HOST from a daemon thread. Does nothing if the port is 0 or a server is already running.
+    """
+    global _metrics_server
+    port = TRACE_METRICS_PORT if port is None else port
+    with _lock:
+        if not port or _metrics_server is not None:
+            return _metrics_server
+        try:
+            _metrics_server = ThreadingHTTPServer((TRACE_METRICS_HOST, port), _MetricsHandler)
+        except OSError:
+            # Another process, e.g. a second server worker, already serves this port
+            return None
+        _metrics_server.daemon_threads = True
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True, name="trace-metrics").start()
+    return _metrics_server
@@ -0,0 +1,181 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+from .dataframe_store import DataFrameStore, DATAFRAME_SPILL_DIR
+from .namespace import SessionNamespace
+from .python_executor import PYTHON_EXECUTION_BACKEND, base_namespace, offload_session_worker, session_variables_bytes
+from .sessions import (
+    SESSION_IDLE_TIMEOUT, session_dir_name, namespace_snapshot_dir, has_namespace_snapshot, remove_namespace_snapshot,
+)
+
+# Memory quotas for session workspaces (stored query results plus Python variables). A session over its own quota
+# spills its older results to disk; when all workspaces together exceed the global quota, the least recently
+# active sessions are evicted: their results are spilled and their Python variables offloaded to disk.
+WORKSPACE_MAX_BYTES = int(os.getenv("WORKSPACE_MAX_BYTES", str(1024 ** 3)))
+WORKSPACES_MAX_BYTES = int(os.getenv("WORKSPACES_MAX_BYTES", str(4 * 1024 ** 3)))
+
+# Workspaces by session id, least recently active first
+_workspaces = OrderedDict()
+_lock = threading.Lock()
+_stats = {"quota_spilled_bytes": 0, "evictions": 0}
+
+
+class Workspace:
+    """
+    One session's stored query results and, for the in-process backend, its Python namespace,
+    with accounting of the bytes each holds in memory.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.dataframes = DataFrameStore(
+            max_bytes=WORKSPACE_MAX_BYTES, spill_dir=os.path.join(DATAFRAME_SPILL_DIR, session_dir_name(session_id))
+        )
+        self.namespace = None
+        # Held while the session's code runs in process, so the namespace is not evicted mid-task
+        self.lock = threading.RLock()
+        self.last_active = time.monotonic()
+        self.evictions = 0
+
+    def get_namespace(self) -> SessionNamespace:
+        """
+        Returns the in-process namespace, creating it (from the offloaded snapshot, if any) on first use.
+        """
+        if self.namespace is None:
+            self.namespace = SessionNamespace(base_namespace(self.dataframes.__getitem__))
+            if has_namespace_snapshot(self.session_id):
+                self.namespace.restore(namespace_snapshot_dir(self.session_id))
+                remove_namespace_snapshot(self.session_id)
+        return self.namespace
+
+    def namespace_bytes(self) -> int:
+        """
+        Approximate memory held by the session's Python variables, in process or in its worker.
+        """
+        if PYTHON_EXECUTION_BACKEND == "inprocess":
+            return self.namespace.nbytes() if self.namespace is not None else 0
+        return session_variables_bytes(self.session_id)
+
+    def resident_bytes(self) -> int:
+        return self.dataframes.resident_bytes() + self.namespace_bytes()
+
+    def usage(self) -> dict:
+        stats = self.dataframes.stats()
+        return {
+            "session_id": self.session_id,
+            "dataframes_resident_bytes": stats["bytes_resident"],
+            "dataframes_spilled_bytes": stats["bytes_spilled"],
+            "frames_resident": stats["frames_resident"],
+            "frames_spilled": stats["frames_spilled"],
+            "python_bytes": self.namespace_bytes(),
+            "resident_bytes": stats["bytes_resident"] + self.namespace_bytes(),
+            "max_bytes": WORKSPACE_MAX_BYTES,
+            "idle_seconds": round(time.monotonic() - self.last_active, 1),
+            "evictions": self.evictions,
+        }
+
+    def evict(self) -> bool:
+        """
+        Frees the workspace's memory: results are spilled to disk and Python variables saved and dropped,
+        to be restored on next use. Returns False if the session is running code in process.
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            self.dataframes.shrink(0)
+            if self.namespace is not None:
+                self.namespace.save(namespace_snapshot_dir(self.session_id))
+                self.namespace = None
+            offload_session_worker(self.session_id)
+            self.evictions += 1
+            return True
+        finally:
+            self.lock.release()
+
+
+def get_workspace(session_id: str) -> Workspace:
+    """
+    Returns the session's workspace, creating it on first use, and marks the session as active.
+    """
+    with _lock:
+        workspace = _workspaces.get(session_id)
+        if workspace is None:
+            workspace = _workspaces[session_id] = Workspace(session_id)
+        _workspaces.move_to_end(session_id)
+        workspace.last_active = time.monotonic()
+    return workspace
+
+
+def enforce_quotas(session_id: str) -> dict:
+    """
+    Applies the quotas after a session stored results or ran code. The session's own older results
+    are spilled until it fits WORKSPACE_MAX_BYTES, then other sessions are evicted, least recently active
+    first, until all fit WORKSPACES_MAX_BYTES.
+
+    Returns:
+        dict: bytes spilled from the session, sessions evicted, and how far the session still exceeds
+        its quota (non-zero when its Python variables alone are over it)
+    """
+    workspace = get_workspace(session_id)
+    over = workspace.resident_bytes() - WORKSPACE_MAX_BYTES
+    spilled = workspace.dataframes.shrink(max(workspace.dataframes.resident_bytes() - over, 0)) if over > 0 else 0
+
+    with _lock:
+        others = [other for other in _workspaces.values() if other is not workspace]
+    sizes = {other.session_id: other.resident_bytes() for other in others}
+    total = workspace.resident_bytes() + sum(sizes.values())
+    evicted = []
+    for other in others:
+        if total <= WORKSPACES_MAX_BYTES:
+            break
+        if sizes[other.session_id] and other.evict():
+            total -= sizes[other.session_id]
+            evicted.append(other.session_id)
+
+    with _lock:
+        _stats["quota_spilled_bytes"] += spilled
+        _stats["evictions"] += len(evicted)
+    return {
+        "spilled_bytes": spilled,
+        "evicted_sessions": evicted,
+        "over_quota_bytes": max(workspace.resident_bytes() - WORKSPACE_MAX_BYTES, 0),
+    }
+
+
+def offload_idle_workspaces(max_idle: float = None) -> int:
+    """
+    Evicts the workspaces of sessions idle for more than max_idle seconds. Returns the number evicted.
+    """
+    max_idle = SESSION_IDLE_TIMEOUT if max_idle is None else max_idle
+    now = time.monotonic()
+    with _lock:
+        idle = [workspace for workspace in _workspaces.values() if now - workspace.last_active > max_idle]
+    return sum(workspace.resident_bytes() > 0 and workspace.evict() for workspace in idle)
+
+
+def get_workspace_usage(session_id: str) -> dict:
+    """
+    Memory used by one session's workspace, or None if it has none yet.
+    """
+    with _lock:
+        workspace = _workspaces.get(session_id)
+    return workspace.usage() if workspace is not None else None
+
+
+def get_workspace_stats() -> dict:
+    """
+    Memory used by all workspaces against the global quota.
+    """
+    with _lock:
+        workspaces = list(_workspaces.values())
+        stats = dict(_stats)
+    usages = [workspace.usage() for workspace in workspaces]
+    return {
+        **stats,
+        "sessions": len(usages),
+        "resident_bytes": sum(usage["resident_bytes"] for usage in usages),
+        "spilled_bytes": sum(usage["dataframes_spilled_bytes"] for usage in usages),
+        "max_bytes": WORKSPACES_MAX_BYTES,
+        "session_max_bytes": WORKSPACE_MAX_BYTES,
+    }
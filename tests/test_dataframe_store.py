@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+import pytest
+from pages.graph.dataframe_store import DataFrameStore, dataframe_nbytes
+
+
+def frame(rows: int, value: int = 0) -> pd.DataFrame:
+    return pd.DataFrame({"id": range(rows), "value": [value] * rows, "name": [f"n{i}" for i in range(rows)]})
+
+
+@pytest.fixture
+def store(tmp_path):
+    budget = dataframe_nbytes(frame(100)) * 2 + 1
+    return DataFrameStore(max_bytes=budget, spill_dir=str(tmp_path))
+
+
+def test_least_recently_used_frame_spills_and_reloads(store, tmp_path):
+    store["a"], store["b"] = frame(100, 1), frame(100, 2)
+    store["a"]
+    store["c"] = frame(100, 3)
+    assert store.stats()["frames_spilled"] == 1
+    assert len(os.listdir(tmp_path)) == 1
+
+    pd.testing.assert_frame_equal(store["b"], frame(100, 2), check_index_type=True)
+    assert isinstance(store["b"].index, pd.RangeIndex)
+    stats = store.stats()
+    assert stats["spill_hits"] == 1 and stats["hits"] == 2
+    assert stats["frames_resident"] == 2
+    assert stats["bytes_resident"] <= store.max_bytes
+
+
+def test_frame_with_duplicate_columns_round_trips(store):
+    df = pd.DataFrame([[1, 2]], columns=["x", "x"])
+    store["dup"] = df
+    store.shrink(0)
+    pd.testing.assert_frame_equal(store["dup"], df)
+
+
+def test_oversized_frame_stays_on_disk(store, tmp_path):
+    store["small"] = frame(100)
+    store["large"] = frame(1000)
+    stats = store.stats()
+    # The small frame is not pushed out to make room for a frame that cannot fit anyway
+    assert stats["frames_resident"] == 1 and stats["evictions"] == 0
+    files = os.listdir(tmp_path)
+    for _ in range(3):
+        pd.testing.assert_frame_equal(store["large"], frame(1000))
+    assert os.listdir(tmp_path) == files
+    assert "small" in store._resident
+
+
+def test_overwrite_and_delete_remove_spill_files(store, tmp_path):
+    store["large"] = frame(1000)
+    store["large"] = frame(10)
+    assert os.listdir(tmp_path) == []
+    store.shrink(0)
+    del store["large"]
+    assert os.listdir(tmp_path) == [] and len(store) == 0
+    with pytest.raises(KeyError):
+        store["large"]
@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import create_engine, text
+from pages.graph import duckdb_replica
+
+pytest.importorskip("duckdb")
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(duckdb_replica, "DUCKDB_REPLICA_ENABLED", True)
+    monkeypatch.setattr(duckdb_replica, "DUCKDB_REPLICA_DIR", str(tmp_path / "replicas"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'source.db'}")
+    with engine.begin() as setup:
+        setup.execute(text("CREATE TABLE sale (id INTEGER PRIMARY KEY, region TEXT, amount INTEGER)"))
+        setup.execute(text("INSERT INTO sale VALUES (1, 'North', 7), (2, 'north', 3), (3, NULL, 5)"))
+    yield engine
+    with duckdb_replica._replicas_lock:
+        duckdb_replica._replicas.clear()
+    engine.dispose()
+
+
+def test_aggregate_runs_on_replica_and_records_bypassed_guard(engine):
+    df, result_info = duckdb_replica.replica_read_sql(engine, "SELECT region, SUM(amount) AS total FROM sale GROUP BY region ORDER BY region")
+    assert result_info["engine"] == "duckdb"
+    assert result_info["guard"]["action"] == "bypassed"
+    # SQLite sorts NULL first in ascending order
+    assert df["region"].tolist() == [None, "North", "north"]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM sale WHERE region LIKE 'north'",
+    "SELECT amount / 2 FROM sale",
+    "SELECT CAST(amount AS TEXT) FROM sale",
+    "SELECT region COLLATE NOCASE FROM sale",
+    "SELECT strftime('%Y', region) FROM sale",
+])
+def test_non_portable_queries_run_on_source(engine, sql):
+    assert duckdb_replica.replica_read_sql(engine, sql) is None
@@ -0,0 +1,41 @@
+import pytest
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration
+from pages.graph.llm_cache import DiskLLMCache, ReplayMissError, cache_key
+
+
+def prompt(answer_id: str, question: str = "How many invoices?") -> str:
+    return dumps([
+        HumanMessage(question, id="human-1"),
+        AIMessage("Let me check.", id=answer_id, response_metadata={"finish_reason": "stop", "run": answer_id}),
+    ])
+
+
+def test_key_ignores_message_ids_and_run_metadata():
+    assert cache_key(prompt("run-1"), "gpt") == cache_key(prompt("run-2"), "gpt")
+
+
+def test_key_depends_on_messages_and_model():
+    assert cache_key(prompt("run-1"), "gpt") != cache_key(prompt("run-1", "How many tracks?"), "gpt")
+    assert cache_key(prompt("run-1"), "gpt") != cache_key(prompt("run-1"), "gpt, temperature=1")
+
+
+def test_recorded_response_replays_for_another_run(tmp_path):
+    generations = [ChatGeneration(message=AIMessage("There are 412 invoices."))]
+    DiskLLMCache(mode="record", cache_dir=str(tmp_path)).update(prompt("run-1"), "gpt", generations)
+
+    replay = DiskLLMCache(mode="replay", cache_dir=str(tmp_path))
+    assert replay.lookup(prompt("run-2"), "gpt")[0].message.content == "There are 412 invoices."
+    with pytest.raises(ReplayMissError):
+        replay.lookup(prompt("run-2", "How many tracks?"), "gpt")
+
+
+def test_record_mode_never_reads_and_entries_are_evicted(tmp_path):
+    generations = [ChatGeneration(message=AIMessage("x" * 1000))]
+    cache = DiskLLMCache(mode="record", cache_dir=str(tmp_path))
+    cache.update(prompt("a", "first"), "gpt", generations)
+    assert cache.lookup(prompt("a", "first"), "gpt") is None
+    cache.max_bytes = next(tmp_path.iterdir()).stat().st_size * 3 // 2
+    cache.update(prompt("a", "second"), "gpt", generations)
+    assert len(list(tmp_path.iterdir())) == 1
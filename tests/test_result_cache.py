@@ -0,0 +1,72 @@
+import os
+import time
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+from pages.graph import result_cache
+
+
+@pytest.fixture
+def db_uri(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "SQL_CACHE_ENABLED", True)
+    monkeypatch.setattr(result_cache, "SQL_CACHE_DIR", str(tmp_path / "cache"))
+    result_cache.clear_result_cache()
+    uri = f"sqlite:///{tmp_path / 'data.db'}"
+    engine = create_engine(uri)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (x INTEGER)"))
+    engine.dispose()
+    yield uri
+    result_cache.clear_result_cache()
+
+
+def store(db_uri: str, sql: str, value: int = 1):
+    df = pd.DataFrame({"x": [value]})
+    result_cache.store_result(db_uri, sql, df, {"truncated": None, "nbytes": 8}, 0.5)
+
+
+def test_equivalent_queries_share_a_key():
+    assert result_cache.normalize_sql("SELECT  x\nFROM t -- note\nWHERE x = 01.50;") == result_cache.normalize_sql(
+        "select x from t where x = 1.5"
+    )
+    # 5/2 and 5/2.0 differ in SQL
+    assert result_cache.normalize_sql("SELECT 5/2") != result_cache.normalize_sql("SELECT 5/2.0")
+    assert result_cache.normalize_sql("SELECT 'A  b' FROM t") != result_cache.normalize_sql("SELECT 'a b' FROM t")
+
+
+def test_hit_from_memory_then_disk(db_uri):
+    store(db_uri, "SELECT x FROM t")
+    df, _, cache_info = result_cache.lookup_result(db_uri, "select x  from t;")
+    assert df["x"].tolist() == [1] and cache_info["hit"] and cache_info["tier"] == "memory"
+
+    result_cache.clear_result_cache()
+    df, _, cache_info = result_cache.lookup_result(db_uri, "SELECT x FROM t")
+    assert df["x"].tolist() == [1] and cache_info["tier"] == "disk"
+
+
+def test_write_to_sqlite_file_invalidates(db_uri):
+    store(db_uri, "SELECT x FROM t")
+    path = db_uri.removeprefix("sqlite:///")
+    # Guarantees a different mtime even on coarse filesystem clocks
+    time.sleep(0.01)
+    engine = create_engine(db_uri)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO t VALUES (2)"))
+    engine.dispose()
+    os.utime(path)
+    df, _, cache_info = result_cache.lookup_result(db_uri, "SELECT x FROM t")
+    assert df is None and not cache_info["hit"]
+
+
+def test_volatile_and_in_memory_queries_are_not_cached(db_uri):
+    store(db_uri, "SELECT random() FROM t")
+    assert result_cache.lookup_result(db_uri, "SELECT random() FROM t")[0] is None
+    assert result_cache._cache_key("sqlite://", "SELECT x FROM t") == (None, None)
+
+
+def test_server_entries_expire_after_ttl(db_uri, monkeypatch):
+    server_uri = "postgresql://user@localhost/db"
+    store(server_uri, "SELECT x FROM t")
+    assert result_cache.lookup_result(server_uri, "SELECT x FROM t")[0] is not None
+    monkeypatch.setattr(result_cache, "SQL_CACHE_TTL", -1)
+    assert result_cache.lookup_result(server_uri, "SELECT x FROM t")[0] is None
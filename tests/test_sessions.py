@@ -0,0 +1,70 @@
+import os
+import time
+import pytest
+from pages.graph import figure_registry, sessions
+from pages.graph.state import add_output_figure_ids
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(sessions, "SESSION_CHECKPOINTS_ENABLED", True)
+    return tmp_path
+
+
+def test_resume_token_is_consumed_on_first_use(store_dir):
+    token = sessions.issue_resume_token("session-a")
+    assert sessions.redeem_resume_token(token) == "session-a"
+    assert sessions.redeem_resume_token(token) is None
+
+
+def test_new_token_revokes_earlier_ones(store_dir):
+    first = sessions.issue_resume_token("session-a")
+    second = sessions.issue_resume_token("session-a")
+    assert sessions.redeem_resume_token(first) is None
+    assert sessions.redeem_resume_token(second) == "session-a"
+
+
+def test_expired_and_unknown_tokens_are_rejected(store_dir, monkeypatch):
+    token = sessions.issue_resume_token("session-a")
+    monkeypatch.setattr(sessions, "SESSION_RESUME_TTL", -1)
+    assert sessions.redeem_resume_token(token) is None
+    assert sessions.redeem_resume_token("not-a-token") is None
+    assert sessions.redeem_resume_token(None) is None
+
+
+@pytest.fixture
+def figure_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(figure_registry, "SESSION_CHECKPOINTS_ENABLED", True)
+    monkeypatch.setattr(figure_registry, "FIGURE_STORE_DIR", str(tmp_path / "figures"))
+    monkeypatch.setattr(figure_registry, "_figures", figure_registry.OrderedDict())
+    monkeypatch.setattr(figure_registry, "_registry_bytes", 0)
+    return tmp_path / "figures"
+
+
+def test_figure_files_are_evicted_with_their_memory_copies(figure_store, monkeypatch):
+    monkeypatch.setattr(figure_registry, "FIGURE_STORE_MAX_BYTES", 250)
+    figure_ids = []
+    for i in range(3):
+        figure_ids.append(figure_registry.register_figure("x" * 100))
+        # Distinct modification times order the files from least to most recently used
+        os.utime(figure_store / f"{figure_ids[-1]}.json", (time.time() - 10 + i, time.time() - 10 + i))
+    figure_registry._evict_files()
+    assert figure_registry.get_figure_json(figure_ids[0]) is None
+    assert figure_registry.get_figure_json(figure_ids[2]) == "x" * 100
+    assert sorted(os.listdir(figure_store)) == sorted(f"{figure_id}.json" for figure_id in figure_ids[1:])
+
+
+def test_figure_files_expire_by_age(figure_store, monkeypatch):
+    figure_id = figure_registry.register_figure("{}")
+    os.utime(figure_store / f"{figure_id}.json", (0, 0))
+    monkeypatch.setattr(figure_registry, "FIGURE_STORE_MAX_AGE", 3600)
+    figure_registry._evict_files()
+    assert figure_registry.get_figure_json(figure_id) is None
+
+
+def test_output_figure_ids_are_bounded(monkeypatch):
+    from pages.graph import compaction
+
+    monkeypatch.setattr(compaction, "OUTPUT_FIGURE_IDS_MAX", 3)
+    assert add_output_figure_ids(["a", "b"], ["c", "d"]) == ["b", "c", "d"]
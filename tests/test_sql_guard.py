@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import create_engine, text
+from pages.graph import sql_guard, sql_runner
+
+
+@pytest.fixture
+def connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(sql_guard, "SQL_MAX_ROWS", 10)
+    monkeypatch.setattr(sql_runner, "SQL_MAX_ROWS", 10)
+    engine = create_engine(f"sqlite:///{tmp_path / 'guard.db'}")
+    with engine.begin() as setup:
+        setup.execute(text("CREATE TABLE line (id INTEGER PRIMARY KEY, name TEXT)"))
+        setup.execute(text("INSERT INTO line (id, name) VALUES " + ", ".join(f"({i}, 'n{i}')" for i in range(1, 51))))
+    with engine.connect() as connection:
+        yield connection
+    engine.dispose()
+
+
+def test_strip_comments_keeps_quoted_text():
+    sql = "SELECT '--a', \"/*b*/\" FROM t -- trailing\nWHERE x = 1 /* block */"
+    assert sql_guard._strip_comments(sql) == "SELECT '--a', \"/*b*/\" FROM t  \nWHERE x = 1  "
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM line -- all lines",
+    "SELECT * FROM line /* all lines */;",
+    "SELECT * FROM line WHERE name <> '--' -- trailing\n;",
+])
+def test_limit_survives_comments(connection, sql):
+    df, result_info = sql_guard.guarded_read_sql(connection, sql)
+    assert result_info["guard"]["action"] == "limit"
+    assert len(df) == 10
+    assert result_info["truncated"] == "row"
+
+
+def test_limited_query_puts_closing_paren_on_its_own_line(connection):
+    limited = sql_guard._limit_query(connection, "SELECT * FROM line -- note", 11)
+    assert limited.endswith("\n) AS guarded_query LIMIT 11")
+    assert "note" not in limited
+
+
+def test_unwrappable_query_falls_back_to_row_cap(connection, monkeypatch):
+    monkeypatch.setattr(sql_guard, "_limit_query", lambda *args: None)
+    sql, verdict = sql_guard.check_query(connection, "SELECT * FROM line")
+    assert sql == "SELECT * FROM line"
+    assert verdict["action"] == "cap"
+    df, result_info = sql_guard.guarded_read_sql(connection, "SELECT * FROM line")
+    assert len(df) == 10
+    assert result_info["truncated"] == "row"
+    assert result_info["guard"]["action"] == "cap"
+
+
+def test_outer_aggregate_runs_as_written(connection):
+    sql, verdict = sql_guard.check_query(connection, "SELECT COUNT(*) FROM line")
+    assert sql == "SELECT COUNT(*) FROM line"
+    assert verdict["action"] == "run"
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from typing import Annotated
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+from langgraph.prebuilt import InjectedState
+from pages.graph.tool_executor import ConcurrentToolNode
+
+finished = []
+
+
+@tool
+def slow_query(label: str) -> str:
+    """Sleeps, then returns its label.
+
+    Args:
+        label: Returned text.
+    """
+    time.sleep(0.2)
+    finished.append(label)
+    return label
+
+
+@tool
+def complete_python_task(graph_state: Annotated[dict, InjectedState]) -> str:
+    """Reports the queries finished before it ran and the conversation it was given."""
+    return f"{','.join(sorted(finished))}|{len(graph_state['messages'])}"
+
+
+def step_state() -> dict:
+    calls = [
+        {"name": "slow_query", "args": {"label": "a"}, "id": "1"},
+        {"name": "slow_query", "args": {"label": "b"}, "id": "2"},
+        {"name": "complete_python_task", "args": {}, "id": "3"},
+    ]
+    return {"messages": [HumanMessage("question"), AIMessage("", tool_calls=calls)]}
+
+
+def check_output(output: dict, elapsed: float):
+    messages = output["messages"]
+    assert [message.tool_call_id for message in messages] == ["1", "2", "3"]
+    # The queries ran in parallel, and the Python task after both with the whole conversation
+    assert elapsed < 0.35
+    assert messages[2].content == "a,b|2"
+    assert messages[0].response_metadata["timing"]["duration_seconds"] >= 0.2
+
+
+def test_queries_run_in_parallel_before_python_task():
+    finished.clear()
+    start = time.perf_counter()
+    output = ConcurrentToolNode([slow_query, complete_python_task]).invoke(step_state())
+    check_output(output, time.perf_counter() - start)
+
+
+def test_async_path_keeps_the_same_order():
+    finished.clear()
+    start = time.perf_counter()
+    output = asyncio.run(ConcurrentToolNode([slow_query, complete_python_task]).ainvoke(step_state()))
+    check_output(output, time.perf_counter() - start)